@@ -19,11 +19,17 @@ For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
 from internal.models.sql import SQLDatabase
+from internal.models.prepared import PreparedQueries
+from internal.models.vector_index import TrackVectorIndex
+from internal.flight_recorder import FlightRecorder
+from internal.profiler import SamplingProfiler, LoopStallDetector
+from internal.retention import run_suggestions_retention
+from internal.usage import UpstreamUsage, run_usage_flush
+from internal.warmup import PipelineWarmup
 from pythonjsonlogger.json import JsonFormatter
 import internal.mq
+import internal.metrics
 from internal.conf import Config
-import logfire
-from pydantic_ai import Agent
 import signal
 import asyncio
 import aio_pika
@@ -39,9 +45,15 @@ async def main() -> int:
     logging.getLogger().handlers[0].setFormatter(formatter)
 
     stop_event = asyncio.Event()
+    # Set by a second signal, which cuts the drain short
+    force_stop_event = asyncio.Event()
 
     def handle_shutdown_signal():
-        logging.getLogger(__name__).info("Shutdown signal received...")
+        if stop_event.is_set():
+            logging.getLogger(__name__).info("Second shutdown signal received, stopping right away...")
+            force_stop_event.set()
+            return
+        logging.getLogger(__name__).info("Shutdown signal received, draining...")
         stop_event.set()
 
     # Register signal handlers for graceful shutdown
@@ -49,6 +61,19 @@ async def main() -> int:
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, handle_shutdown_signal)
 
+    # SIGUSR1 starts or stops the sampling profiler, SIGUSR2 dumps the
+    # flight recorder. Both write to PROFILE_DIR.
+    SamplingProfiler.attach()
+    FlightRecorder.capacity = conf.FLIGHT_RECORDER_SIZE
+    loop.add_signal_handler(
+        signal.SIGUSR1, SamplingProfiler.toggle,
+        conf.PROFILE_DIR, conf.PROFILE_MAX_SECONDS, conf.PROFILE_SAMPLE_INTERVAL)
+    loop.add_signal_handler(signal.SIGUSR2, FlightRecorder.dump, conf.PROFILE_DIR)
+
+    # The pipeline and Logfire are not needed to connect and start consuming,
+    # so they load in the background meanwhile.
+    PipelineWarmup.start(conf.LOGFIRE_TOKEN)
+
     try:
         # Connecting to PostgreSQL
         await SQLDatabase.get_connection()
@@ -65,17 +90,59 @@ async def main() -> int:
         await SQLDatabase.close()
         return -1
 
+    metrics_server = None
+    if conf.METRICS_PORT:
+        metrics_server = await internal.metrics.serve(conf.METRICS_HOST, conf.METRICS_PORT)
+
+    index_sync_task = None
+    if conf.VECTOR_INDEX_PATH:
+        # Only the snapshot is mapped here, the incremental synchronization
+        # happens in the background so that consumption can start right away.
+        TrackVectorIndex.open(conf.VECTOR_INDEX_PATH)
+        index_sync_task = asyncio.create_task(
+            TrackVectorIndex.run_sync_loop(conf.VECTOR_INDEX_SYNC_INTERVAL))
+
+    # Also creates the upcoming partitions, so it runs even without retention
+    retention_task = asyncio.create_task(run_suggestions_retention(
+        conf.SUGGESTIONS_MAINTENANCE_INTERVAL,
+        conf.SUGGESTIONS_RETENTION_DAYS or None,
+        not conf.SUGGESTIONS_RETENTION_DETACH_ONLY,
+    ))
+
+    usage_flush_task = None
+    if conf.USAGE_FLUSH_INTERVAL > 0:
+        UpstreamUsage.enabled = True
+        usage_flush_task = asyncio.create_task(run_usage_flush(conf.USAGE_FLUSH_INTERVAL))
+
+    pipeline = None
+    if conf.PIPELINE_ENGINE == "streaming":
+        # The stages are made of the pipeline's nodes, which are needed now
+        from internal.streaming import StreamingPipeline
+        pipeline = StreamingPipeline(
+            max_jobs=conf.STREAMING_MAX_JOBS,
+            queue_size=conf.STREAMING_QUEUE_SIZE,
+            workers=StreamingPipeline.parse_workers(conf.STREAMING_WORKERS),
+        )
+        pipeline.start()
+
+    stall_detector_task = None
+    if conf.LOOP_STALL_THRESHOLD > 0:
+        stall_detector_task = asyncio.create_task(LoopStallDetector.run(conf.LOOP_STALL_THRESHOLD))
+
     exit_code = 0
+    control_task = None
     try:
         logging.info("Acura is starting...")
-        logging.info("Logfire is initializing...")
-        logfire.configure(token=conf.LOGFIRE_TOKEN, service_name="acura")
-        Agent.instrument_all()  # used for pydanticai logging
 
-        # Start consuming messages and wait for the stop event
+        # Start consuming messages, which drains and returns once the stop
+        # event is set
         consume_tasks = asyncio.create_task(
-            internal.mq.start_consuming(mq))
-        await stop_event.wait()
+            internal.mq.start_consuming(mq, pipeline, stop_event))
+        control_task = asyncio.create_task(
+            internal.mq.consume_control_messages(mq))
+        force_stop = asyncio.create_task(force_stop_event.wait())
+        await asyncio.wait((consume_tasks, force_stop), return_when=asyncio.FIRST_COMPLETED)
+        force_stop.cancel()
         consume_tasks.cancel()
         try:
             await consume_tasks
@@ -86,8 +153,31 @@ async def main() -> int:
         exit_code = -1
     finally:
         logging.getLogger(__name__).info("Acura is shutting down...")
+        if control_task is not None:
+            control_task.cancel()
+        if stall_detector_task is not None:
+            stall_detector_task.cancel()
+            LoopStallDetector.stop()
+        retention_task.cancel()
+        SamplingProfiler.stop()
+        if pipeline is not None:
+            await pipeline.stop()
+        if usage_flush_task is not None:
+            usage_flush_task.cancel()
+            try:
+                await UpstreamUsage.flush()
+            except Exception as e:
+                logging.getLogger(__name__).error("Failed to flush the upstream usage: %s", e)
+        if FlightRecorder.slowest():
+            FlightRecorder.dump(conf.PROFILE_DIR)
+        if index_sync_task is not None:
+            index_sync_task.cancel()
+            TrackVectorIndex.flush()
+        if metrics_server is not None:
+            metrics_server.close()
         # Gracefully close the PostgreSQL connection
         await mq.close()
+        await PreparedQueries.close()
         await SQLDatabase.close()
 
     return exit_code
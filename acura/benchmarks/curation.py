@@ -0,0 +1,361 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+# Offline end-to-end benchmark of `curate()`.
+#
+# OpenAI, Spotify and Brave Search are replaced by local fakes (see
+# `benchmarks/fakes.py`), while PostgreSQL is real: point POSTGRES_URL at a
+# local, migrated database with pgvector (e.g. the one from
+# `docker/docker-compose.dev.yml`). Never run this against production, since
+# it creates and deletes subscribers and tracks.
+#
+#   python -m benchmarks.curation --branch both --messages 200 --concurrency 5
+#   python -m benchmarks.curation --baseline benchmarks/baseline.json
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+
+# The services read their credentials when they are imported, so the fake
+# values have to be in place before anything from `internal` is imported.
+for variable in ("OPENAI_API_KEY", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "BRAVE_SEARCH_TOKEN"):
+    os.environ.setdefault(variable, "bench")
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+from sqlalchemy import bindparam, event, text  # noqa: E402
+
+from benchmarks.fakes import EMBEDDING_DIMENSIONS, FakeUpstreams, UpstreamProfile  # noqa: E402
+from internal.chain import curate, GenerateSearchQueryNode, MatchQueryWithSpotifyPlaylist  # noqa: E402
+from internal.flight_recorder import FlightRecorder  # noqa: E402
+from internal.models.sql import SQLDatabase, EmbeddingVector  # noqa: E402
+from internal.services.brave_search import BraveSearchService  # noqa: E402
+from internal.services.embeddings import EmbeddingsService  # noqa: E402
+from internal.services.spotify import SpotifyService  # noqa: E402
+from internal.streaming import StreamingPipeline  # noqa: E402
+
+logger = logging.getLogger("benchmarks.curation")
+
+REUSE_QUERY = "bench reuse: warm acoustic coffee house"
+# Number of catalog tracks seeded around the reuse query. The router needs
+# at least 100 similar tracks before it reuses existing data.
+REUSE_CATALOG_SIZE = 150
+UPSTREAMS = ("spotify", "brave", "openai", "llm")
+
+
+@dataclass
+class BranchReport:
+    branch: str
+    messages: int
+    concurrency: int
+    engine: str
+    errors: int
+    wall_seconds: float
+    messages_per_second: float
+    latency_p50: float
+    latency_p90: float
+    latency_p99: float
+    latency_max: float
+    # Time until the message would have been acknowledged, i.e. until the
+    # first PUBLISH_ACK_AFTER_BATCHES batches of tracks were published
+    first_track_p50: float
+    first_track_p90: float
+    db_round_trips_per_message: float
+    upstream_requests_per_message: dict[str, float] = field(default_factory=dict)
+    rate_limited: dict[str, int] = field(default_factory=dict)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def _parse_per_upstream(spec: str | None, scale: float = 1.0) -> dict[str, float]:
+    """
+    Parse `spotify=80,brave=120` style arguments. A bare number applies to
+    every upstream.
+    """
+    if not spec:
+        return {}
+    if "=" not in spec:
+        return {upstream: float(spec) * scale for upstream in UPSTREAMS}
+
+    values = {}
+    for item in spec.split(","):
+        upstream, _, value = item.partition("=")
+        if upstream not in UPSTREAMS:
+            raise argparse.ArgumentTypeError(f"Unknown upstream `{upstream}`")
+        values[upstream] = float(value) * scale
+    return values
+
+
+def install_fakes(fakes: FakeUpstreams, prompt_queries: dict[str, str], stack: contextlib.ExitStack) -> None:
+    """
+    Point every upstream client of the pipeline at the fakes. The LLM
+    overrides stay active until `stack` is closed.
+    """
+    SpotifyService._client = httpx.AsyncClient(
+        base_url="https://api.spotify.com/", transport=fakes.transport("spotify"))
+    SpotifyService._bearer_token = None
+    BraveSearchService._client = httpx.AsyncClient(
+        base_url="https://api.search.brave.com", transport=fakes.transport("brave"))
+    EmbeddingsService._client = AsyncOpenAI(
+        api_key="bench", http_client=httpx.AsyncClient(transport=fakes.transport("openai")))
+
+    model = fakes.llm(lambda prompt: prompt_queries.get(prompt.strip(), prompt.strip()))
+    stack.enter_context(GenerateSearchQueryNode.query_gen_agent.override(model=model))
+    stack.enter_context(GenerateSearchQueryNode.batch_query_gen_agent.override(model=model))
+    stack.enter_context(MatchQueryWithSpotifyPlaylist.playlist_filter_agent.override(model=model))
+
+
+def count_round_trips(round_trips: Counter) -> None:
+    # Queries are attributed through the flight recorder, which also follows
+    # curations across the stages of the streaming pipeline.
+    def before_cursor_execute(*_):
+        if (recording := FlightRecorder.current()) is not None:
+            round_trips[recording.sid] += 1
+
+    engine = SQLDatabase._connection.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def seed_subscribers(run_id: str, branch: str, n: int) -> tuple[list[int], dict[str, str]]:
+    """
+    Create `n` subscribers whose prompts make the fake LLM generate either
+    the shared reuse query or a unique discovery query.
+    """
+    prompt_queries = {}
+    sids = []
+    async with SQLDatabase.connection() as pg:
+        for i in range(n):
+            r = await pg.execute(
+                text("INSERT INTO subscribers (note) VALUES (:note) RETURNING id"),
+                {"note": f"bench:{run_id}"},
+            )
+            sid = r.scalar_one()
+            prompt = f"bench {run_id} {branch} subscriber {i}"
+            await pg.execute(text("UPDATE prompts SET prompt = :prompt WHERE sid = :sid"), {"prompt": prompt, "sid": sid})
+            prompt_queries[prompt] = REUSE_QUERY if branch == "reuse" else f"bench {run_id} discovery {i}"
+            sids.append(sid)
+
+    return sids, prompt_queries
+
+
+async def seed_reuse_catalog(run_id: str, fakes: FakeUpstreams) -> None:
+    """
+    Seed tracks whose embeddings are close to the reuse query, so that the
+    router picks `ReuseExistingDataNode`.
+    """
+    center = fakes.embed(f"Search Query: {REUSE_QUERY}")
+    rng = np.random.default_rng(fakes.seed)
+    async with SQLDatabase.connection() as pg:
+        for i in range(REUSE_CATALOG_SIZE):
+            vector = center + rng.standard_normal(center.shape[0]).astype(np.float32) * 0.01
+            await pg.execute(
+                text("""
+                    INSERT INTO tracks (title, artist, duration, uri, search_embedding)
+                    VALUES (:title, :artist, 200000, :uri, :embedding)
+                """).bindparams(bindparam("embedding", type_=EmbeddingVector(EMBEDDING_DIMENSIONS))),
+                {
+                    "title": f"bench {run_id} catalog {i}",
+                    "artist": f"bench {run_id}",
+                    "uri": f"https://www.youtube.com/watch?v={run_id[:6]}{i:05d}",
+                    "embedding": vector,
+                },
+            )
+
+
+async def cleanup(run_id: str, track_prefix: str) -> None:
+    async with SQLDatabase.connection() as pg:
+        await pg.execute(text("DELETE FROM subscribers WHERE note = :note"), {"note": f"bench:{run_id}"})
+        await pg.execute(text("DELETE FROM tracks WHERE title LIKE :prefix"), {"prefix": f"{track_prefix}%"})
+
+
+async def run_branch(branch: str, args: argparse.Namespace, run_id: str, round_trips: Counter) -> BranchReport:
+    track_prefix = f"bench {run_id}"
+    fakes = FakeUpstreams(
+        profiles={
+            upstream: UpstreamProfile(
+                latency=args.latency.get(upstream, 0.0),
+                jitter=args.jitter.get(upstream, 0.0),
+                rate_limit_ratio=args.rate_limit.get(upstream, 0.0),
+            ) for upstream in UPSTREAMS
+        },
+        playlist_size=args.playlist_size,
+        track_prefix=track_prefix,
+        seed=args.seed,
+    )
+
+    sids, prompt_queries = await seed_subscribers(run_id, branch, args.messages)
+    if branch == "reuse":
+        await seed_reuse_catalog(run_id, fakes)
+
+    latencies: list[float] = []
+    first_track_latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    pipeline = None
+    if args.engine == "streaming":
+        pipeline = StreamingPipeline(
+            max_jobs=args.concurrency, workers=StreamingPipeline.parse_workers(args.workers))
+        pipeline.start()
+
+    async def process(sid: int):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            published = asyncio.Event()
+            first_track = asyncio.create_task(published.wait())
+            first_track.add_done_callback(
+                lambda t: t.cancelled() or first_track_latencies.append(time.perf_counter() - start))
+            try:
+                await curate(sid, pipeline, published)
+            except Exception as e:
+                errors += 1
+                logger.warning("Curation for subscriber %s failed: %s", sid, e)
+            finally:
+                if published.is_set():
+                    await first_track
+                else:
+                    first_track.cancel()
+            latencies.append(time.perf_counter() - start)
+
+    with contextlib.ExitStack() as stack:
+        install_fakes(fakes, prompt_queries, stack)
+        round_trips.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(process(sid) for sid in sids))
+        wall = time.perf_counter() - start
+
+    if pipeline is not None:
+        await pipeline.stop()
+
+    if not args.keep:
+        await cleanup(run_id, track_prefix)
+
+    return BranchReport(
+        branch=branch,
+        messages=len(sids),
+        concurrency=args.concurrency,
+        engine=args.engine,
+        errors=errors,
+        wall_seconds=wall,
+        messages_per_second=len(sids) / wall if wall else 0.0,
+        latency_p50=_percentile(latencies, 50),
+        latency_p90=_percentile(latencies, 90),
+        latency_p99=_percentile(latencies, 99),
+        latency_max=max(latencies, default=0.0),
+        first_track_p50=_percentile(first_track_latencies, 50),
+        first_track_p90=_percentile(first_track_latencies, 90),
+        db_round_trips_per_message=statistics.fmean(round_trips[sid] for sid in sids) if sids else 0.0,
+        upstream_requests_per_message={u: fakes.requests[u] / len(sids) for u in UPSTREAMS},
+        rate_limited=dict(fakes.rate_limited),
+    )
+
+
+def find_regressions(reports: list[BranchReport], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the reports with a previously written baseline. Latencies and
+    database round trips may not grow, and throughput may not drop, by more
+    than `tolerance` (relative).
+    """
+    regressions = []
+    for report in reports:
+        reference = baseline.get(report.branch)
+        if reference is None:
+            continue
+
+        for metric in ("latency_p50", "latency_p99", "db_round_trips_per_message"):
+            if getattr(report, metric) > reference[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{report.branch}: {metric} {getattr(report, metric):.4f} > baseline {reference[metric]:.4f}")
+        if report.messages_per_second < reference["messages_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{report.branch}: messages_per_second {report.messages_per_second:.2f} "
+                f"< baseline {reference['messages_per_second']:.2f}")
+        if report.errors > reference["errors"]:
+            regressions.append(f"{report.branch}: {report.errors} errors > baseline {reference['errors']}")
+
+    return regressions
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the curation pipeline.")
+    parser.add_argument("--branch", choices=("reuse", "discovery", "both"), default="both")
+    parser.add_argument("--messages", type=int, default=50, help="Curations per branch")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--engine", choices=("graph", "streaming"), default="graph")
+    parser.add_argument("--workers", default="",
+                        help="Streaming pipeline workers per stage, e.g. `verification=32,embedding=8`")
+    parser.add_argument("--playlist-size", type=int, default=50, help="Tracks per fake Spotify playlist")
+    parser.add_argument("--latency", type=lambda s: _parse_per_upstream(s, 1 / 1000), default={},
+                        help="Per-upstream latency in ms, e.g. `spotify=80,brave=120,openai=60,llm=400`")
+    parser.add_argument("--jitter", type=lambda s: _parse_per_upstream(s, 1 / 1000), default={},
+                        help="Per-upstream random extra latency in ms")
+    parser.add_argument("--rate-limit", type=_parse_per_upstream, default={},
+                        help="Per-upstream probability of answering with HTTP 429, e.g. `brave=0.05`")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if the results regress against this report")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--keep", action="store_true", help="Do not delete the seeded data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    await SQLDatabase.get_connection()
+    round_trips: Counter = Counter()
+    count_round_trips(round_trips)
+
+    run_id = uuid.uuid4().hex[:8]
+    branches = ("reuse", "discovery") if args.branch == "both" else (args.branch,)
+    try:
+        reports = [await run_branch(branch, args, run_id, round_trips) for branch in branches]
+    finally:
+        await SQLDatabase.close()
+
+    result = {report.branch: asdict(report) for report in reports}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(reports, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,220 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass, field
+
+import httpx
+import numpy as np
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, UserPromptPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+EMBEDDING_DIMENSIONS = 1024
+# One prompt of a batched query generation request
+BATCHED_PROMPT = re.compile(r'<prompt id="(\d+)">\n(.*?)\n</prompt>', re.DOTALL)
+
+
+@dataclass
+class UpstreamProfile:
+    """
+    Latency and failure behaviour of a single fake upstream.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Probability of answering a request with HTTP 429
+    rate_limit_ratio: float = 0.0
+
+
+@dataclass
+class FakeUpstreams:
+    """
+    Local stand-ins for Spotify, Brave Search and OpenAI embeddings served
+    through httpx mock transports, plus a deterministic LLM.
+    """
+    profiles: dict[str, UpstreamProfile] = field(default_factory=dict)
+    # Number of tracks in every fake Spotify playlist
+    playlist_size: int = 50
+    # Prefix for every generated track, so that runs do not collide on the
+    # `tracks (title, artist)` unique constraint.
+    track_prefix: str = "bench"
+    seed: int = 0
+    requests: Counter = field(default_factory=Counter)
+    rate_limited: Counter = field(default_factory=Counter)
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+
+    def profile(self, upstream: str) -> UpstreamProfile:
+        return self.profiles.get(upstream, UpstreamProfile())
+
+    async def _simulate(self, upstream: str) -> httpx.Response | None:
+        self.requests[upstream] += 1
+        profile = self.profile(upstream)
+        delay = profile.latency + self._rng.uniform(0, profile.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if profile.rate_limit_ratio and self._rng.random() < profile.rate_limit_ratio:
+            self.rate_limited[upstream] += 1
+            return httpx.Response(429, json={"error": "rate limited"}, headers={"Retry-After": "0"})
+        return None
+
+    def _track(self, playlist_id: str, index: int) -> dict:
+        return {
+            "id": f"{playlist_id}-{index}",
+            "name": f"{self.track_prefix} {playlist_id} track {index}",
+            "artists": [{"name": f"{self.track_prefix} artist {index % 17}"}],
+            "duration_ms": 180_000 + index * 1000,
+            "explicit": index % 10 == 0,
+            "available_markets": ["US"] * 80,
+            "album": {"images": [{"url": f"https://i.scdn.co/image/{playlist_id}-{index}"}]},
+            "external_ids": {"isrc": f"BENCH{index:07d}"},
+        }
+
+    # Spotify
+
+    async def _spotify(self, request: httpx.Request) -> httpx.Response:
+        if limited := await self._simulate("spotify"):
+            return limited
+
+        path = request.url.path
+        if path == "/api/token":
+            return httpx.Response(200, json={"access_token": "bench", "expires_in": 3600})
+
+        if path == "/v1/search":
+            query = request.url.params["q"]
+            limit = int(request.url.params.get("limit", 10))
+            digest = hashlib.sha256(query.encode()).hexdigest()
+            items = [{
+                "id": f"{digest[:12]}{i}",
+                "name": f"{query} #{i}",
+                "description": f"The best of {query}",
+            } for i in range(limit)]
+            return httpx.Response(200, json={"playlists": {"items": items, "next": None}})
+
+        if path.startswith("/v1/playlists/"):
+            playlist_id = path.split("/")[3]
+            offset = int(request.url.params.get("offset", 0))
+            limit = int(request.url.params.get("limit", 100))
+            end = min(offset + limit, self.playlist_size)
+            items = [{"track": self._track(playlist_id, i)} for i in range(offset, end)]
+            next_url = None
+            if end < self.playlist_size:
+                next_url = f"https://api.spotify.com{path}?{urllib.parse.urlencode({'offset': end, 'limit': limit})}"
+            return httpx.Response(200, json={"items": items, "next": next_url})
+
+        return httpx.Response(404, json={"error": "not found"})
+
+    # Brave Search
+
+    async def _brave(self, request: httpx.Request) -> httpx.Response:
+        if limited := await self._simulate("brave"):
+            return limited
+
+        query = request.url.params["q"].removeprefix("site:youtube.com ")
+        digest = hashlib.sha256(query.encode()).hexdigest()
+        # Spotify tracks are searched as "<title> <artist>", while the
+        # pipeline verifies the results against "<title> - <artist>".
+        name, _, artist = query.partition(f" {self.track_prefix} artist ")
+        title = f"{name} - {self.track_prefix} artist {artist}" if artist else query
+        results = [
+            {"title": title, "url": f"https://www.youtube.com/watch?v={digest[:11]}"},
+            {"title": f"{query} (lyrics)", "url": f"https://www.youtube.com/shorts/{digest[11:22]}"},
+        ]
+        return httpx.Response(200, json={"web": {"results": results}})
+
+    # OpenAI embeddings
+
+    @staticmethod
+    def embed(text: str) -> np.ndarray:
+        """
+        Deterministic unit vector for the given text.
+        """
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    async def _openai(self, request: httpx.Request) -> httpx.Response:
+        if limited := await self._simulate("openai"):
+            return limited
+
+        body = json.loads(request.content)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, text in enumerate(inputs):
+            vector = self.embed(text)[: body.get("dimensions", EMBEDDING_DIMENSIONS)]
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype(np.float32).tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        return httpx.Response(200, json={
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+        })
+
+    def transport(self, upstream: str) -> httpx.MockTransport:
+        handler = {"spotify": self._spotify, "brave": self._brave, "openai": self._openai}[upstream]
+        return httpx.MockTransport(handler)
+
+    # LLM
+
+    def llm(self, query_for_prompt) -> FunctionModel:
+        """
+        Deterministic stand-in for the LLM. Free-text agents receive the
+        search query returned by `query_for_prompt`, batched query generation
+        receives one such query per prompt, and boolean agents always accept
+        the first playlist they are asked about.
+        """
+
+        async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+            self.requests["llm"] += 1
+            profile = self.profile("llm")
+            delay = profile.latency + self._rng.uniform(0, profile.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+
+            prompt = ""
+            for part in messages[-1].parts:
+                if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                    prompt = part.content
+
+            if info.allow_text_result:
+                return ModelResponse(parts=[TextPart(query_for_prompt(prompt))])
+            result_tool = info.result_tools[0]
+            if "queries" in result_tool.parameters_json_schema.get("properties", {}):
+                return ModelResponse(parts=[ToolCallPart(tool_name=result_tool.name, args={"queries": [
+                    {"prompt_id": int(prompt_id), "query": query_for_prompt(batched_prompt)}
+                    for prompt_id, batched_prompt in BATCHED_PROMPT.findall(prompt)
+                ]})])
+            return ModelResponse(parts=[
+                ToolCallPart(tool_name=info.result_tools[0].name, args={"response": True}),
+            ])
+
+        return FunctionModel(respond, model_name="bench")
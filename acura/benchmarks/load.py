@@ -0,0 +1,406 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+# Load generator for the `acura` queue. Publishes curation messages for
+# seeded subscribers to a local RabbitMQ at a configurable rate and burst
+# pattern, and measures the end-to-end latency from publishing a message to
+# the suggestion rows of its subscriber, as well as the depth of the queue
+# over time.
+#
+# The messages are consumed by whatever workers are attached to AMQP_URL,
+# e.g. `python .` started N times, or by consumers started in this process
+# against the fake upstreams of `benchmarks/fakes.py` (`--in-process-workers`).
+# External workers call the real upstreams. Like the other benchmarks it needs
+# a local, migrated database in POSTGRES_URL, and creates and deletes its own
+# subscribers.
+#
+#   python -m benchmarks.load --pattern morning --duration 120 --subscribers 200
+#   python -m benchmarks.load --pattern same-license --in-process-workers 2 --record schedule.json
+#   python -m benchmarks.load --replay schedule.json --in-process-workers 4
+#   python -m benchmarks.load --pattern burst --critical-ratio 0.1 --in-process-workers 1
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+
+for variable in ("OPENAI_API_KEY", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "BRAVE_SEARCH_TOKEN"):
+    os.environ.setdefault(variable, "bench")
+
+import aio_pika  # noqa: E402
+import numpy as np  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from benchmarks.curation import UPSTREAMS, _parse_per_upstream, _percentile, cleanup, install_fakes, \
+    seed_subscribers  # noqa: E402
+from benchmarks.fakes import FakeUpstreams, UpstreamProfile  # noqa: E402
+from internal.conf import Config  # noqa: E402
+from internal.priority import QUEUE_ARGUMENTS, URGENCY_PRIORITIES  # noqa: E402
+from internal.models.sql import SQLDatabase  # noqa: E402
+
+logger = logging.getLogger("benchmarks.load")
+
+PATTERNS = ("steady", "poisson", "burst", "morning", "same-license")
+QUEUE_NAME = "acura"
+
+
+@dataclass
+class Send:
+    # Seconds after the start of the run
+    at: float
+    # Index of the seeded subscriber
+    subscriber: int
+    urgency: str = "normal"
+
+
+@dataclass
+class BacklogSample:
+    at: float
+    ready: int
+    consumers: int
+
+
+@dataclass
+class LoadReport:
+    pattern: str
+    published: int
+    subscribers: int
+    in_process_workers: int
+    publish_seconds: float
+    # Messages whose subscriber received suggestions after them
+    completed: int
+    messages_per_second: float
+    # Publish to the first and to the last suggestion row of the message
+    first_suggestion_p50: float
+    first_suggestion_p90: float
+    first_suggestion_p99: float
+    first_suggestion_max: float
+    last_suggestion_p50: float
+    last_suggestion_p90: float
+    # Publish to the first suggestion row, per urgency of the message
+    first_suggestion_p90_by_urgency: dict[str, float]
+    backlog_max: int
+    backlog_mean: float
+    # Seconds from the last publish until the queue was empty again
+    backlog_drain_seconds: float | None
+    backlog: list[BacklogSample] = field(default_factory=list)
+
+
+def make_schedule(args: argparse.Namespace, rng: np.random.Generator) -> list[Send]:
+    """
+    Send times and subscribers for the given pattern:
+
+    - steady: `--rate` messages per second, evenly spaced
+    - poisson: `--rate` messages per second on average, random arrivals
+    - burst: `--burst-size` messages for different subscribers at once,
+      every `--burst-interval` seconds
+    - morning: `--waves` opening waves of `--burst-size` messages each, which
+      peak at the opening and trail off over `--wave-width` seconds, on top
+      of `--rate` background traffic
+    - same-license: bursts of `--burst-size` messages for the same
+      subscriber within `--burst-spread` seconds, every `--burst-interval`
+      seconds
+
+    A random `--critical-ratio` of the messages is marked as critical.
+    """
+    n = args.subscribers
+    sends: list[Send] = []
+    if args.pattern in ("steady", "morning") and args.rate:
+        sends += [Send(i / args.rate, i % n) for i in range(int(args.rate * args.duration))]
+
+    if args.pattern == "poisson":
+        at = rng.exponential(1 / args.rate)
+        while at < args.duration:
+            sends.append(Send(float(at), int(rng.integers(n))))
+            at += rng.exponential(1 / args.rate)
+
+    elif args.pattern == "burst":
+        for i, at in enumerate(np.arange(0, args.duration, args.burst_interval)):
+            sends += [Send(float(at), (i * args.burst_size + j) % n) for j in range(args.burst_size)]
+
+    elif args.pattern == "morning":
+        for opening in np.linspace(0, args.duration, args.waves, endpoint=False):
+            offsets = np.abs(rng.normal(0, args.wave_width / 2, args.burst_size))
+            sends += [Send(float(opening + offset), int(rng.integers(n))) for offset in offsets]
+
+    elif args.pattern == "same-license":
+        for i, at in enumerate(np.arange(0, args.duration, args.burst_interval)):
+            offsets = rng.uniform(0, args.burst_spread, args.burst_size)
+            sends += [Send(float(at + offset), i % n) for offset in offsets]
+
+    for send in sends:
+        if rng.random() < args.critical_ratio:
+            send.urgency = "critical"
+    return sorted(sends, key=lambda send: send.at)
+
+
+async def seed_licenses(run_id: str, n: int) -> tuple[list[int], list[str], dict[str, str]]:
+    sids, prompt_queries = await seed_subscribers(run_id, "discovery", n)
+    async with SQLDatabase.connection() as pg:
+        r = await pg.execute(text("SELECT id, license FROM subscribers WHERE id = ANY(:sids)"), {"sids": sids})
+        licenses = dict(r.all())
+    return sids, [str(licenses[sid]) for sid in sids], prompt_queries
+
+
+async def database_clock_offset() -> float:
+    """
+    Seconds to add to `time.time()` to get the database clock, which stamps
+    the suggestion rows.
+    """
+    async with SQLDatabase.connection() as pg:
+        before = time.time()
+        r = await pg.execute(text("SELECT extract(epoch FROM clock_timestamp())"))
+        now = float(r.scalar_one())
+        return now - (before + time.time()) / 2
+
+
+@dataclass
+class SuggestionCollector:
+    """
+    Polls the suggestion rows of the seeded subscribers. Rows are stamped
+    with the start of the inserting transaction, so every poll looks back a
+    little to catch rows which were committed late.
+    """
+    sids: list[int]
+    since: float
+    rows: dict[str, tuple[int, float]] = field(default_factory=dict)
+    last_new_row: float = 0.0
+
+    async def poll(self) -> None:
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                text("""
+                    SELECT s.id::text, pl.sid, extract(epoch FROM s.added_at)
+                    FROM suggestions s
+                    JOIN playlists pl ON pl.id = s.pid
+                    WHERE pl.sid = ANY(:sids) AND s.added_at > to_timestamp(:since)
+                """),
+                {"sids": self.sids, "since": self.since},
+            )
+            for suggestion_id, sid, added_at in r.all():
+                if suggestion_id not in self.rows:
+                    self.rows[suggestion_id] = (sid, float(added_at))
+                    self.last_new_row = time.perf_counter()
+        if self.rows:
+            self.since = max(added_at for _, added_at in self.rows.values()) - 10
+
+
+async def sample_backlog(channel: aio_pika.abc.AbstractChannel, started: float, samples: list[BacklogSample]):
+    queue = await channel.declare_queue(QUEUE_NAME, passive=True)
+    while True:
+        await queue.declare()
+        result = queue.declaration_result
+        samples.append(BacklogSample(time.perf_counter() - started, result.message_count, result.consumer_count))
+        await asyncio.sleep(0.5)
+
+
+async def publish(channel: aio_pika.abc.AbstractChannel, schedule: list[Send], licenses: list[str],
+                  clock_offset: float) -> list[tuple[int, float, str]]:
+    """
+    Publish the schedule in real time and return the subscriber, the
+    (database clock) publish time and the urgency of every message.
+    """
+    published = []
+    started = time.perf_counter()
+    for send in schedule:
+        if (delay := send.at - (time.perf_counter() - started)) > 0:
+            await asyncio.sleep(delay)
+        await channel.default_exchange.publish(
+            aio_pika.Message(
+                body=json.dumps({"license": licenses[send.subscriber], "urgency": send.urgency}).encode(),
+                content_type="application/json",
+                message_id=uuid.uuid4().hex,
+                priority=URGENCY_PRIORITIES[send.urgency],
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=QUEUE_NAME,
+        )
+        published.append((send.subscriber, time.time() + clock_offset, send.urgency))
+    return published
+
+
+def match_latencies(published: list[tuple[int, float, str]], sids: list[int], rows: dict[str, tuple[int, float]]
+                    ) -> tuple[list[float], list[float], dict[str, list[float]], float | None]:
+    """
+    Attribute the suggestion rows of every subscriber to its messages: a
+    message owns the rows added after it was published and before the next
+    message of the same subscriber. Returns the latencies to the first and
+    the last owned row, the former also per urgency, and the time of the
+    last row.
+    """
+    added = defaultdict(list)
+    for sid, added_at in rows.values():
+        added[sid].append(added_at)
+    sent = defaultdict(list)
+    for subscriber, at, urgency in published:
+        sent[sids[subscriber]].append((at, urgency))
+
+    first, last, by_urgency = [], [], defaultdict(list)
+    for sid, messages in sent.items():
+        messages.sort()
+        rows_of_sid = sorted(added[sid])
+        for (at, urgency), until in zip(messages, [at for at, _ in messages[1:]] + [float("inf")]):
+            owned = [added_at for added_at in rows_of_sid if at <= added_at < until]
+            if owned:
+                first.append(owned[0] - at)
+                last.append(owned[-1] - at)
+                by_urgency[urgency].append(owned[0] - at)
+
+    last_row = max((added_at for _, added_at in rows.values()), default=None)
+    return first, last, dict(by_urgency), last_row
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Load generator for the acura queue.")
+    parser.add_argument("--pattern", choices=PATTERNS, default="steady")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to publish for")
+    parser.add_argument("--rate", type=float, default=2, help="Messages per second (steady, poisson, morning)")
+    parser.add_argument("--burst-size", type=int, default=20, help="Messages per burst or wave")
+    parser.add_argument("--burst-interval", type=float, default=15, help="Seconds between bursts")
+    parser.add_argument("--burst-spread", type=float, default=1, help="Seconds over which a same-license burst is sent")
+    parser.add_argument("--waves", type=int, default=1, help="Opening waves (morning)")
+    parser.add_argument("--wave-width", type=float, default=30, help="Seconds a wave trails off over (morning)")
+    parser.add_argument("--subscribers", type=int, default=50, help="Subscribers to seed")
+    parser.add_argument("--critical-ratio", type=float, default=0.0,
+                        help="Share of the messages sent with the critical urgency, the rest are normal")
+    parser.add_argument("--record", help="Write the generated schedule to this file")
+    parser.add_argument("--replay", help="Publish the schedule from this file instead of generating one")
+    parser.add_argument("--in-process-workers", type=int, default=0,
+                        help="Consumers to run in this process against fake upstreams, 0 relies on external workers")
+    parser.add_argument("--latency", type=lambda s: _parse_per_upstream(s, 1 / 1000), default={},
+                        help="Per-upstream latency of the fakes in ms, e.g. `spotify=80,brave=120,openai=60,llm=400`")
+    parser.add_argument("--settle", type=float, default=10,
+                        help="Seconds without new suggestions on an empty queue after which the run ends")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the backlog after publishing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the seeded data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    rng = np.random.default_rng(args.seed)
+    if args.replay:
+        with open(args.replay) as f:
+            schedule = [Send(**send) for send in json.load(f)]
+        args.subscribers = max(args.subscribers, max((send.subscriber for send in schedule), default=0) + 1)
+    else:
+        schedule = make_schedule(args, rng)
+    if args.record:
+        with open(args.record, "w") as f:
+            json.dump([asdict(send) for send in schedule], f)
+
+    await SQLDatabase.get_connection()
+    mq = await aio_pika.connect_robust(Config().AMQP_URL)
+    channel = await mq.channel()
+    await channel.declare_queue(QUEUE_NAME, durable=True, auto_delete=False, arguments=QUEUE_ARGUMENTS)
+
+    run_id = uuid.uuid4().hex[:8]
+    stop = asyncio.Event()
+    consumers: list[asyncio.Task] = []
+    samples: list[BacklogSample] = []
+    sampler = None
+    with contextlib.ExitStack() as stack:
+        try:
+            sids, licenses, prompt_queries = await seed_licenses(run_id, args.subscribers)
+            clock_offset = await database_clock_offset()
+            collector = SuggestionCollector(sids, time.time() + clock_offset)
+
+            if args.in_process_workers:
+                import internal.mq
+
+                fakes = FakeUpstreams(
+                    profiles={upstream: UpstreamProfile(latency=args.latency.get(upstream, 0.0))
+                              for upstream in UPSTREAMS},
+                    track_prefix=f"bench {run_id}",
+                    seed=args.seed,
+                )
+                install_fakes(fakes, prompt_queries, stack)
+                consumers = [asyncio.create_task(internal.mq.start_consuming(mq, None, stop))
+                             for _ in range(args.in_process_workers)]
+
+            started = time.perf_counter()
+            sampler = asyncio.create_task(sample_backlog(channel, started, samples))
+            published = await publish(channel, schedule, licenses, clock_offset)
+            publish_seconds = time.perf_counter() - started
+
+            # Wait until the queue is empty and the suggestions have settled
+            collector.last_new_row = time.perf_counter()
+            deadline = time.perf_counter() + args.timeout
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(1)
+                await collector.poll()
+                empty = samples and samples[-1].ready == 0
+                if empty and time.perf_counter() - collector.last_new_row > args.settle:
+                    break
+            else:
+                logger.warning("Timed out waiting for the backlog")
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+            stop.set()
+            await asyncio.gather(*consumers, return_exceptions=True)
+            if not args.keep:
+                await cleanup(run_id, f"bench {run_id}")
+            await mq.close()
+            await SQLDatabase.close()
+
+    first, last, first_by_urgency, last_row = match_latencies(published, sids, collector.rows)
+    drained_at = next((sample.at for sample in samples if sample.at >= publish_seconds and sample.ready == 0), None)
+    first_publish = min((at for _, at, _ in published), default=0.0)
+    report = LoadReport(
+        pattern="replay" if args.replay else args.pattern,
+        published=len(published),
+        subscribers=len(sids),
+        in_process_workers=args.in_process_workers,
+        publish_seconds=publish_seconds,
+        completed=len(first),
+        messages_per_second=len(first) / (last_row - first_publish) if last_row and last_row > first_publish else 0.0,
+        first_suggestion_p50=_percentile(first, 50),
+        first_suggestion_p90=_percentile(first, 90),
+        first_suggestion_p99=_percentile(first, 99),
+        first_suggestion_max=max(first, default=0.0),
+        last_suggestion_p50=_percentile(last, 50),
+        last_suggestion_p90=_percentile(last, 90),
+        first_suggestion_p90_by_urgency={
+            urgency: _percentile(latencies, 90) for urgency, latencies in sorted(first_by_urgency.items())},
+        backlog_max=max((sample.ready for sample in samples), default=0),
+        backlog_mean=float(np.mean([sample.ready for sample in samples])) if samples else 0.0,
+        backlog_drain_seconds=drained_at - publish_seconds if drained_at is not None else None,
+        backlog=samples,
+    )
+
+    result = asdict(report)
+    print(json.dumps({key: value for key, value in result.items() if key != "backlog"}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
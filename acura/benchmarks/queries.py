@@ -0,0 +1,194 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+# Micro-benchmark of the hot DAO queries, through SQLAlchemy and through the
+# prepared statement fast path (`DAO_FAST_PATH`).
+#
+# Like `benchmarks/curation.py`, it needs a local, migrated database with
+# pgvector in POSTGRES_URL, and creates and deletes its own data.
+#
+#   python -m benchmarks.queries --iterations 2000 --concurrency 4
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass, asdict
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import numpy as np  # noqa: E402
+from sqlalchemy import bindparam, text  # noqa: E402
+
+from benchmarks.fakes import EMBEDDING_DIMENSIONS  # noqa: E402
+from internal.conf import Config  # noqa: E402
+from internal.models.dao import SubscribersDAO, SuggestionsDAO, TracksDAO  # noqa: E402
+from internal.models.prepared import PreparedQueries  # noqa: E402
+from internal.models.sql import SQLDatabase, EmbeddingVector  # noqa: E402
+
+QUERIES = ("subscriber", "similar_tracks", "recent_suggestions", "publish_suggestions")
+
+
+@dataclass
+class QueryReport:
+    query: str
+    path: str
+    iterations: int
+    latency_p50_ms: float
+    latency_p90_ms: float
+    latency_p99_ms: float
+    queries_per_second: float
+
+
+@dataclass
+class Fixture:
+    license: str
+    playlist_id: int
+    sid: int
+    embedding: np.ndarray
+    track_ids: list[int]
+
+
+async def seed(run_id: str, n_tracks: int, n_suggestions: int, rng: np.random.Generator) -> Fixture:
+    async with SQLDatabase.connection() as pg:
+        r = await pg.execute(
+            text("INSERT INTO subscribers (note) VALUES (:note) RETURNING id, license"), {"note": f"bench:{run_id}"})
+        sid, license = r.one()
+        r = await pg.execute(
+            text("INSERT INTO playlists (sid, created_at) VALUES (:sid, current_date) RETURNING id"), {"sid": sid})
+        playlist_id = r.scalar_one()
+
+        center = rng.standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+        track_ids = []
+        for i in range(n_tracks):
+            vector = center + rng.standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32) * 0.5
+            r = await pg.execute(
+                text("""
+                    INSERT INTO tracks (title, artist, duration, uri, search_embedding)
+                    VALUES (:title, :artist, 200000, :uri, :embedding)
+                    RETURNING id
+                """).bindparams(bindparam("embedding", type_=EmbeddingVector(EMBEDDING_DIMENSIONS))),
+                {
+                    "title": f"bench {run_id} query {i}",
+                    "artist": f"bench {run_id}",
+                    "uri": f"https://www.youtube.com/watch?v={run_id[:6]}{i:05d}",
+                    "embedding": vector,
+                },
+            )
+            track_ids.append(r.scalar_one())
+
+        for i in range(n_suggestions):
+            await pg.execute(
+                text("INSERT INTO suggestions (pid, tid) VALUES (:pid, :tid)"),
+                {"pid": playlist_id, "tid": track_ids[i % len(track_ids)]},
+            )
+
+    return Fixture(str(license), playlist_id, sid, center, track_ids)
+
+
+async def cleanup(run_id: str) -> None:
+    async with SQLDatabase.connection() as pg:
+        await pg.execute(text("DELETE FROM subscribers WHERE note = :note"), {"note": f"bench:{run_id}"})
+        await pg.execute(text("DELETE FROM tracks WHERE title LIKE :prefix"), {"prefix": f"bench {run_id} %"})
+
+
+def make_call(query: str, fixture: Fixture):
+    if query == "subscriber":
+        return lambda: SubscribersDAO.get_subscriber_by_license(fixture.license)
+    if query == "similar_tracks":
+        return lambda: TracksDAO.get_similar_track_ids(fixture.embedding)
+    if query == "recent_suggestions":
+        return lambda: SuggestionsDAO.get_past_n_hours_suggestions(fixture.playlist_id)
+    return lambda: SuggestionsDAO.publish_suggestions(fixture.sid, fixture.playlist_id, fixture.track_ids[:5])
+
+
+async def measure(query: str, path: str, fixture: Fixture, iterations: int, concurrency: int) -> QueryReport:
+    Config().DAO_FAST_PATH = path == "prepared"
+    call = make_call(query, fixture)
+    # Warm up the statement caches of both paths
+    for _ in range(10):
+        await call()
+
+    latencies = []
+    remaining = iterations
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+
+    p50, p90, p99 = (float(np.percentile(latencies, q)) * 1000 for q in (50, 90, 99))
+    return QueryReport(query, path, iterations, p50, p90, p99, iterations / wall)
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the hot DAO queries.")
+    parser.add_argument("--query", choices=(*QUERIES, "all"), default="all")
+    parser.add_argument("--iterations", type=int, default=1000, help="Calls per query and path")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--tracks", type=int, default=500, help="Catalog tracks to seed")
+    parser.add_argument("--suggestions", type=int, default=200, help="Recent suggestions to seed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--keep", action="store_true", help="Do not delete the seeded data")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    await SQLDatabase.get_connection()
+
+    run_id = uuid.uuid4().hex[:8]
+    queries = QUERIES if args.query == "all" else (args.query,)
+    reports = []
+    try:
+        fixture = await seed(run_id, args.tracks, args.suggestions, np.random.default_rng(args.seed))
+        for query in queries:
+            for path in ("sqlalchemy", "prepared"):
+                reports.append(await measure(query, path, fixture, args.iterations, args.concurrency))
+    finally:
+        if not args.keep:
+            await cleanup(run_id)
+        await PreparedQueries.close()
+        await SQLDatabase.close()
+
+    result = [asdict(report) for report in reports]
+    print(json.dumps(result, indent=2))
+    for sqlalchemy, prepared in zip(reports[::2], reports[1::2]):
+        print(f"{sqlalchemy.query}: p50 {sqlalchemy.latency_p50_ms:.3f}ms -> {prepared.latency_p50_ms:.3f}ms "
+              f"({sqlalchemy.latency_p50_ms / prepared.latency_p50_ms:.2f}x)", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
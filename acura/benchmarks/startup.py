@@ -0,0 +1,167 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+# Cold start benchmark of the worker: the imports of `__main__`, which are all
+# that stands between the process start and consuming, and the imports and
+# construction which are deferred to the pipeline warm-up and the first
+# curation. Every run is a fresh interpreter started with `-X importtime`,
+# whose output is broken down by top-level package.
+#
+#   python -m benchmarks.startup --runs 5 --top 10
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# Written to stderr between the phases of a child run, like `-X importtime`
+PHASE_MARKER = "startup-phase:"
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+@dataclass
+class PhaseReport:
+    phase: str
+    # Median over the runs
+    seconds: float
+    n_modules: int
+    # Time spent in each top-level package, excluding its own imports of
+    # other packages, in seconds.
+    packages: dict[str, float] = field(default_factory=dict)
+
+
+def child() -> None:
+    """
+    Runs inside the measured interpreter and reports the wall time of each
+    phase on stdout.
+    """
+    from internal.warmup import PIPELINE_MODULES
+
+    timings = {}
+
+    def phase(name: str, run) -> None:
+        print(f"{PHASE_MARKER}{name}", file=sys.stderr, flush=True)
+        started = time.perf_counter()
+        run()
+        timings[name] = time.perf_counter() - started
+
+    def load_main():
+        # Only the imports, `main()` is guarded by `__name__`
+        source = (ROOT / "__main__.py").read_text()
+        exec(compile(source, str(ROOT / "__main__.py"), "exec"), {"__name__": "acura_startup"})
+
+    def warm_up():
+        import importlib
+        for module in PIPELINE_MODULES:
+            importlib.import_module(module)
+
+    def construct():
+        from internal.chain import GenerateSearchQueryNode, MatchQueryWithSpotifyPlaylist, MusicDiscoveryPipeline
+        from internal.services.embeddings import EmbeddingsService
+        GenerateSearchQueryNode.query_gen_agent
+        GenerateSearchQueryNode.batch_query_gen_agent
+        MatchQueryWithSpotifyPlaylist.playlist_filter_agent
+        MusicDiscoveryPipeline.graph
+        EmbeddingsService.client()
+
+    phase("startup", load_main)
+    phase("warm_up", warm_up)
+    phase("first_curation", construct)
+    print(json.dumps(timings))
+
+
+def parse_import_times(stderr: str) -> dict[str, Counter]:
+    """
+    Self time per top-level package and phase, in seconds.
+    """
+    phases: dict[str, Counter] = {}
+    current = None
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            current = phases.setdefault(line.removeprefix(PHASE_MARKER), Counter())
+        elif current is not None and (match := IMPORT_TIME.match(line)):
+            self_us, _, _, module = match.groups()
+            current[module.split(".")[0]] += int(self_us) / 1e6
+    return phases
+
+
+def measure(env: dict[str, str]) -> tuple[dict[str, float], dict[str, Counter]]:
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "benchmarks.startup", "--child"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(r.stdout.splitlines()[-1]), parse_import_times(r.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the worker.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure")
+    parser.add_argument("--top", type=int, default=8, help="Packages to list per phase")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return 0
+
+    env = dict(os.environ)
+    # Nothing is called, but the settings are read at import time
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env.setdefault("SPOTIFY_CLIENT_ID", "bench")
+    env.setdefault("SPOTIFY_CLIENT_SECRET", "bench")
+
+    # The first run warms the file system cache and the bytecode cache
+    measure(env)
+    runs = [measure(env) for _ in range(args.runs)]
+
+    reports = []
+    for phase in runs[0][0]:
+        packages = Counter()
+        for _, imports in runs:
+            packages.update(imports.get(phase, Counter()))
+        reports.append(PhaseReport(
+            phase=phase,
+            seconds=statistics.median(timings[phase] for timings, _ in runs),
+            n_modules=len(runs[0][1].get(phase, ())),
+            packages={package: seconds / len(runs) for package, seconds in packages.most_common(args.top)},
+        ))
+
+    result = [asdict(report) for report in reports]
+    print(json.dumps(result, indent=2))
+    for report in reports:
+        breakdown = ", ".join(f"{package} {seconds * 1000:.0f}ms" for package, seconds in report.packages.items())
+        print(f"{report.phase}: {report.seconds * 1000:.0f}ms ({breakdown})", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,15 +18,120 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.providers.openai import OpenAIProvider
+from __future__ import annotations
+import functools
+import logging
+from typing import TYPE_CHECKING, Callable, Generic, TypeVar
 from internal.conf import Config
+from internal import metrics
 
+if TYPE_CHECKING:
+    from pydantic_ai.models import Model
+    from pydantic_ai.models.openai import OpenAIModel
 
-def decide_llm():
-    """Decides which LLM to use based on the configuration."""
+T = TypeVar("T")
 
-    return OpenAIModel(
-        "gpt-4o-mini" if not Config().OLLAMA_MODEL_NAME else Config().OLLAMA_MODEL_NAME,
-        provider=OpenAIProvider(base_url=Config().OLLAMA_API_URL if Config().OLLAMA_API_URL else None),
-    )
+logger = logging.getLogger(__name__)
+
+# Agents whose model can be routed with `AGENT_MODELS`, named after their
+# `llm` upstream operations.
+AGENTS = ("query_generation", "batched_query_generation", "playlist_filter")
+PROVIDERS = ("openai", "ollama")
+
+
+def parse_agent_models(spec: str) -> dict[str, list[tuple[str, str]]]:
+    """
+    Parses `agent=provider:model` pairs, where several models separated by `|`
+    are tried in order, e.g.
+    "playlist_filter=ollama:qwen2.5:1.5b|openai:gpt-4o-mini,query_generation=openai:gpt-4o".
+    """
+    routes = {}
+    for pair in filter(None, (part.strip() for part in spec.split(","))):
+        agent, _, models = pair.partition("=")
+        if agent.strip() not in AGENTS:
+            raise ValueError(f"Unknown agent `{agent.strip()}`")
+        route = []
+        for model in filter(None, (part.strip() for part in models.split("|"))):
+            provider, _, name = model.partition(":")
+            if provider not in PROVIDERS or not name:
+                raise ValueError(f"Invalid model `{model}` of agent `{agent.strip()}`, expected `provider:model`")
+            route.append((provider, name))
+        routes[agent.strip()] = route
+    return routes
+
+
+@functools.cache
+def _model(provider: str, name: str) -> OpenAIModel:
+    # Importing the OpenAI model pulls in most of `openai`, which is left to
+    # the first agent instead of the start of the worker.
+    from pydantic_ai.models.openai import OpenAIModel
+
+    return OpenAIModel(name, provider=_provider(provider))
+
+
+@functools.cache
+def _provider(provider: str):
+    """
+    One provider, and thus one HTTP client, per upstream, shared by all the
+    models served by it. Ollama is reached through its OpenAI compatible API.
+    """
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    if provider == "ollama":
+        return OpenAIProvider(base_url=Config().OLLAMA_API_URL or "http://localhost:11434/v1")
+    return OpenAIProvider()
+
+
+@functools.cache
+def decide_llm(agent: str | None = None) -> Model:
+    """
+    Decides which LLM the given agent uses based on the configuration. Agents
+    routed to their own models in `AGENT_MODELS` fall back to the next model
+    of their route, and finally to the default model, when a request fails.
+    """
+    if Config().OLLAMA_MODEL_NAME:
+        default = ("ollama" if Config().OLLAMA_API_URL else "openai", Config().OLLAMA_MODEL_NAME)
+    else:
+        default = ("openai", "gpt-4o-mini")
+
+    route = parse_agent_models(Config().AGENT_MODELS).get(agent, []) if agent else []
+    route = list(dict.fromkeys([*route, default]))
+    if len(route) == 1:
+        return _model(*route[0])
+
+    from openai import APIError
+    from pydantic_ai.exceptions import ModelHTTPError
+    from pydantic_ai.models.fallback import FallbackModel
+
+    models = [_model(*model) for model in route]
+
+    def fallback_on(e: Exception) -> bool:
+        # Unreachable or failing models are skipped, anything else (e.g. a
+        # cancellation or a bug) is raised right away.
+        if not isinstance(e, (ModelHTTPError, APIError)):
+            return False
+        logger.warning("LLM request of agent `%s` failed, trying its next model: %s", agent, e)
+        metrics.LLM_FALLBACKS.inc(agent=agent)
+        return True
+
+    return FallbackModel(*models, fallback_on=fallback_on)
+
+
+class LazyAttribute(Generic[T]):
+    """
+    Class attribute which is built by `factory` on first access, e.g. agents
+    which are only needed once the worker receives its first message. The
+    built value then replaces the descriptor on the class.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self.name: str | None = None
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance, owner: type) -> T:
+        value = self.factory()
+        setattr(owner, self.name, value)
+        return value
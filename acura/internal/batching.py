@@ -0,0 +1,88 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import contextvars
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class MicroBatcher(Generic[T, R]):
+    """
+    Coalesces concurrent calls which arrive within `window` seconds of the
+    first one (or until `max_size` of them are waiting) into a single call of
+    `run_batch`, which must return one result per item, in order.
+    """
+    run_batch: Callable[[list[T]], Awaitable[list[R]]]
+    window: float
+    max_size: int
+
+    _pending: list[tuple[T, asyncio.Future]] = field(default_factory=list, repr=False)
+    _timer: asyncio.TimerHandle | None = field(default=None, repr=False)
+    _tasks: set[asyncio.Task] = field(default_factory=set, repr=False)
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        # The batch serves many callers, so it must not inherit the context
+        # (e.g. the flight recording) of the one which happened to fill it.
+        task = asyncio.create_task(self._run(batch), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        # Callers which gave up in the meantime are left out
+        batch = [(item, future) for item, future in batch if not future.done()]
+        if not batch:
+            return
+
+        try:
+            results: list[Any] = await self.run_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
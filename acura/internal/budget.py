@@ -0,0 +1,110 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+
+from internal.conf import Config
+from internal import metrics
+
+
+class BudgetExhausted(RuntimeError):
+    """
+    Raised when a capped kind of upstream call is requested after its cap has
+    been reached.
+    """
+
+
+@dataclass
+class CurationBudget:
+    """
+    Limits of a single curation: how many new tracks are enough, until when
+    the curation may run, and how many LLM, embedding and search calls it may
+    make. `None` means unlimited.
+    """
+    target_tracks: Optional[int] = None
+    # Absolute deadline in event loop time, see `asyncio.timeout_at`
+    deadline: Optional[float] = None
+    max_calls: dict[str, int] = field(default_factory=dict)
+
+    calls: dict[str, int] = field(default_factory=dict)
+    n_published: int = 0
+    # Why the curation stopped early, if it did
+    stop_reason: Optional[str] = None
+
+    @classmethod
+    def from_config(cls) -> "CurationBudget":
+        conf = Config()
+        caps = {
+            "llm": conf.CURATION_MAX_LLM_CALLS,
+            "embedding": conf.CURATION_MAX_EMBEDDING_CALLS,
+            "search": conf.CURATION_MAX_SEARCH_CALLS,
+        }
+        return cls(
+            target_tracks=conf.CURATION_TARGET_TRACKS or None,
+            deadline=(asyncio.get_running_loop().time() + conf.CURATION_DEADLINE) if conf.CURATION_DEADLINE else None,
+            max_calls={kind: cap for kind, cap in caps.items() if cap},
+        )
+
+    def remaining(self, kind: str) -> Optional[int]:
+        if kind not in self.max_calls:
+            return None
+        return max(self.max_calls[kind] - self.calls.get(kind, 0), 0)
+
+    def spend(self, kind: str) -> None:
+        """
+        Account for one call of the given kind (`llm`, `embedding` or
+        `search`), raising `BudgetExhausted` if its cap has been reached.
+        """
+        if self.remaining(kind) == 0:
+            self.mark_stopped(kind)
+            raise BudgetExhausted(f"Curation budget of {self.max_calls[kind]} {kind} calls exhausted")
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def tracks_wanted(self, n_added_tracks: int) -> Optional[int]:
+        """
+        Number of tracks still needed to reach the target, or None when there
+        is no target.
+        """
+        if self.target_tracks is None:
+            return None
+        return max(self.target_tracks - n_added_tracks, 0)
+
+    def is_expired(self) -> bool:
+        return self.deadline is not None and asyncio.get_running_loop().time() >= self.deadline
+
+    def should_stop(self, n_added_tracks: int) -> bool:
+        """
+        Checked between tracks: whether the curation should stop with what it
+        has, because the target is met or because it ran out of time.
+        """
+        if self.tracks_wanted(n_added_tracks) == 0:
+            self.mark_stopped("target")
+            return True
+        if self.is_expired():
+            self.mark_stopped("deadline")
+            return True
+        return False
+
+    def mark_stopped(self, reason: str) -> None:
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            metrics.BUDGET_STOPS.inc(reason=reason)
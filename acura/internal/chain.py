@@ -19,32 +19,118 @@ For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
 from pydantic_ai import Agent
+import asyncio
 import logging
-from dataclasses import dataclass
-from internal.services.spotify import SpotifyService
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field, replace
+from internal.services.spotify import SpotifyService, TrackCandidate
 from internal.services.brave_search import BraveSearchService
-from internal.agents import decide_llm
+from internal.agents import LazyAttribute, decide_llm
 from pydantic_graph import BaseNode, GraphRunContext, End, Graph
 import Levenshtein
 from internal.models.dao import PromptsDAO, PlaylistsDAO, TracksDAO, SuggestionsDAO
-from typing import Union
-from internal.services.embeddings import EmbeddingsService
+from internal.models.vector_index import TrackVectorIndex
+from typing import AsyncIterator, ClassVar, Union
+from internal.services.embeddings import EmbeddingsService, Embedding, as_embedding
+from internal.speculation import SpeculativeDiscovery
+from internal.semantic_cache import SemanticCurationCache
+from internal.conf import Config
+from internal import metrics
+from internal.flight_recorder import FlightRecorder
+from internal.usage import UpstreamUsage
+from internal.publishing import SuggestionBatcher
+from internal.budget import BudgetExhausted, CurationBudget
+from internal.circuit import CircuitBreaker
+from internal.checkpoint import CurationCheckpointer
+from internal.batching import MicroBatcher
+from internal.playlist_decisions import PlaylistDecisions
 
 # Maximum number of retries for executing the workflow
 MAX_RETRIES = 3
 
+# The system prompts follow CodeSignal's MPF format for GenAI prompts.
+# Learn more here: https://codesignal.com/learn/paths/prompt-engineering-for-everyone?courseSlug=understanding-llms-and-basic-prompting-techniques&unitSlug=mastering-consistent-formatting-and-organization-for-effective-prompting
+QUERY_GENERATION_PROMPT = """
+Generate concise, unique music search queries based on a business owner's prompt describing their establishment and desired musical ambiance.
+
+- Infer relevant musical attributes from the user's prompt and produce a search query that:
+  - Is free from redundancy and repetition.
+  - Targets unique musical aspects to ensure diverse search results and minimize duplication issues in the database.
+  - Maintains a professional tone aligned with business needs.
+  - Avoids extraneous or unrelated details.
+  - Is unique every time.
+"""
+
 
 @dataclass
 class GraphState:
     spotify_search_query: str | None = None
+    search_embedding: Embedding | None = None
 
     retry_count: int = 0
     error_info: str | None = None
 
+    def __post_init__(self):
+        if self.search_embedding is not None:
+            self.search_embedding = as_embedding(self.search_embedding)
+
+
+@dataclass
+class SpeculativeDiscoveryResult:
+    found_playlists: list[dict]
+    # Only meaningful when `prefiltered` is set, in which case `None` means
+    # that none of the found playlists matched the query.
+    matched_playlist: dict | None = None
+    prefiltered: bool = False
+
+
+@dataclass
+class SearchQuery:
+    prompt_id: int
+    query: str
+
+
+@dataclass
+class SearchQueries:
+    queries: list[SearchQuery]
+
 
 @dataclass
 class GraphDeps:
     sid: int
+    # Spotify discovery work started ahead of the router decision, if the
+    # speculative mode is enabled. Lives in the dependencies rather than the
+    # state, since the state is snapshotted after every node.
+    speculation: SpeculativeDiscovery | None = field(default=None, repr=False)
+    # Set once the first PUBLISH_ACK_AFTER_BATCHES batches of tracks have been
+    # published, which is when the consumer acknowledges the message.
+    published: asyncio.Event | None = field(default=None, repr=False)
+    started_at: float = field(default_factory=time.perf_counter, repr=False)
+    budget: CurationBudget = field(default_factory=CurationBudget, repr=False)
+    checkpointer: CurationCheckpointer | None = field(default=None, repr=False)
+
+    async def checkpoint(self, node: BaseNode, state: GraphState) -> None:
+        if self.checkpointer is not None:
+            await self.checkpointer.save(node, state)
+
+    def discard_speculation(self, reason: str) -> None:
+        if self.speculation is not None:
+            self.speculation.discard(reason)
+            self.speculation = None
+
+    def suggestion_batcher(self, playlist_id: int) -> SuggestionBatcher:
+        return SuggestionBatcher(
+            self.sid, playlist_id, Config().PUBLISH_BATCH_SIZE, on_published=self._batch_published)
+
+    def _batch_published(self, n_batches: int, n_tracks: int) -> None:
+        self.budget.n_published += n_tracks
+        if n_batches == 1:
+            metrics.TIME_TO_FIRST_TRACK.observe(time.perf_counter() - self.started_at)
+
+        ack_after = Config().PUBLISH_ACK_AFTER_BATCHES
+        if self.published is not None and ack_after and n_batches >= ack_after:
+            self.published.set()
 
 
 @dataclass
@@ -52,28 +138,70 @@ class GenerateSearchQueryNode(BaseNode[GraphState, GraphDeps]):
     """
     Generates a concise search query based on the user's prompt.
     """
-    query_gen_agent = Agent(
-        model=decide_llm(),
+    query_gen_agent = LazyAttribute(lambda: Agent(
+        model=decide_llm("query_generation"),
         retries=5,
         result_retries=3,
         result_type=str,
         name="GenerateSearchQueryAgent",
         model_settings={"temperature": 0.85, "top_p": 0.30},
-        # The system prompts follow CodeSignal's MPF format for GenAI prompts.
-        # Learn more here: https://codesignal.com/learn/paths/prompt-engineering-for-everyone?courseSlug=understanding-llms-and-basic-prompting-techniques&unitSlug=mastering-consistent-formatting-and-organization-for-effective-prompting
-        system_prompt="""
-Generate concise, unique music search queries based on a business owner's prompt describing their establishment and desired musical ambiance.
-
-- Infer relevant musical attributes from the user's prompt and produce a search query that:
-  - Is free from redundancy and repetition.
-  - Targets unique musical aspects to ensure diverse search results and minimize duplication issues in the database.
-  - Maintains a professional tone aligned with business needs.
-  - Avoids extraneous or unrelated details.
-  - Is unique every time.
-"""
-    )
-
-    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> "SourceSelectionRouterNode":
+        system_prompt=QUERY_GENERATION_PROMPT,
+    ))
+    # Answers the prompts of several subscribers at once during bursts, see
+    # `generate_search_query`.
+    batch_query_gen_agent = LazyAttribute(lambda: Agent(
+        model=decide_llm("batched_query_generation"),
+        retries=5,
+        result_retries=3,
+        result_type=SearchQueries,
+        name="GenerateSearchQueriesAgent",
+        model_settings={"temperature": 0.85, "top_p": 0.30},
+        system_prompt=QUERY_GENERATION_PROMPT + """
+- You will be given several prompts of different business owners, each enclosed
+  in a `<prompt id="...">` tag. Generate exactly one search query per prompt,
+  independently of the other prompts, and return it with the prompt's ID.
+""",
+    ))
+    query_batcher: ClassVar[MicroBatcher[str, str] | None] = None
+
+    @classmethod
+    async def generate_search_query(cls, prompt: str) -> str:
+        """
+        Generates the search query for a prompt. With QUERY_BATCH_WINDOW set,
+        prompts of curations which start within the window are answered by a
+        single LLM request.
+        """
+        conf = Config()
+        if not conf.QUERY_BATCH_WINDOW:
+            return (await cls.generate_search_queries([prompt]))[0]
+
+        if cls.query_batcher is None:
+            cls.query_batcher = MicroBatcher(cls.generate_search_queries, conf.QUERY_BATCH_WINDOW, conf.QUERY_BATCH_SIZE)
+        return await cls.query_batcher.submit(prompt)
+
+    @classmethod
+    async def generate_search_queries(cls, prompts: list[str]) -> list[str]:
+        metrics.QUERY_BATCH_SIZE.observe(len(prompts))
+        if len(prompts) == 1:
+            with metrics.track_upstream("llm", "query_generation"):
+                flow = await cls.query_gen_agent.run(prompts[0])
+            UpstreamUsage.record_model_usage(flow.usage())
+            return [flow.data]
+
+        with metrics.track_upstream("llm", "batched_query_generation"):
+            flow = await cls.batch_query_gen_agent.run("\n".join(
+                f'<prompt id="{i}">\n{prompt}\n</prompt>' for i, prompt in enumerate(prompts)))
+        UpstreamUsage.record_model_usage(flow.usage())
+        queries = {query.prompt_id: query.query for query in flow.data.queries}
+
+        # Prompts the model skipped are answered one by one
+        missing = [i for i in range(len(prompts)) if not queries.get(i)]
+        for i, query in zip(missing, await asyncio.gather(
+                *(cls.generate_search_queries([prompts[i]]) for i in missing))):
+            queries[i] = query[0]
+        return [queries[i] for i in range(len(prompts))]
+
+    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> Union["SourceSelectionRouterNode", End[int]]:
         if ctx.state.error_info:
             logging.getLogger(__name__).error(
                 f"Error in previous step: {ctx.state.error_info}")
@@ -81,15 +209,32 @@ Generate concise, unique music search queries based on a business owner's prompt
             raise RuntimeError(
                 f"Maximum retries ({MAX_RETRIES}) exceeded for query: `{ctx.state.spotify_search_query}`")
 
+        try:
+            ctx.deps.budget.spend("llm")
+        except BudgetExhausted as e:
+            # Every loop-back for a new query ends up here
+            logging.getLogger(__name__).info(f"Stopping the curation early: {e}")
+            return End(ctx.deps.budget.n_published)
+
         try:
             prompts = await PromptsDAO.get_subscriber_prompts_by_sid(ctx.deps.sid)
             prompt = prompts[0].prompt
-            flow = await self.query_gen_agent.run(prompt)
-            ctx.state.spotify_search_query = flow.data
-            return SourceSelectionRouterNode()
+            ctx.state.spotify_search_query = await self.generate_search_query(prompt)
         except Exception as e:
             raise RuntimeError(f"Error during query generation: {e}")
 
+        if Config().SPECULATIVE_DISCOVERY:
+            # Any speculation left over from a previous attempt was started for
+            # a query which is no longer relevant.
+            ctx.deps.discard_speculation("query regenerated")
+            ctx.deps.speculation = SpeculativeDiscovery.start(
+                ctx.state.spotify_search_query,
+                speculative_discovery(
+                    ctx.state.spotify_search_query, Config().SPECULATIVE_PREFILTER, ctx.deps.budget),
+            )
+
+        return SourceSelectionRouterNode()
+
 
 @dataclass
 class SearchSpotifyPlaylistsNode(BaseNode[GraphState, GraphDeps]):
@@ -99,13 +244,25 @@ class SearchSpotifyPlaylistsNode(BaseNode[GraphState, GraphDeps]):
 
     async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> Union["MatchQueryWithSpotifyPlaylist", "GenerateSearchQueryNode"]:
         try:
-            found_playlists, _ = await SpotifyService.search_playlists(query=ctx.state.spotify_search_query)
-            if not found_playlists:
+            speculative_result = None
+            if ctx.deps.speculation is not None:
+                speculation, ctx.deps.speculation = ctx.deps.speculation, None
+                speculative_result = await speculation.claim(ctx.state.spotify_search_query)
+
+            if speculative_result is None:
+                found_playlists, _ = await SpotifyService.search_playlists(query=ctx.state.spotify_search_query)
+                speculative_result = SpeculativeDiscoveryResult(found_playlists)
+
+            if not speculative_result.found_playlists:
                 ctx.state.retry_count += 1
                 ctx.state.error_info = f"No playlists found for query: {ctx.state.spotify_search_query}"
                 return GenerateSearchQueryNode()
 
-            return MatchQueryWithSpotifyPlaylist(found_playlists)
+            return MatchQueryWithSpotifyPlaylist(
+                speculative_result.found_playlists,
+                matched_playlist=speculative_result.matched_playlist,
+                prefiltered=speculative_result.prefiltered,
+            )
         except Exception as e:
             raise RuntimeError(f"Error retrieving Spotify playlists: {e}")
 
@@ -116,9 +273,12 @@ class MatchQueryWithSpotifyPlaylist(BaseNode[GraphState, GraphDeps]):
     Matches Spotify playlists against the generated query and filters tracks using an agent.
     """
     found_playlists: list[dict]
+    # Set when the matching has already been done by the speculative discovery
+    matched_playlist: dict | None = None
+    prefiltered: bool = False
 
-    playlist_filter_agent = Agent(
-        model=decide_llm(),
+    playlist_filter_agent = LazyAttribute(lambda: Agent(
+        model=decide_llm("playlist_filter"),
         retries=3,
         result_retries=2,
         result_type=bool,
@@ -134,37 +294,73 @@ Determine if a given playlist matches user's query or might include any music
 which is related to user's request. The user will give you the query, as well
 as the title and the description of the playlist.
 """
-    )
-
-    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> Union["SearchAndVerifyYoutubeAndSaveNode", "GenerateSearchQueryNode"]:
-        matched_playlist = None
+    ))
 
-        for playlist in self.found_playlists:
-            if playlist is None:
-                continue
+    @classmethod
+    async def find_matching_playlist(
+            cls, query: str, found_playlists: list[dict], budget: CurationBudget | None = None) -> dict | None:
+        """
+        Returns the first playlist which the filter agent considers a match for
+        the query, or None if none of them match. Decisions made earlier about
+        the same playlist and query are reused instead of asking the agent.
+        """
+        decisions = PlaylistDecisions(query)
+        await decisions.load([playlist for playlist in found_playlists if playlist is not None])
+        try:
+            for playlist in found_playlists:
+                if playlist is None:
+                    continue
 
-            try:
-                flow = await self.playlist_filter_agent.run(f"""
+                is_playlist_match = decisions.get(playlist)
+                if is_playlist_match is None:
+                    if budget is not None:
+                        # Without LLM calls left, none of the remaining
+                        # playlists can be judged.
+                        try:
+                            budget.spend("llm")
+                        except BudgetExhausted as e:
+                            logging.getLogger(__name__).info(f"Stopping the playlist filter early: {e}")
+                            return None
+
+                    try:
+                        with metrics.track_upstream("llm", "playlist_filter"):
+                            flow = await cls.playlist_filter_agent.run(f"""
 __PLAYLIST INFO__
 1. Title: {playlist['name']}
 2. Description: {playlist['description']}
 
 __ASK__
-This is their search query: {ctx.state.spotify_search_query}
+This is their search query: {query}
 """)
-                is_playlist_match = flow.data
+                        UpstreamUsage.record_model_usage(flow.usage())
+                        is_playlist_match = flow.data
+                        decisions.remember(playlist, is_playlist_match)
+
+                    except Exception as e:
+                        logging.getLogger(__name__).error(
+                            f"Error filtering playlist '{playlist['name']}']: {e}")
+
                 if is_playlist_match:
-                    matched_playlist = playlist
-                    break
+                    return playlist
 
-            except Exception as e:
-                logging.getLogger(__name__).error(
-                    f"Error filtering playlist '{playlist['name']}']: {e}")
+            return None
+        finally:
+            await decisions.save()
+
+    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> \
+            Union["SearchAndVerifyYoutubeAndSaveNode", "GenerateSearchQueryNode", End[int]]:
+        if self.prefiltered:
+            matched_playlist = self.matched_playlist
+        else:
+            matched_playlist = await self.find_matching_playlist(
+                ctx.state.spotify_search_query, self.found_playlists, ctx.deps.budget)
 
         if matched_playlist:
-            pid = matched_playlist["id"]
-            tracks = await SpotifyService.get_playlist_tracks(pid)
-            return SearchAndVerifyYoutubeAndSaveNode(tracks=filter(lambda track: not track["explicit"], tracks))
+            # The tracks are streamed by the next node, page by page
+            return SearchAndVerifyYoutubeAndSaveNode(spotify_playlist_id=matched_playlist["id"])
+        elif ctx.deps.budget.remaining("llm") == 0:
+            # A new query could not be generated either
+            return End(ctx.deps.budget.n_published)
         else:
             ctx.state.retry_count += 1
             ctx.state.error_info = f"No matching playlists found for query: {ctx.state.spotify_search_query}"
@@ -176,52 +372,150 @@ class SearchAndVerifyYoutubeAndSaveNode(BaseNode[GraphState, GraphDeps]):
     """
     Searches YouTube for videos of the corresponding tracks and verifies them to ensure they are music videos.
     """
-    tracks: list[dict]
+    spotify_playlist_id: str
+    # Progress restored from a checkpoint: the number of leading non-explicit
+    # tracks which have already been processed and published.
+    n_processed: int = 0
+    n_added_tracks: int = 0
+    added_track_ids: list[int] = field(default_factory=list)
+
+    async def stream_tracks(self) -> AsyncIterator[TrackCandidate]:
+        """
+        Yields the non-explicit tracks of the playlist which are left to
+        process, as soon as their page has been downloaded. Use with
+        `contextlib.aclosing` to stop the download when stopping early.
+        """
+        n_skipped = 0
+        async with aclosing(SpotifyService.iter_playlist_tracks(self.spotify_playlist_id)) as pages:
+            async for page in pages:
+                for track in page:
+                    if track.explicit:
+                        continue
+                    if n_skipped < self.n_processed:
+                        n_skipped += 1
+                        continue
+                    yield track
+
+    @classmethod
+    async def find_youtube_video(cls, track: TrackCandidate) -> dict | None:
+        """
+        Returns the first YouTube search result which is close enough to the
+        track title and artist to be considered its music video, or None.
+        """
+        brave_search_query = f"{track.name} {track.artist}"
+        results: list[dict] = await BraveSearchService.search_youtube_for_videos(brave_search_query)
+        if not results:
+            return None
+
+        for youtube_result in results:
+            similarity = Levenshtein.ratio(
+                f"{track.name.lower()} - {track.artist.lower()}",
+                youtube_result['title'].lower()
+            )
+
+            if youtube_result and (similarity > 0.75) and ("watch" in youtube_result["url"]):
+                return youtube_result
+
+        return None
+
+    @classmethod
+    async def save_track(cls, track: TrackCandidate, youtube_result: dict, embedding: Embedding) -> int | None:
+        """
+        Stores a verified track along with its embedding and returns its ID,
+        or None if it could not be created. Adding it to the playlist is left
+        to a `SuggestionBatcher`.
+        """
+        verified_track = {
+            "title": track.name,
+            "uri": youtube_result["url"],
+            "artist": track.artist,
+            "duration": track.duration_ms,
+            "explicit": track.explicit,
+            "image": track.image,
+        }
+
+        # Create the track in the database
+        track_row = await TracksDAO.create_track(verified_track)
+        if track_row is None:
+            return None
+
+        await TracksDAO.update_track_embedding(track_row.id, embedding)
+        TrackVectorIndex.add(track_row.id, embedding)
+        return track_row.id
+
+    @classmethod
+    def remember_curation(cls, state: GraphState, spotify_playlist_id: str | None, added_track_ids: list[int]) -> None:
+        if Config().SEMANTIC_CACHE and state.search_embedding is not None:
+            SemanticCurationCache.store(
+                state.search_embedding,
+                state.spotify_search_query,
+                spotify_playlist_id,
+                added_track_ids,
+            )
 
     async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> End:
         playlist = await PlaylistsDAO.create_or_get_playlist(ctx.deps.sid)
-        n_added_tracks = 0
-
-        for track in self.tracks:
-            brave_search_query = f"{track['name']} {track['artists'][0]['name']}"
-            try:
-                results: list[dict] = await BraveSearchService.search_youtube_for_videos(brave_search_query)
-                if not results:
-                    continue
+        # Tracks are published in small batches as they are verified, so
+        # that the first ones reach the listener long before the last track
+        # of the playlist has been processed.
+        batcher = ctx.deps.suggestion_batcher(playlist.id)
+        n_added_tracks = self.n_added_tracks
+        added_track_ids: list[int] = list(self.added_track_ids)
+
+        # The index of the track among the non-explicit tracks of the playlist
+        i = self.n_processed - 1
+        try:
+            async with aclosing(self.stream_tracks()) as tracks:
+                async for track in tracks:
+                    i += 1
+                    # Stop as soon as the target is met or the deadline has passed
+                    if ctx.deps.budget.should_stop(n_added_tracks):
+                        break
 
-                for youtube_result in results:
-                    similarity = Levenshtein.ratio(
-                        f"{track['name'].lower()} - {track['artists'][0]['name'].lower()}",
-                        youtube_result['title'].lower()
-                    )
+                    try:
+                        ctx.deps.budget.spend("search")
+                        youtube_result = await self.find_youtube_video(track)
+                        if youtube_result is None:
+                            continue
 
-                    if youtube_result and (similarity > 0.75) and ("watch" in youtube_result["url"]):
+                        ctx.deps.budget.spend("embedding")
                         embedding = await EmbeddingsService.create_track_embedding(
                             ctx.state.spotify_search_query,
-                            track["name"],
-                            track["artists"][0]["name"],
+                            track.name,
+                            track.artist,
                         )
-
-                        verified_track = {
-                            "title": track["name"],
-                            "uri": youtube_result["url"],
-                            "artist": track["artists"][0]["name"],
-                            "duration": track["duration_ms"],
-                            "explicit": track["explicit"],
-                            "image": track.get("album", {}).get("images", [{}])[0].get("url", None),
-                        }
-
-                        # Create the track in the database
-                        tid = await PlaylistsDAO.add_track_to_playlist(playlist.id, verified_track)
-                        # Add the track to suggestions
-                        await TracksDAO.update_track_embedding(tid, embedding)
+                        tid = await self.save_track(track, youtube_result, embedding)
                         n_added_tracks += 1
+                        if tid is not None:
+                            added_track_ids.append(tid)
+                            n_batches = batcher.n_batches
+                            await batcher.add(tid)
+                            # Once a batch is out, a retry can skip everything up to here
+                            if batcher.n_batches > n_batches:
+                                await ctx.deps.checkpoint(replace(
+                                    self, n_processed=i + 1, n_added_tracks=n_added_tracks,
+                                    added_track_ids=list(added_track_ids)), ctx.state)
+
+                    except BudgetExhausted as e:
+                        logging.getLogger(__name__).info(f"Stopping the curation early: {e}")
                         break
-
-            except Exception as e:
-                raise RuntimeError(
-                    f"Error searching and verifying YouTube for track '{track['name']}']: {e}")
-
+                    except Exception as e:
+                        raise RuntimeError(
+                            f"Error searching and verifying YouTube for track '{track.name}']: {e}")
+        except asyncio.CancelledError:
+            # E.g. the worker is draining: everything before the current track
+            # is published and recorded, so that the requeued message resumes
+            # right here.
+            await batcher.flush()
+            await ctx.deps.checkpoint(replace(
+                self, n_processed=max(i, self.n_processed), n_added_tracks=n_added_tracks,
+                added_track_ids=list(added_track_ids)), ctx.state)
+            raise
+        finally:
+            # Tracks saved before a failure are still published
+            await batcher.flush()
+
+        self.remember_curation(ctx.state, self.spotify_playlist_id, added_track_ids)
         return End(n_added_tracks)
 
 
@@ -240,7 +534,8 @@ class SourceSelectionRouterNode(BaseNode[GraphState, GraphDeps]):
         - The number of tracks curated for a specific genre
     """
 
-    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> Union["ReuseExistingDataNode", SearchSpotifyPlaylistsNode]:
+    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> \
+            Union["ReuseExistingDataNode", "ReuseCachedCurationNode", SearchSpotifyPlaylistsNode, End[int]]:
         """
         Executes the logic to determine whether to reuse existing data or search for new Spotify playlists.
 
@@ -251,7 +546,10 @@ class SourceSelectionRouterNode(BaseNode[GraphState, GraphDeps]):
         Returns:
             Union["ReuseExistingDataNode", SearchSpotifyPlaylistsNode]:
             - `ReuseExistingDataNode` if there are sufficient curations to reuse existing data.
+            - `ReuseCachedCurationNode` if new data would have to be curated, but a
+              semantically similar query has recently been curated by this process.
             - `SearchSpotifyPlaylistsNode` if new data needs to be curated.
+            - `End` with the tracks published so far if the embedding budget is exhausted.
 
         Workflow:
             1. Creates a search query embedding using the Spotify search query from the context state.
@@ -267,22 +565,44 @@ class SourceSelectionRouterNode(BaseNode[GraphState, GraphDeps]):
               from the list of similar tracks for faster lookup during filtering.
         """
 
+        try:
+            ctx.deps.budget.spend("embedding")
+        except BudgetExhausted as e:
+            logging.getLogger(__name__).info(f"Stopping the curation early: {e}")
+            ctx.deps.discard_speculation("budget exhausted")
+            return End(ctx.deps.budget.n_published)
         search_embedding = await EmbeddingsService.create_search_query_embedding(ctx.state.spotify_search_query)
-        all_similar_tracks_cos = await TracksDAO.get_similar_track_ids(search_embedding)
-        past_1_hour_suggestions = await SuggestionsDAO.get_past_n_hours_suggestions(ctx.deps.sid)
+        ctx.state.search_embedding = search_embedding
+        all_similar_tracks_cos = await get_similar_track_ids(search_embedding)
+        past_1_hour_suggestions = await SuggestionsDAO.get_past_n_hours_subscriber_suggestions(ctx.deps.sid)
         similar_track_ids = {t.id for t in all_similar_tracks_cos}
         suggestions_from_past_hour = [
             s for s in past_1_hour_suggestions if s.tid in similar_track_ids]
         ratio = len(suggestions_from_past_hour) / \
             len(all_similar_tracks_cos) if all_similar_tracks_cos else 0
         if (len(all_similar_tracks_cos) < 100) or (ratio > 0.5):
+            # Cached curations this subscriber already got everything from
+            # would publish nothing, and so would every retry of the message.
+            suggested_track_ids = {s.tid for s in past_1_hour_suggestions}
+            if Config().SEMANTIC_CACHE and \
+                    (cached := SemanticCurationCache.lookup(search_embedding, exclude=suggested_track_ids)):
+                ctx.deps.discard_speculation("semantic cache hit")
+                return ReuseCachedCurationNode(track_ids=cached.track_ids)
+            # The Spotify branch would fail fast, so whatever similar tracks
+            # there are make a better curation than none.
+            if all_similar_tracks_cos and Config().CIRCUIT_MIN_CALLS and \
+                    CircuitBreaker.first_open("spotify", "brave") is not None:
+                ctx.deps.discard_speculation("discovery circuit open")
+                return ReuseExistingDataNode(search_embedding=search_embedding)
             return SearchSpotifyPlaylistsNode()
+
+        ctx.deps.discard_speculation("router chose to reuse existing data")
         return ReuseExistingDataNode(search_embedding=search_embedding)
 
 
 @dataclass
 class ReuseExistingDataNode(BaseNode[GraphState, GraphDeps]):
-    search_embedding: list[float]
+    search_embedding: Embedding
 
     """
     Reuses existing data from the database. This is one of the most important
@@ -290,6 +610,9 @@ class ReuseExistingDataNode(BaseNode[GraphState, GraphDeps]):
     data, thus saving time and resources.
     """
 
+    def __post_init__(self):
+        self.search_embedding = as_embedding(self.search_embedding)
+
     async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> End:
         """
         This function must use the `search_embedding` class variable. The steps are
@@ -301,58 +624,183 @@ class ReuseExistingDataNode(BaseNode[GraphState, GraphDeps]):
         """
 
         # Step 1: Get track IDs most similar to `search_embedding`
-        similar_tracks = await TracksDAO.get_similar_track_ids(self.search_embedding)
+        similar_tracks = await get_similar_track_ids(self.search_embedding)
         # Step 2: Get the playlist ID from the database
         playlist = await PlaylistsDAO.create_or_get_playlist(ctx.deps.sid)
         # Step 3: Get the suggestions from the past hour
-        past_hour_suggestions = await SuggestionsDAO.get_past_n_hours_suggestions(ctx.deps.sid)
+        past_hour_suggestions = await SuggestionsDAO.get_past_n_hours_suggestions(playlist.id)
         # Step 4: Filter similar_tracks to exclude tracks from past hour suggestions
         past_hour_track_ids = {
             suggestion.tid for suggestion in past_hour_suggestions}
         filtered_tracks = [
             track for track in similar_tracks if track.id not in past_hour_track_ids]
+        if (wanted := ctx.deps.budget.tracks_wanted(0)) is not None:
+            filtered_tracks = filtered_tracks[:wanted]
 
-        # Add filtered tracks to the playlist
-        n_added_tracks = 0
+        # Add filtered tracks to the playlist. A batch which fails to publish
+        # fails the curation, whose retry skips the tracks published before.
+        batcher = ctx.deps.suggestion_batcher(playlist.id)
         for track in filtered_tracks:
-            try:
-                await SuggestionsDAO.add_track_to_suggestions(playlist.id, track.id)
-                n_added_tracks += 1
-            except Exception as e:
-                logging.getLogger(__name__).error(
-                    f"Error adding track '{track.title}' to playlist: {e}")
+            await batcher.add(track.id)
+        await batcher.flush()
 
-        return End(n_added_tracks)
+        return End(batcher.n_published)
+
+
+@dataclass
+class ReuseCachedCurationNode(BaseNode[GraphState, GraphDeps]):
+    """
+    Reuses the tracks of a recent Spotify curation whose search query was
+    semantically close to the current one, instead of running the Spotify
+    branch of the pipeline again.
+    """
+    track_ids: list[int]
+
+    async def run(self, ctx: GraphRunContext[GraphState, GraphDeps]) -> End:
+        playlist = await PlaylistsDAO.create_or_get_playlist(ctx.deps.sid)
+        past_hour_suggestions = await SuggestionsDAO.get_past_n_hours_suggestions(playlist.id)
+        past_hour_track_ids = {
+            suggestion.tid for suggestion in past_hour_suggestions}
+
+        track_ids = [tid for tid in self.track_ids if tid not in past_hour_track_ids]
+        if (wanted := ctx.deps.budget.tracks_wanted(0)) is not None:
+            track_ids = track_ids[:wanted]
+
+        # Like in `ReuseExistingDataNode`, publish errors fail the curation
+        batcher = ctx.deps.suggestion_batcher(playlist.id)
+        for tid in track_ids:
+            await batcher.add(tid)
+        await batcher.flush()
+
+        return End(batcher.n_published)
 
 
 @dataclass
 class MusicDiscoveryPipeline:
-    graph = Graph(
+    # Built on first use, like the agents of the nodes
+    graph = LazyAttribute(lambda: Graph(
         nodes=(
             GenerateSearchQueryNode,
             SourceSelectionRouterNode,
             ReuseExistingDataNode,
+            ReuseCachedCurationNode,
             SearchSpotifyPlaylistsNode,
             MatchQueryWithSpotifyPlaylist,
             SearchAndVerifyYoutubeAndSaveNode
         ),
         name="Music Discovery Pipeline",
         run_end_type=int
-    )
+    ))
+
+    @classmethod
+    async def restore(cls, deps: GraphDeps) -> tuple[BaseNode, GraphState]:
+        """
+        The node to start from and the state to start with: where a previous
+        attempt of the same message left off, or the beginning.
+        """
+        if deps.checkpointer is not None and (saved := await deps.checkpointer.load()):
+            node_def = cls.graph.node_defs.get(saved.node_id)
+            try:
+                node = node_def.node(**saved.node_data) if node_def is not None else None
+            except TypeError as e:
+                # Saved by a version of the node with different fields
+                logging.getLogger(__name__).warning(
+                    f"Ignoring incompatible checkpoint of curation `{deps.checkpointer.key}`: {e}")
+                node = None
+            if node is not None:
+                logging.getLogger(__name__).info(
+                    f"Resuming curation `{deps.checkpointer.key}` from {saved.node_id}")
+                metrics.CHECKPOINT_RESUMES.inc(node=saved.node_id)
+                return node, GraphState(**saved.state)
+
+        return GenerateSearchQueryNode(), GraphState()
 
     async def run(self, deps: GraphDeps):
-        flow = await self.graph.run(
-            GenerateSearchQueryNode(),
-            state=GraphState(),
-            deps=deps,
-        )
+        start_node, state = await self.restore(deps)
+        try:
+            async with self.graph.iter(
+                start_node,
+                state=state,
+                deps=deps,
+            ) as flow:
+                node = flow.next_node
+                while not isinstance(node, End):
+                    with metrics.NODE_DURATION.time(node=node.get_id()), FlightRecorder.span("node", node.get_id()), \
+                            UpstreamUsage.node(node.get_id()):
+                        node = await flow.next(node)
+                    if not isinstance(node, End):
+                        await deps.checkpoint(node, flow.state)
+        finally:
+            # Make sure that no speculative work outlives the pipeline run,
+            # e.g. when one of the nodes fails.
+            deps.discard_speculation("pipeline finished")
+
+        if deps.checkpointer is not None:
+            await deps.checkpointer.clear()
+        return node.data
+
+
+async def get_similar_track_ids(search_embedding: Embedding):
+    """
+    Answers similarity queries from the in-process vector index once it is
+    synchronized, falling back to PostgreSQL otherwise.
+    """
+    if TrackVectorIndex.is_ready():
+        return await TrackVectorIndex.get_similar_track_ids(search_embedding)
+    return await TracksDAO.get_similar_track_ids(search_embedding)
+
+
+async def speculative_discovery(query: str, prefilter: bool, budget: CurationBudget) -> SpeculativeDiscoveryResult:
+    """
+    Runs the Spotify branch of the pipeline up to (optionally) the playlist
+    prefilter, so that it can overlap with the source selection router.
+    """
+    found_playlists, _ = await SpotifyService.search_playlists(query=query)
+    if not prefilter or not found_playlists:
+        return SpeculativeDiscoveryResult(found_playlists)
 
-        return flow.output
+    matched_playlist = await MatchQueryWithSpotifyPlaylist.find_matching_playlist(query, found_playlists, budget)
+    return SpeculativeDiscoveryResult(found_playlists, matched_playlist=matched_playlist, prefiltered=True)
 
 
-async def curate(sid: int):
+async def curate(
+        sid: int,
+        pipeline=None,
+        published: asyncio.Event | None = None,
+        budget: CurationBudget | None = None,
+        checkpoint_key: str | None = None):
     """
-    Curates a playlist for a given subscriber ID.
+    Curates a playlist for a given subscriber ID, using the given execution
+    engine (the graph based `MusicDiscoveryPipeline` by default). The
+    `published` event is set as soon as the first batches of tracks are
+    visible to the subscriber.
+
+    The curation is bounded by the given budget, or by the configured one.
+    When its deadline passes, the curation is cancelled along with any
+    in-flight upstream calls, and the tracks published until then count as
+    its result.
+
+    With a `checkpoint_key`, usually the ID of the triggering message, the
+    progress is checkpointed after every node, and a later call with the same
+    key resumes from the last checkpoint.
     """
 
-    return await MusicDiscoveryPipeline().run(deps=GraphDeps(sid))
+    budget = budget or CurationBudget.from_config()
+    checkpointer = CurationCheckpointer(checkpoint_key, sid) if checkpoint_key else None
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with FlightRecorder.record(sid) as recording:
+            try:
+                async with asyncio.timeout_at(budget.deadline):
+                    n_added_tracks = await (pipeline or MusicDiscoveryPipeline()).run(
+                        deps=GraphDeps(sid, published=published, budget=budget, checkpointer=checkpointer))
+            except TimeoutError:
+                budget.mark_stopped("deadline")
+                if not budget.n_published:
+                    raise RuntimeError(f"Curation deadline exceeded for subscriber {sid}")
+                n_added_tracks = budget.n_published
+            outcome = recording.outcome = "curated" if n_added_tracks else "empty"
+        return n_added_tracks
+    finally:
+        metrics.CURATION_DURATION.observe(time.perf_counter() - start, outcome=outcome)
@@ -0,0 +1,85 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import logging
+from dataclasses import dataclass, asdict
+from typing import Any
+
+import numpy as np
+
+from internal.conf import Config
+from internal.models.dao import CheckpointsDAO
+
+logger = logging.getLogger(__name__)
+
+
+def _to_json(data: dict[str, Any]) -> dict[str, Any]:
+    # Embeddings are float32 arrays, which are stored as plain lists and
+    # turned back into arrays by the dataclasses they are restored into.
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in data.items()}
+
+
+@dataclass
+class SavedCheckpoint:
+    node_id: str
+    node_data: dict[str, Any]
+    state: dict[str, Any]
+
+
+@dataclass
+class CurationCheckpointer:
+    """
+    Durable progress of a single curation, keyed by the ID of the message
+    which triggered it. After every node the next node and the graph state
+    are stored, so that a redelivery of a failed message resumes where the
+    previous attempt left off instead of paying for the same LLM and search
+    calls again.
+
+    Checkpoints are best effort: failing to store one never fails the
+    curation itself.
+    """
+    key: str
+    sid: int
+
+    async def load(self) -> SavedCheckpoint | None:
+        try:
+            row = await CheckpointsDAO.get_checkpoint(self.key, Config().CHECKPOINT_TTL_HOURS)
+        except Exception as e:
+            logger.warning("Failed to load the checkpoint of `%s`: %s", self.key, e)
+            return None
+        if row is None:
+            return None
+        return SavedCheckpoint(row.node, row.node_data, row.state)
+
+    async def save(self, node, state) -> None:
+        """
+        Store the node which runs next (a dataclass) and the graph state.
+        """
+        try:
+            await CheckpointsDAO.save_checkpoint(
+                self.key, self.sid, node.get_id(), _to_json(asdict(node)), _to_json(asdict(state)))
+        except Exception as e:
+            logger.warning("Failed to checkpoint `%s` at %s: %s", self.key, node.get_id(), e)
+
+    async def clear(self) -> None:
+        try:
+            await CheckpointsDAO.delete_checkpoint(self.key, Config().CHECKPOINT_TTL_HOURS)
+        except Exception as e:
+            logger.warning("Failed to delete the checkpoint of `%s`: %s", self.key, e)
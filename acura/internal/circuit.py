@@ -0,0 +1,198 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import ClassVar
+
+from internal.conf import Config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an upstream whose circuit is open.
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"Circuit of upstream `{upstream}` is open, retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def circuit_open_in(error: BaseException | None) -> CircuitOpen | None:
+    """
+    The `CircuitOpen` which caused the given error, if any. The nodes wrap
+    the errors of their upstream calls, so the whole chain is searched.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, CircuitOpen):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Circuit breaker of a single upstream (see `metrics.track_upstream`).
+
+    While closed, the outcome and duration of every call of the last
+    `window` seconds is kept. Once at least `min_calls` calls were made and
+    the share of failed calls reaches `failure_rate`, or the share of calls
+    slower than `slow_call_seconds` reaches `slow_call_rate`, the circuit
+    opens: calls fail right away with `CircuitOpen` for `open_seconds`.
+    Then it turns half-open and lets `probes` calls through. It closes once
+    all of them succeeded in time, and opens again as soon as one did not.
+    """
+    upstream: str
+    failure_rate: float
+    slow_call_seconds: float
+    slow_call_rate: float
+    window: float
+    min_calls: int
+    open_seconds: float
+    probes: int
+    state: str = CLOSED
+    # (monotonic time, failed, slow) of the calls of the window
+    _calls: deque[tuple[float, bool, bool]] = field(default_factory=deque, repr=False)
+    _opened_at: float = 0.0
+    _probing: int = 0
+    _probe_successes: int = 0
+
+    _breakers: ClassVar[dict[str, "CircuitBreaker"]] = {}
+
+    @classmethod
+    def of(cls, upstream: str) -> "CircuitBreaker":
+        breaker = cls._breakers.get(upstream)
+        if breaker is None:
+            conf = Config()
+            breaker = cls._breakers[upstream] = cls(
+                upstream,
+                failure_rate=conf.CIRCUIT_FAILURE_RATE,
+                slow_call_seconds=parse_slow_call_seconds(conf.CIRCUIT_SLOW_CALL_SECONDS).get(
+                    upstream, float("inf")),
+                slow_call_rate=conf.CIRCUIT_SLOW_CALL_RATE,
+                window=conf.CIRCUIT_WINDOW,
+                min_calls=conf.CIRCUIT_MIN_CALLS,
+                open_seconds=conf.CIRCUIT_OPEN_SECONDS,
+                probes=conf.CIRCUIT_HALF_OPEN_PROBES,
+            )
+        return breaker
+
+    @classmethod
+    def first_open(cls, *upstreams: str) -> "CircuitBreaker | None":
+        return next((breaker for breaker in map(cls.of, upstreams) if breaker.is_open()), None)
+
+    def is_open(self) -> bool:
+        """
+        Whether calls are rejected right now, which is also the case while
+        half-open once all the probes are in flight.
+        """
+        if self.state == OPEN and time.monotonic() >= self._opened_at + self.open_seconds:
+            logger.info("Circuit of upstream `%s` is half-open, probing", self.upstream)
+            self.state = HALF_OPEN
+            self._probing = self._probe_successes = 0
+        return self.state == OPEN or (self.state == HALF_OPEN and self._probing >= self.probes)
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def check(self) -> None:
+        if self.is_open():
+            raise CircuitOpen(self.upstream, self.retry_after())
+
+    def before_call(self) -> bool:
+        """
+        Raise `CircuitOpen` if the call must not be made, and return whether
+        it is one of the probes of a half-open circuit.
+        """
+        self.check()
+        if self.state == HALF_OPEN:
+            self._probing += 1
+            return True
+        return False
+
+    def after_call(self, probe: bool, failed: bool | None, duration: float) -> None:
+        """
+        Record the outcome of a call started with `before_call`. Calls which
+        did not reach the upstream (`failed` is None) are not counted.
+        """
+        if probe and self.state == HALF_OPEN:
+            self._probing -= 1
+        if failed is not None:
+            self.record(failed, duration)
+
+    def record(self, failed: bool, duration: float) -> None:
+        slow = duration >= self.slow_call_seconds
+        if self.state == OPEN:
+            # Calls started before the circuit opened
+            return
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._open("a probe failed" if failed else "a probe was slow")
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.probes:
+                    logger.info("Circuit of upstream `%s` is closed again", self.upstream)
+                    self.state = CLOSED
+                    self._calls.clear()
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        if len(self._calls) < self.min_calls:
+            return
+        n_failed = sum(1 for _, failed, _ in self._calls if failed)
+        n_slow = sum(1 for _, _, slow in self._calls if slow)
+        if n_failed / len(self._calls) >= self.failure_rate:
+            self._open(f"{n_failed} of the last {len(self._calls)} calls failed")
+        elif n_slow / len(self._calls) >= self.slow_call_rate:
+            self._open(f"{n_slow} of the last {len(self._calls)} calls took {self.slow_call_seconds:g}s or more")
+
+    def _open(self, reason: str) -> None:
+        logger.warning("Circuit of upstream `%s` opened for %gs: %s", self.upstream, self.open_seconds, reason)
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+
+
+def parse_slow_call_seconds(spec: str) -> dict[str, float]:
+    """
+    Parses `upstream=seconds` pairs, e.g. "brave=5,spotify=5,openai=5,llm=30".
+    """
+    thresholds = {}
+    for pair in filter(None, (part.strip() for part in spec.split(","))):
+        upstream, _, seconds = pair.partition("=")
+        thresholds[upstream.strip()] = float(seconds)
+    return thresholds
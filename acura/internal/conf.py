@@ -49,6 +49,105 @@ class Config:
         self.LOGFIRE_TOKEN = os.getenv("LOGFIRE_TOKEN")
         self.OLLAMA_MODEL_NAME = os.getenv("OLLAMA_MODEL_NAME")
         self.OLLAMA_API_URL = os.getenv("OLLAMA_API_URL")
+        # Comma separated `agent=provider:model` pairs, where `|` separates the
+        # models to fall back to, e.g. "playlist_filter=ollama:qwen2.5:1.5b"
+        self.AGENT_MODELS = os.getenv("AGENT_MODELS", "")
+        # Start the Spotify search (and optionally the playlist prefilter)
+        # concurrently with the source selection router.
+        self.SPECULATIVE_DISCOVERY = bool(os.getenv("SPECULATIVE_DISCOVERY"))
+        self.SPECULATIVE_PREFILTER = bool(os.getenv("SPECULATIVE_PREFILTER"))
+        # Cross-subscriber cache of recent Spotify curations, keyed by the
+        # search query embedding.
+        self.SEMANTIC_CACHE = bool(os.getenv("SEMANTIC_CACHE"))
+        self.SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+        self.SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "900"))
+        self.SEMANTIC_CACHE_SIMILARITY = float(os.getenv("SEMANTIC_CACHE_SIMILARITY", "0.95"))
+        # Path prefix of the memory-mapped snapshot of track embeddings. The
+        # in-process vector index is disabled when this is not set.
+        self.VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH")
+        self.VECTOR_INDEX_SYNC_INTERVAL = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", "30"))
+        # Port of the Prometheus metrics endpoint, disabled when not set
+        self.METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+        self.METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+        # Budget of every curation, 0 means unlimited: the number of new tracks
+        # after which it stops, its deadline in seconds, and caps on the LLM,
+        # embedding and search calls it may make.
+        self.CURATION_TARGET_TRACKS = int(os.getenv("CURATION_TARGET_TRACKS", "0"))
+        self.CURATION_DEADLINE = float(os.getenv("CURATION_DEADLINE", "0"))
+        self.CURATION_MAX_LLM_CALLS = int(os.getenv("CURATION_MAX_LLM_CALLS", "0"))
+        self.CURATION_MAX_EMBEDDING_CALLS = int(os.getenv("CURATION_MAX_EMBEDDING_CALLS", "0"))
+        self.CURATION_MAX_SEARCH_CALLS = int(os.getenv("CURATION_MAX_SEARCH_CALLS", "0"))
+        # Checkpoints of failed curations older than this are not resumed
+        self.CHECKPOINT_TTL_HOURS = int(os.getenv("CHECKPOINT_TTL_HOURS", "6"))
+        # Run the hottest DAO queries as prepared statements on a dedicated
+        # asyncpg pool instead of through SQLAlchemy
+        self.DAO_FAST_PATH = bool(os.getenv("DAO_FAST_PATH"))
+        self.DAO_FAST_PATH_POOL_SIZE = int(os.getenv("DAO_FAST_PATH_POOL_SIZE", "5"))
+        # Suggestions are partitioned by month. Partitions whose rows are all
+        # older than SUGGESTIONS_RETENTION_DAYS are detached, and also dropped
+        # unless SUGGESTIONS_RETENTION_DETACH_ONLY is set (0 keeps them forever).
+        self.SUGGESTIONS_RETENTION_DAYS = int(os.getenv("SUGGESTIONS_RETENTION_DAYS", "0"))
+        self.SUGGESTIONS_RETENTION_DETACH_ONLY = bool(os.getenv("SUGGESTIONS_RETENTION_DETACH_ONLY"))
+        self.SUGGESTIONS_MAINTENANCE_INTERVAL = float(os.getenv("SUGGESTIONS_MAINTENANCE_INTERVAL", "3600"))
+        # Upstream calls and tokens are aggregated per subscriber and pipeline
+        # node, and added to the `upstream_usage` table every this many seconds
+        # (0 disables the accounting)
+        self.USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+        # Failed curations are retried after RETRY_BASE_DELAY seconds, doubling
+        # with every attempt, and dead-lettered after RETRY_MAX_ATTEMPTS retries
+        self.RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "15"))
+        self.RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+        # Number of shard queues messages are routed to by subscriber (0 keeps
+        # the single shared queue), and the heartbeat of the workers which
+        # share them out
+        self.SHARDS = int(os.getenv("SHARDS", "0"))
+        self.SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", "5"))
+        # Circuit breaker of every upstream: it opens for CIRCUIT_OPEN_SECONDS
+        # once CIRCUIT_FAILURE_RATE of the calls of the last CIRCUIT_WINDOW
+        # seconds failed, or CIRCUIT_SLOW_CALL_RATE of them were slower than
+        # the upstream's `upstream=seconds` threshold, and then lets
+        # CIRCUIT_HALF_OPEN_PROBES calls through (0 min calls disables them)
+        self.CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+        self.CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "60"))
+        self.CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+        self.CIRCUIT_SLOW_CALL_SECONDS = os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "brave=10,spotify=10,openai=10,llm=60")
+        self.CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+        self.CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+        self.CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "3"))
+        # Messages waiting for a curation slot gain one priority level (see
+        # `internal.priority`) for every this many seconds they wait
+        self.PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "30"))
+        # On SIGTERM, curations in flight get this many seconds to finish before
+        # their messages are requeued (a second signal stops right away)
+        self.DRAIN_GRACE_PERIOD = float(os.getenv("DRAIN_GRACE_PERIOD", "25"))
+        # Decisions of the playlist filter agent are reused for this long
+        # (0 disables the decision cache)
+        self.PLAYLIST_DECISIONS_TTL_HOURS = int(os.getenv("PLAYLIST_DECISIONS_TTL_HOURS", "168"))
+        # Search queries of curations starting within this many seconds of each
+        # other are generated by a single LLM request (0 disables batching)
+        self.QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW", "0"))
+        self.QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "16"))
+        # Execution engine of `curate()`: "graph" runs every curation end to end
+        # in its own task, "streaming" splits it into stages with their own
+        # worker pools connected by bounded queues.
+        self.PIPELINE_ENGINE = os.getenv("PIPELINE_ENGINE", "graph")
+        self.STREAMING_MAX_JOBS = int(os.getenv("STREAMING_MAX_JOBS", "50"))
+        self.STREAMING_QUEUE_SIZE = int(os.getenv("STREAMING_QUEUE_SIZE", "100"))
+        # Comma separated `stage=workers` pairs, e.g. "verification=32,embedding=8"
+        self.STREAMING_WORKERS = os.getenv("STREAMING_WORKERS", "")
+        # Curated tracks are published to the playlist in batches of this size,
+        # and the message is acknowledged after the given number of batches
+        # (0 waits for the whole curation).
+        self.PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "5"))
+        self.PUBLISH_ACK_AFTER_BATCHES = int(os.getenv("PUBLISH_ACK_AFTER_BATCHES", "1"))
+        # On-demand sampling profiler (toggled by SIGUSR1 or a control message)
+        # and flight recorder of the slowest curations (dumped by SIGUSR2).
+        self.PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/acura-profiles")
+        self.PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+        self.PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+        self.FLIGHT_RECORDER_SIZE = int(os.getenv("FLIGHT_RECORDER_SIZE", "20"))
+        # Event loop stall detection threshold in seconds, 0 disables it
+        self.LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.5"))
 
         if os.getenv("DEBUG"):
             self.DEBUG = True
@@ -0,0 +1,158 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import ClassVar
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    # Offset from the start of the curation, in seconds
+    start: float
+    duration: float
+    outcome: str
+
+
+@dataclass
+class CurationRecording:
+    """
+    Timing breakdown of a single `curate()` run: every pipeline node and
+    every upstream call made on its behalf, in start order.
+    """
+    sid: int
+    started_at: float = field(default_factory=time.time)
+    duration: float | None = None
+    outcome: str | None = None
+    spans: list[Span] = field(default_factory=list)
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+
+_current: contextvars.ContextVar[CurationRecording | None] = contextvars.ContextVar(
+    "curation_recording", default=None)
+
+
+@dataclass
+class FlightRecorder:
+    """
+    Keeps the full span breakdown of the N slowest `curate()` runs of this
+    process for post-mortem analysis.
+    """
+    capacity: ClassVar[int] = 20
+    # Min-heap of (duration, tie breaker, recording), so that the fastest of
+    # the retained recordings is evicted first.
+    _slowest: ClassVar[list[tuple[float, int, CurationRecording]]] = []
+    _counter: ClassVar[itertools.count] = itertools.count()
+
+    @classmethod
+    @contextmanager
+    def record(cls, sid: int):
+        """
+        Record the wrapped curation. Spans started in tasks spawned from the
+        wrapped block are attributed to the same recording.
+        """
+        recording = CurationRecording(sid)
+        token = _current.set(recording)
+        recording.outcome = "error"
+        try:
+            yield recording
+        finally:
+            _current.reset(token)
+            recording.duration = time.perf_counter() - recording._start
+            cls._retain(recording)
+
+    @classmethod
+    def current(cls) -> CurationRecording | None:
+        return _current.get()
+
+    @classmethod
+    @contextmanager
+    def resume(cls, recording: CurationRecording | None):
+        """
+        Attribute the spans of the wrapped block to the given recording, for
+        work done on behalf of a curation outside of its own task.
+        """
+        token = _current.set(recording)
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    @classmethod
+    def _retain(cls, recording: CurationRecording) -> None:
+        entry = (recording.duration, next(cls._counter), recording)
+        if len(cls._slowest) < cls.capacity:
+            heapq.heappush(cls._slowest, entry)
+        elif recording.duration > cls._slowest[0][0]:
+            heapq.heapreplace(cls._slowest, entry)
+
+    @classmethod
+    @contextmanager
+    def span(cls, kind: str, name: str):
+        """
+        Add a span to the recording of the current curation, if any.
+        """
+        recording = _current.get()
+        if recording is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            end = time.perf_counter()
+            recording.spans.append(Span(kind, name, start - recording._start, end - start, outcome))
+
+    @classmethod
+    def slowest(cls) -> list[CurationRecording]:
+        return [recording for _, _, recording in sorted(cls._slowest, reverse=True)]
+
+    @classmethod
+    def dump(cls, directory: str) -> str:
+        """
+        Write the retained recordings, slowest first, to a JSON file in the
+        given directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"acura-{os.getpid()}-{int(time.time())}.flight.json")
+        recordings = []
+        for recording in cls.slowest():
+            data = asdict(recording)
+            data.pop("_start")
+            recordings.append(data)
+
+        with open(path, "w") as f:
+            json.dump(recordings, f, indent=2)
+        logger.info("Wrote %d flight recordings to %s", len(recordings), path)
+        return path
@@ -0,0 +1,39 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+from dataclasses import dataclass
+from typing import ClassVar
+
+
+@dataclass
+class WorkerHealth:
+    """
+    Liveness and readiness of the worker, served next to the metrics (see
+    `metrics.serve`). The worker is live as long as its event loop answers,
+    and ready only while it consumes messages: it turns unready as soon as
+    it starts draining, so that the orchestrator can tell a draining worker
+    from a stuck one.
+    """
+    consuming: ClassVar[bool] = False
+    draining: ClassVar[bool] = False
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        return cls.consuming and not cls.draining
@@ -0,0 +1,365 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import ClassVar
+
+from internal.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from internal.conf import Config
+from internal.flight_recorder import FlightRecorder
+from internal.health import WorkerHealth
+from internal.usage import UpstreamUsage
+
+logger = logging.getLogger(__name__)
+
+# Curations take anywhere from milliseconds (cache hits) to minutes (large
+# playlists with slow upstreams), hence the wide range.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+@dataclass
+class Metric:
+    """
+    Base class of all metrics. Every metric registers itself with the
+    process-wide registry on creation, so that it is exposed automatically.
+    """
+    name: str
+    documentation: str
+    labelnames: tuple[str, ...] = ()
+
+    registry: ClassVar[list["Metric"]] = []
+    type_name: ClassVar[str] = "untyped"
+
+    def __post_init__(self):
+        Metric.registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric `{self.name}` expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+@dataclass
+class Counter(Metric):
+    _values: dict[tuple[str, ...], float] = field(default_factory=dict, repr=False)
+
+    type_name: ClassVar[str] = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+@dataclass
+class Gauge(Metric):
+    _values: dict[tuple[str, ...], float] = field(default_factory=dict, repr=False)
+
+    type_name: ClassVar[str] = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+@dataclass
+class Histogram(Metric):
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    # Per label set: non-cumulative bucket counts, sum and count
+    _values: dict[tuple[str, ...], list] = field(default_factory=dict, repr=False)
+
+    type_name: ClassVar[str] = "histogram"
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        if key not in self._values:
+            self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts, _, _ = entry = self._values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the wrapped block, whether it succeeds or not.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+NODE_DURATION = Histogram(
+    "acura_graph_node_duration_seconds", "Duration of the music discovery pipeline nodes.", ("node",))
+CURATION_DURATION = Histogram(
+    "acura_curation_duration_seconds", "Duration of complete curate() runs.", ("outcome",))
+UPSTREAM_DURATION = Histogram(
+    "acura_upstream_request_duration_seconds",
+    "Duration of calls to upstream services (Spotify, Brave Search, OpenAI embeddings, LLM).",
+    ("upstream", "operation"))
+UPSTREAM_REQUESTS = Counter(
+    "acura_upstream_requests_total", "Calls to upstream services by outcome.", ("upstream", "operation", "outcome"))
+LLM_FALLBACKS = Counter(
+    "acura_llm_fallbacks_total",
+    "Failed LLM requests of agents with fallback models, which the next model retries if any.", ("agent",))
+DAO_DURATION = Histogram(
+    "acura_dao_query_duration_seconds", "Duration of DAO methods.", ("method",))
+SEMAPHORE_WAIT = Histogram(
+    "acura_consumer_semaphore_wait_seconds", "Time messages wait for a free curation slot, by urgency.", ("urgency",))
+MESSAGES = Counter(
+    "acura_messages_total",
+    "Processed AMQP messages by outcome (ack, early_ack, retry, requeue, delay, dead_letter, reject).",
+    ("outcome",))
+OWNED_SHARDS = Gauge(
+    "acura_owned_shards", "Shard queues consumed by this worker, when sharding is enabled.")
+IN_FLIGHT = Gauge(
+    "acura_curations_in_flight", "Curations currently holding a worker slot.")
+SPECULATIONS = Counter(
+    "acura_speculative_discoveries_total", "Speculative discovery tasks by outcome.", ("outcome",))
+SPECULATION_WASTED = Counter(
+    "acura_speculative_wasted_seconds_total", "Seconds of speculative discovery work which was thrown away.")
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "acura_semantic_cache_lookups_total", "Semantic curation cache lookups by result.", ("result",))
+PLAYLIST_DECISION_LOOKUPS = Counter(
+    "acura_playlist_decision_lookups_total", "Playlist filter decision cache lookups by result.", ("result",))
+TIME_TO_FIRST_TRACK = Histogram(
+    "acura_time_to_first_track_seconds", "Time from the start of a curation until its first tracks are published.")
+QUERY_BATCH_SIZE = Histogram(
+    "acura_query_generation_batch_size", "Prompts answered per search query generation request.",
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+CHECKPOINT_RESUMES = Counter(
+    "acura_checkpoint_resumes_total", "Curations resumed from a checkpoint, by the node they resumed at.", ("node",))
+BUDGET_STOPS = Counter(
+    "acura_budget_stops_total",
+    "Curations stopped early by their budget, by reason (target, deadline, llm, embedding, search).", ("reason",))
+STAGE_DURATION = Histogram(
+    "acura_stage_item_duration_seconds", "Time the streaming pipeline stages spend per work item.", ("stage",))
+STAGE_QUEUE_DEPTH = Gauge(
+    "acura_stage_queue_depth", "Work items waiting in front of every streaming pipeline stage.", ("stage",))
+CIRCUIT_STATE = Gauge(
+    "acura_circuit_state", "State of the circuit breaker of every upstream (0 closed, 1 half-open, 2 open).",
+    ("upstream",))
+LOOP_STALLS = Counter(
+    "acura_event_loop_stalls_total", "Times the event loop did not respond within the stall threshold.")
+
+
+_CIRCUIT_STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+@dataclass
+class _UpstreamCall:
+    upstream: str
+    n_attempts: int = 0
+
+
+# The `track_upstream` call in progress, see `record_attempt`
+_upstream_call: ContextVar[_UpstreamCall | None] = ContextVar("upstream_call", default=None)
+
+
+@contextmanager
+def track_upstream(upstream: str, operation: str):
+    """
+    Record the duration and the outcome of a call to an upstream service, and
+    count it in the `UpstreamUsage` of the current subscriber and node. Calls
+    to an upstream whose circuit is open fail right away with `CircuitOpen`,
+    see `CircuitBreaker`.
+    """
+    breaker = CircuitBreaker.of(upstream) if Config().CIRCUIT_MIN_CALLS else None
+    try:
+        probe = breaker.before_call() if breaker is not None else False
+    except CircuitOpen:
+        UPSTREAM_REQUESTS.inc(upstream=upstream, operation=operation, outcome="circuit_open")
+        CIRCUIT_STATE.set(_CIRCUIT_STATES[breaker.state], upstream=upstream)
+        raise
+
+    outcome = "error"
+    failed: bool | None = True
+    start = time.perf_counter()
+    call = _UpstreamCall(upstream)
+    token = _upstream_call.set(call)
+    try:
+        with UPSTREAM_DURATION.time(upstream=upstream, operation=operation), \
+                FlightRecorder.span("upstream", f"{upstream}.{operation}"):
+            yield
+        outcome = "ok"
+        failed = False
+    except BaseException as e:
+        # Cancellations, and circuits opened by the retries of this very
+        # call, say nothing about the health of the upstream
+        if isinstance(e, CircuitOpen) or not isinstance(e, Exception):
+            failed = None
+        raise
+    finally:
+        _upstream_call.reset(token)
+        UPSTREAM_REQUESTS.inc(upstream=upstream, operation=operation, outcome=outcome)
+        UpstreamUsage.record(upstream, calls=1)
+        if breaker is not None:
+            # The attempts of services which retry on their own were counted
+            # one by one already.
+            breaker.after_call(probe, None if call.n_attempts else failed, time.perf_counter() - start)
+            CIRCUIT_STATE.set(_CIRCUIT_STATES[breaker.state], upstream=upstream)
+
+
+def record_attempt(upstream: str, failed: bool, duration: float) -> None:
+    """
+    For services which retry within a single `track_upstream` call: count
+    one attempt in the circuit of the upstream, instead of the call as a
+    whole, whose duration would include the backoff between attempts.
+    """
+    call = _upstream_call.get()
+    if call is None or call.upstream != upstream:
+        return
+    call.n_attempts += 1
+    if Config().CIRCUIT_MIN_CALLS:
+        CircuitBreaker.of(upstream).record(failed, duration)
+
+
+def instrument_upstream(upstream: str):
+    """
+    Decorator for async service methods, see `track_upstream`. Must be placed
+    below `@classmethod`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_upstream(upstream, func.__name__):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_query(func):
+    """
+    Decorator for async DAO methods. Must be placed below `@classmethod`.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with DAO_DURATION.time(method=func.__qualname__), FlightRecorder.span("dao", func.__qualname__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+def render() -> str:
+    """
+    All registered metrics in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in Metric.registry) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        # Drain the headers, the request body is never used
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 and parts[0] == "GET" else None
+        if path == "/metrics":
+            status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", render()
+        elif path == "/livez":
+            status, content_type, body = "200 OK", "text/plain; charset=utf-8", "ok\n"
+        elif path == "/readyz":
+            if WorkerHealth.is_ready():
+                status, content_type, body = "200 OK", "text/plain; charset=utf-8", "ready\n"
+            else:
+                status, content_type, body = "503 Service Unavailable", "text/plain; charset=utf-8", (
+                    "draining\n" if WorkerHealth.draining else "starting\n")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "Not Found\n"
+
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+    except Exception as e:
+        logger.warning("Failed to serve metrics request: %s", e)
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Expose the metrics at `http://<host>:<port>/metrics`, along with the
+    liveness (`/livez`) and readiness (`/readyz`) of the worker.
+    """
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("Serving Prometheus metrics on %s:%s", host, port)
+    return server
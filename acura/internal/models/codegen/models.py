@@ -1,7 +1,8 @@
 from typing import Any, List, Optional
 
 from pgvector.sqlalchemy.vector import VECTOR
-from sqlalchemy import ARRAY, Boolean, Column, Date, DateTime, ForeignKeyConstraint, Index, Integer, PrimaryKeyConstraint, String, Table, Text, UniqueConstraint, Uuid, text
+from sqlalchemy import ARRAY, BigInteger, Boolean, Column, Date, DateTime, ForeignKeyConstraint, Identity, Index, Integer, PrimaryKeyConstraint, String, Table, Text, UniqueConstraint, Uuid, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 import datetime
 import uuid
@@ -30,7 +31,7 @@ class Subscribers(Base):
     created_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
     note: Mapped[Optional[str]] = mapped_column(Text)
 
-    suggestion: Mapped[List['Suggestions']] = relationship('Suggestions', secondary='playback', back_populates='subscriber')
+    curation_checkpoints: Mapped[List['CurationCheckpoints']] = relationship('CurationCheckpoints', back_populates='subscribers')
     playlists: Mapped[List['Playlists']] = relationship('Playlists', back_populates='subscribers')
     prompts: Mapped[List['Prompts']] = relationship('Prompts', back_populates='subscribers')
 
@@ -56,6 +57,56 @@ class Tracks(Base):
     suggestions: Mapped[List['Suggestions']] = relationship('Suggestions', back_populates='tracks')
 
 
+class CurationCheckpoints(Base):
+    __tablename__ = 'curation_checkpoints'
+    __table_args__ = (
+        ForeignKeyConstraint(['sid'], ['subscribers.id'], ondelete='CASCADE', name='curation_checkpoints_sid_fkey'),
+        PrimaryKeyConstraint('key', name='curation_checkpoints_pkey'),
+        Index('idx_curation_checkpoints_updated_at', 'updated_at')
+    )
+
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    sid: Mapped[int] = mapped_column(Integer)
+    node: Mapped[str] = mapped_column(Text)
+    node_data: Mapped[dict] = mapped_column(JSONB)
+    state: Mapped[dict] = mapped_column(JSONB)
+    updated_at: Mapped[datetime.datetime] = mapped_column(DateTime(True), server_default=text('now()'))
+
+    subscribers: Mapped['Subscribers'] = relationship('Subscribers', back_populates='curation_checkpoints')
+
+
+class PlaylistFilterDecisions(Base):
+    __tablename__ = 'playlist_filter_decisions'
+    __table_args__ = (
+        PrimaryKeyConstraint('spotify_playlist_id', 'query_key', name='playlist_filter_decisions_pkey'),
+        Index('idx_playlist_filter_decisions_decided_at', 'decided_at')
+    )
+
+    spotify_playlist_id: Mapped[str] = mapped_column(Text, primary_key=True)
+    query_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    playlist_digest: Mapped[str] = mapped_column(Text)
+    matches: Mapped[bool] = mapped_column(Boolean)
+    decided_at: Mapped[datetime.datetime] = mapped_column(DateTime(True), server_default=text('now()'))
+
+
+class UpstreamUsage(Base):
+    __tablename__ = 'upstream_usage'
+    __table_args__ = (
+        PrimaryKeyConstraint('id', name='upstream_usage_pkey'),
+        UniqueConstraint('period_start', 'sid', 'node', 'upstream', name='upstream_usage_period_start_sid_node_upstream_key'),
+        Index('idx_upstream_usage_sid_period_start', 'sid', 'period_start')
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, Identity(always=True, start=1, increment=1, minvalue=1, maxvalue=9223372036854775807, cycle=False, cache=1), primary_key=True)
+    period_start: Mapped[datetime.datetime] = mapped_column(DateTime(True))
+    upstream: Mapped[str] = mapped_column(Text)
+    calls: Mapped[int] = mapped_column(BigInteger, server_default=text('0'))
+    input_tokens: Mapped[int] = mapped_column(BigInteger, server_default=text('0'))
+    output_tokens: Mapped[int] = mapped_column(BigInteger, server_default=text('0'))
+    sid: Mapped[Optional[int]] = mapped_column(Integer)
+    node: Mapped[Optional[str]] = mapped_column(Text)
+
+
 class Playlists(Base):
     __tablename__ = 'playlists'
     __table_args__ = (
@@ -92,15 +143,15 @@ class Suggestions(Base):
     __table_args__ = (
         ForeignKeyConstraint(['pid'], ['playlists.id'], ondelete='CASCADE', name='suggestions_pid_fkey'),
         ForeignKeyConstraint(['tid'], ['tracks.id'], ondelete='CASCADE', name='suggestions_tid_fkey'),
-        PrimaryKeyConstraint('id', name='suggestions_pkey')
+        PrimaryKeyConstraint('id', 'added_at', name='suggestions_pkey'),
+        Index('idx_suggestions_pid_added_at', 'pid', 'added_at')
     )
 
     pid: Mapped[int] = mapped_column(Integer)
     tid: Mapped[int] = mapped_column(Integer)
+    added_at: Mapped[datetime.datetime] = mapped_column(DateTime(True), primary_key=True, server_default=text('now()'))
     id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, server_default=text('gen_random_uuid()'))
-    added_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
 
-    subscriber: Mapped[List['Subscribers']] = relationship('Subscribers', secondary='playback', back_populates='suggestion')
     playlists: Mapped['Playlists'] = relationship('Playlists', back_populates='suggestions')
     tracks: Mapped['Tracks'] = relationship('Tracks', back_populates='suggestions')
 
@@ -110,6 +161,5 @@ t_playback = Table(
     Column('subscriber_id', Integer, primary_key=True),
     Column('suggestion_id', Uuid),
     ForeignKeyConstraint(['subscriber_id'], ['subscribers.id'], ondelete='CASCADE', name='playback_sid_fkey'),
-    ForeignKeyConstraint(['suggestion_id'], ['suggestions.id'], ondelete='CASCADE', name='playback_suggestion_id_fkey'),
     PrimaryKeyConstraint('subscriber_id', name='playback_pkey')
 )
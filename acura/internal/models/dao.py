@@ -18,25 +18,38 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
+import json
 from dataclasses import dataclass
-from internal.models.codegen import Subscribers, Prompts, Playlists, Tracks, Suggestions
-from internal.models.sql import SQLDatabase
-from sqlalchemy import select, insert, func, literal_column, update, asc, text
+from internal.models.codegen import Subscribers, Prompts, Playlists, Tracks, Suggestions, CurationCheckpoints, \
+    PlaylistFilterDecisions, UpstreamUsage
+from internal.models.sql import SQLDatabase, EmbeddingVector
+from internal.models.prepared import PreparedQueries
+from internal.conf import Config
+from sqlalchemy import select, insert, delete, func, literal_column, update, asc, text, or_, type_coerce
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
 from sqlalchemy.exc import IntegrityError
 from asyncpg.exceptions import UniqueViolationError
-from internal.services.embeddings import EmbeddingsService
+from internal.services.embeddings import Embedding
+from internal.metrics import instrument_query
 
 logger = logging.getLogger(__name__)
 
+# Postgres NOTIFY channel announcing every batch of new suggestions
+SUGGESTIONS_CHANNEL = "acura_suggestions"
+
 
 @dataclass
 class SubscribersDAO:
     @classmethod
+    @instrument_query
     async def get_subscriber_by_license(cls, license: str):
         """
         Retrieve the subscriber from the database based on the provided license key.
         """
+        if Config().DAO_FAST_PATH:
+            return await PreparedQueries.get_subscriber_by_license(license)
+
         async with SQLDatabase.connection() as pg:
             r = await pg.execute(select(Subscribers).where(Subscribers.license == license))
             return r.one_or_none()
@@ -45,6 +58,7 @@ class SubscribersDAO:
 @dataclass
 class PromptsDAO:
     @classmethod
+    @instrument_query
     async def get_subscriber_prompts_by_sid(cls, sid: int):
         """
         Retrieve the prompt from the database based on the provided prompt ID.
@@ -57,6 +71,7 @@ class PromptsDAO:
 @dataclass
 class PlaylistsDAO:
     @classmethod
+    @instrument_query
     async def create_or_get_playlist(cls, sid: int):
         """
         Create a new playlist for the current date or return the existing one.
@@ -85,6 +100,7 @@ class PlaylistsDAO:
             return r.one_or_none()
 
     @classmethod
+    @instrument_query
     async def add_track_to_playlist(cls, playlist_id: int, track_data: dict):
         """
         Given a list of track data, create each track record (if possible)
@@ -98,6 +114,7 @@ class PlaylistsDAO:
 @dataclass
 class TracksDAO:
     @classmethod
+    @instrument_query
     async def get_tracks_by_ids(cls, track_ids: list[int]):
         """
         Retrieve tracks from the database based on a list of track IDs.
@@ -107,7 +124,8 @@ class TracksDAO:
             return r.all()
 
     @classmethod
-    async def update_track_embedding(cls, track_id: int, embedding: list[float]):
+    @instrument_query
+    async def update_track_embedding(cls, track_id: int, embedding: Embedding):
         """
         Update the embedding for a given track ID.
         """
@@ -115,17 +133,21 @@ class TracksDAO:
             r = await pg.execute(
                 update(Tracks)
                 .where(Tracks.id == track_id)
-                .values(search_embedding=embedding)
+                .values(search_embedding=type_coerce(embedding, EmbeddingVector(1024)))
             )
 
             return r.rowcount
 
     @classmethod
-    async def get_similar_track_ids(cls, search_embedding: list[float], sim_threshold: float = 0.5):
+    @instrument_query
+    async def get_similar_track_ids(cls, search_embedding: Embedding, sim_threshold: float = 0.5):
         """
         Retrieve tracks with a cosine distance less than 0.5 from the given embedding.
         """
+        if Config().DAO_FAST_PATH:
+            return await PreparedQueries.get_similar_track_ids(search_embedding, sim_threshold)
 
+        search_embedding = type_coerce(search_embedding, EmbeddingVector(1024))
         async with SQLDatabase.connection() as pg:
             r = await pg.execute(
                 select(Tracks.id)
@@ -135,11 +157,46 @@ class TracksDAO:
             return r.all()
 
     @classmethod
-    async def n_similar_tracks_count(cls, search_embedding: list[float]):
+    @instrument_query
+    async def get_track_embeddings_after(cls, track_id: int, limit: int):
+        """
+        Retrieve the IDs and embeddings of the tracks created after the given
+        track ID, in ID order.
+        """
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(Tracks.id, Tracks.search_embedding)
+                .where(Tracks.id > track_id)
+                .order_by(asc(Tracks.id))
+                .limit(limit)
+            )
+
+            return r.all()
+
+    @classmethod
+    @instrument_query
+    async def get_track_embeddings_by_ids(cls, track_ids: list[int]):
+        """
+        Retrieve the IDs and embeddings of the given tracks.
+        """
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(Tracks.id, Tracks.search_embedding)
+                .where(Tracks.id.in_(track_ids))
+            )
+
+            return r.all()
+
+    @classmethod
+    @instrument_query
+    async def n_similar_tracks_count(cls, search_embedding: Embedding):
         """
         Count the number of tracks with a cosine distance less than 0.5 from the given embedding.
         """
 
+        search_embedding = type_coerce(search_embedding, EmbeddingVector(1024))
         async with SQLDatabase.connection() as pg:
             r = await pg.execute(
                 select(func.count(Tracks.id))
@@ -150,6 +207,7 @@ class TracksDAO:
             return r.scalar_one_or_none()
 
     @classmethod
+    @instrument_query
     async def create_track(cls, track_data: dict):
         """
         Attempt to create a track in the database from the given track data.
@@ -179,10 +237,14 @@ class TracksDAO:
 @dataclass
 class SuggestionsDAO:
     @classmethod
+    @instrument_query
     async def get_past_n_hours_suggestions(cls, playlist_id: int, hours: int = 1):
         """
         Retrieve suggestions from the past specified hours for a given playlist.
+        The bound on `added_at` restricts the scan to the latest partitions.
         """
+        if Config().DAO_FAST_PATH:
+            return await PreparedQueries.get_recent_suggestions(playlist_id, hours)
 
         async with SQLDatabase.connection() as pg:
             r = await pg.execute(
@@ -194,6 +256,45 @@ class SuggestionsDAO:
             return r.all()
 
     @classmethod
+    @instrument_query
+    async def get_past_n_hours_subscriber_suggestions(cls, sid: int, hours: int = 1):
+        """
+        Retrieve suggestions from the past specified hours across all the
+        playlists of a given subscriber.
+        """
+        if Config().DAO_FAST_PATH:
+            return await PreparedQueries.get_recent_subscriber_suggestions(sid, hours)
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(Suggestions.pid, Suggestions.tid, Suggestions.added_at)
+                .join(Playlists, Playlists.id == Suggestions.pid)
+                .where(Playlists.sid == sid)
+                .where(Suggestions.added_at > func.now() - text(f"INTERVAL '{hours} hours'"))
+            )
+
+            return r.all()
+
+    @classmethod
+    @instrument_query
+    async def maintain_partitions(cls, retention_days: int | None, drop_detached: bool = True) -> int:
+        """
+        Create the upcoming monthly partitions of the Suggestions table and
+        remove the ones older than the given number of days (none when it is
+        None), see the `maintain_suggestions_partitions` database function.
+        Returns the number of removed partitions.
+        """
+
+        retention = text(f"INTERVAL '{retention_days} days'") if retention_days else text("NULL::INTERVAL")
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(func.maintain_suggestions_partitions(retention, drop_detached))
+            )
+
+            return r.scalar_one()
+
+    @classmethod
+    @instrument_query
     async def add_track_to_suggestions(cls, playlist_id: int, track_id: int):
         """
         Insert a record into the Suggestions table linking the playlist and track.
@@ -207,3 +308,153 @@ class SuggestionsDAO:
             )
 
             return r.one_or_none()
+
+    @classmethod
+    @instrument_query
+    async def publish_suggestions(cls, sid: int, playlist_id: int, track_ids: list[int]):
+        """
+        Insert a batch of suggestions with a single statement and announce it
+        on the `acura_suggestions` channel, so that listeners can pick up the
+        new tracks without waiting for the whole curation.
+        """
+        if Config().DAO_FAST_PATH:
+            return await PreparedQueries.publish_suggestions(SUGGESTIONS_CHANNEL, sid, playlist_id, track_ids)
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                insert(Suggestions)
+                .values([{"pid": playlist_id, "tid": tid} for tid in track_ids])
+                .returning(Suggestions.tid)
+            )
+            inserted = r.scalars().all()
+
+            payload = json.dumps({"sid": sid, "playlist_id": playlist_id, "track_ids": inserted})
+            await pg.execute(select(func.pg_notify(SUGGESTIONS_CHANNEL, payload)))
+            return inserted
+
+
+@dataclass
+class CheckpointsDAO:
+    @classmethod
+    @instrument_query
+    async def get_checkpoint(cls, key: str, max_age_hours: int):
+        """
+        Retrieve the checkpoint stored under the given key, unless it is older
+        than the given number of hours.
+        """
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(CurationCheckpoints.node, CurationCheckpoints.node_data, CurationCheckpoints.state)
+                .where(CurationCheckpoints.key == key)
+                .where(CurationCheckpoints.updated_at > func.now() - text(f"INTERVAL '{max_age_hours} hours'"))
+            )
+
+            return r.one_or_none()
+
+    @classmethod
+    @instrument_query
+    async def save_checkpoint(cls, key: str, sid: int, node: str, node_data: dict, state: dict):
+        """
+        Insert or overwrite the checkpoint stored under the given key.
+        """
+
+        values = {"node": node, "node_data": node_data, "state": state, "updated_at": func.now()}
+        async with SQLDatabase.connection() as pg:
+            await pg.execute(
+                pg_insert(CurationCheckpoints)
+                .values(key=key, sid=sid, **values)
+                .on_conflict_do_update(index_elements=[CurationCheckpoints.key], set_=values)
+            )
+
+    @classmethod
+    @instrument_query
+    async def delete_checkpoint(cls, key: str, max_age_hours: int):
+        """
+        Delete the checkpoint stored under the given key, along with all the
+        checkpoints which expired without ever being resumed.
+        """
+
+        async with SQLDatabase.connection() as pg:
+            await pg.execute(
+                delete(CurationCheckpoints)
+                .where(or_(
+                    CurationCheckpoints.key == key,
+                    CurationCheckpoints.updated_at < func.now() - text(f"INTERVAL '{max_age_hours} hours'"),
+                ))
+            )
+
+
+@dataclass
+class PlaylistFilterDecisionsDAO:
+    @classmethod
+    @instrument_query
+    async def get_decisions(cls, query_key: str, spotify_playlist_ids: list[str], max_age_hours: int):
+        """
+        Retrieve the decisions made for the given canonical query about any
+        of the given playlists, unless they are older than the given number
+        of hours.
+        """
+
+        async with SQLDatabase.connection() as pg:
+            r = await pg.execute(
+                select(
+                    PlaylistFilterDecisions.spotify_playlist_id,
+                    PlaylistFilterDecisions.playlist_digest,
+                    PlaylistFilterDecisions.matches)
+                .where(PlaylistFilterDecisions.query_key == query_key)
+                .where(PlaylistFilterDecisions.spotify_playlist_id.in_(spotify_playlist_ids))
+                .where(PlaylistFilterDecisions.decided_at > func.now() - text(f"INTERVAL '{max_age_hours} hours'"))
+            )
+
+            return r.all()
+
+    @classmethod
+    @instrument_query
+    async def save_decisions(cls, query_key: str, decisions: list[dict], max_age_hours: int):
+        """
+        Insert or overwrite the decisions (dicts of `spotify_playlist_id`,
+        `playlist_digest` and `matches`) made for the given canonical query,
+        and delete the decisions which have expired.
+        """
+
+        statement = pg_insert(PlaylistFilterDecisions).values([
+            {"query_key": query_key, **decision} for decision in decisions])
+        async with SQLDatabase.connection() as pg:
+            await pg.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[PlaylistFilterDecisions.spotify_playlist_id, PlaylistFilterDecisions.query_key],
+                    set_={
+                        "playlist_digest": statement.excluded.playlist_digest,
+                        "matches": statement.excluded.matches,
+                        "decided_at": func.now(),
+                    })
+            )
+            await pg.execute(
+                delete(PlaylistFilterDecisions)
+                .where(PlaylistFilterDecisions.decided_at < func.now() - text(f"INTERVAL '{max_age_hours} hours'"))
+            )
+
+
+@dataclass
+class UpstreamUsageDAO:
+    @classmethod
+    @instrument_query
+    async def add_usage(cls, rows: list[dict]):
+        """
+        Add the given totals (dicts of `period_start`, `sid`, `node`,
+        `upstream`, `calls`, `input_tokens` and `output_tokens`) to the ones
+        already recorded for the same period, subscriber, node and upstream.
+        """
+
+        statement = pg_insert(UpstreamUsage).values(rows)
+        async with SQLDatabase.connection() as pg:
+            await pg.execute(
+                statement.on_conflict_do_update(
+                    constraint="upstream_usage_period_start_sid_node_upstream_key",
+                    set_={
+                        "calls": UpstreamUsage.calls + statement.excluded.calls,
+                        "input_tokens": UpstreamUsage.input_tokens + statement.excluded.input_tokens,
+                        "output_tokens": UpstreamUsage.output_tokens + statement.excluded.output_tokens,
+                    })
+            )
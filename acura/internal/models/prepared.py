@@ -0,0 +1,173 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+from dataclasses import dataclass
+from typing import ClassVar, Optional
+
+import asyncpg
+from pgvector.asyncpg import register_vector
+from sqlalchemy.engine import make_url
+
+from internal.conf import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Row(asyncpg.Record):
+    """
+    Record with attribute access, like the rows returned by SQLAlchemy, so
+    that callers do not need to know which path answered them.
+    """
+
+    def __getattr__(self, name: str):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class PreparingConnection(asyncpg.Connection):
+    """
+    Connection which keeps the statements it prepared for its whole lifetime,
+    so that every hot query is parsed and planned once per connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared: dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+    async def prepared(self, query: str) -> asyncpg.prepared_stmt.PreparedStatement:
+        statement = self._prepared.get(query)
+        if statement is None:
+            statement = await self.prepare(query, record_class=Row)
+            self._prepared[query] = statement
+        return statement
+
+    def forget(self, query: str) -> None:
+        self._prepared.pop(query, None)
+
+
+@dataclass
+class PreparedQueries:
+    """
+    Fast path for the hottest DAO queries. They run as prepared statements
+    with bound parameters directly on asyncpg, bypassing the compilation of
+    SQLAlchemy expressions, on a small pool of their own so that they also
+    do not queue behind the shared SQLAlchemy connection.
+    """
+
+    GET_SUBSCRIBER_BY_LICENSE: ClassVar[str] = "SELECT * FROM subscribers WHERE license = $1"
+    GET_SIMILAR_TRACK_IDS: ClassVar[str] = """
+        SELECT id FROM tracks
+        WHERE search_embedding <=> $1 < $2
+        ORDER BY search_embedding <=> $1
+    """
+    GET_RECENT_SUGGESTIONS: ClassVar[str] = """
+        SELECT pid, tid, added_at FROM suggestions
+        WHERE pid = $1 AND added_at > now() - $2::interval
+    """
+    GET_RECENT_SUBSCRIBER_SUGGESTIONS: ClassVar[str] = """
+        SELECT s.pid, s.tid, s.added_at FROM suggestions s
+        JOIN playlists p ON p.id = s.pid
+        WHERE p.sid = $1 AND s.added_at > now() - $2::interval
+    """
+    # A single statement for batches of any size
+    INSERT_SUGGESTIONS: ClassVar[str] = """
+        INSERT INTO suggestions (pid, tid)
+        SELECT $1, tid FROM unnest($2::int[]) AS tid
+        RETURNING tid
+    """
+    NOTIFY: ClassVar[str] = "SELECT pg_notify($1, $2)"
+
+    _pool: ClassVar[Optional[asyncpg.Pool]] = None
+    _pool_lock: ClassVar[asyncio.Lock | None] = None
+
+    @classmethod
+    async def _get_pool(cls) -> asyncpg.Pool:
+        if cls._pool is not None:
+            return cls._pool
+
+        if cls._pool_lock is None:
+            cls._pool_lock = asyncio.Lock()
+        async with cls._pool_lock:
+            if cls._pool is None:
+                conf = Config()
+                # POSTGRES_URL names the SQLAlchemy driver, asyncpg wants a plain DSN
+                dsn = make_url(conf.POSTGRES_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+                cls._pool = await asyncpg.create_pool(
+                    dsn,
+                    min_size=1,
+                    max_size=conf.DAO_FAST_PATH_POOL_SIZE,
+                    connection_class=PreparingConnection,
+                    init=register_vector,
+                )
+                logger.info("Prepared statement pool initialized")
+        return cls._pool
+
+    @classmethod
+    async def _run(cls, method: str, query: str, *args):
+        """
+        Run a prepared statement; `method` is `fetch`, `fetchrow` or `fetchval`.
+        """
+        pool = await cls._get_pool()
+        async with pool.acquire() as conn:
+            try:
+                statement = await conn.prepared(query)
+                return await getattr(statement, method)(*args)
+            except asyncpg.exceptions.InvalidCachedStatementError:
+                # The schema changed under the statement, e.g. by a migration
+                conn.forget(query)
+                statement = await conn.prepared(query)
+                return await getattr(statement, method)(*args)
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._pool is not None:
+            await cls._pool.close()
+            cls._pool = None
+            logger.info("Prepared statement pool closed")
+
+    @classmethod
+    async def get_subscriber_by_license(cls, license: str) -> Row | None:
+        return await cls._run("fetchrow", cls.GET_SUBSCRIBER_BY_LICENSE, license)
+
+    @classmethod
+    async def get_similar_track_ids(cls, search_embedding, sim_threshold: float) -> list[Row]:
+        return await cls._run("fetch", cls.GET_SIMILAR_TRACK_IDS, search_embedding, sim_threshold)
+
+    @classmethod
+    async def get_recent_suggestions(cls, playlist_id: int, hours: int) -> list[Row]:
+        return await cls._run("fetch", cls.GET_RECENT_SUGGESTIONS, playlist_id, datetime.timedelta(hours=hours))
+
+    @classmethod
+    async def get_recent_subscriber_suggestions(cls, sid: int, hours: int) -> list[Row]:
+        return await cls._run("fetch", cls.GET_RECENT_SUBSCRIBER_SUGGESTIONS, sid, datetime.timedelta(hours=hours))
+
+    @classmethod
+    async def publish_suggestions(cls, channel: str, sid: int, playlist_id: int, track_ids: list[int]) -> list[int]:
+        rows = await cls._run("fetch", cls.INSERT_SUGGESTIONS, playlist_id, track_ids)
+        inserted = [row["tid"] for row in rows]
+        payload = json.dumps({"sid": sid, "playlist_id": playlist_id, "track_ids": inserted})
+        await cls._run("fetchval", cls.NOTIFY, channel, payload)
+        return inserted
@@ -19,6 +19,9 @@ For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
 import logging
+from pgvector.asyncpg import register_vector
+from pgvector.sqlalchemy import VECTOR
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncConnection
 from contextlib import asynccontextmanager
 from typing import Optional, AsyncGenerator, ClassVar
@@ -26,6 +29,26 @@ from internal.conf import Config
 from dataclasses import dataclass
 
 
+class EmbeddingVector(VECTOR):
+    """
+    `vector` column type which hands float32 arrays to asyncpg as they are,
+    to be sent and received with pgvector's binary codec (registered on every
+    connection), instead of formatting them as text. Use it for the bound
+    embeddings of a query through `type_coerce`.
+    """
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        return None
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+def _register_vector_codec(dbapi_connection, connection_record) -> None:
+    dbapi_connection.run_async(register_vector)
+
+
 @dataclass
 class SQLDatabase:
     """
@@ -48,6 +71,7 @@ class SQLDatabase:
                 echo=config.DEBUG,
                 isolation_level="AUTOCOMMIT"
             )
+            event.listen(cls.__engine.sync_engine, "connect", _register_vector_codec)
             cls.__logger.info("Database engine initialized")
 
     @classmethod
@@ -0,0 +1,284 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import ClassVar, Optional
+
+import numpy as np
+
+from internal.models.dao import TracksDAO
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 1024
+# Number of rows fetched from PostgreSQL per synchronization round trip
+SYNC_BATCH_SIZE = 5000
+
+
+@dataclass
+class SimilarTrack:
+    """
+    Mirrors the rows returned by `TracksDAO.get_similar_track_ids`.
+    """
+    id: int
+    distance: float
+
+
+@dataclass
+class TrackVectorIndex:
+    """
+    In-process mirror of `tracks.search_embedding`, used by the router to
+    answer similarity queries without a round trip to PostgreSQL.
+
+    The vectors are L2-normalized and stored as a float32 matrix in a
+    memory-mapped file next to the matching track IDs, so that a restarted
+    worker only has to map the snapshot and fetch the tracks which were added
+    since it was written. New tracks are picked up incrementally by track ID;
+    tracks whose embedding was still missing at synchronization time are kept
+    in a pending set and retried on the next round.
+
+    Searches are exact (brute-force over the matrix), which keeps the results
+    identical to the pgvector queries they replace. They run in a worker
+    thread, so that large indexes do not block the event loop.
+    """
+
+    _path: ClassVar[Optional[str]] = None
+    _ids: ClassVar[Optional[np.memmap]] = None
+    _vectors: ClassVar[Optional[np.memmap]] = None
+    _count: ClassVar[int] = 0
+    _watermark: ClassVar[int] = 0
+    # Tracks at or below the watermark which did not have an embedding yet
+    _pending: ClassVar[set[int]] = set()
+    # Tracks above the watermark which were already added through `add`
+    _ahead: ClassVar[set[int]] = set()
+    _synced: ClassVar[bool] = False
+    _sync_lock: ClassVar[Optional[asyncio.Lock]] = None
+
+    @classmethod
+    def open(cls, path: str) -> None:
+        """
+        Map the snapshot at the given path, creating an empty one if needed.
+        """
+        cls._path = path
+        meta_path = f"{path}.json"
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        capacity = meta.get("capacity", SYNC_BATCH_SIZE)
+        cls._count = meta.get("count", 0)
+        cls._watermark = meta.get("watermark", 0)
+        cls._pending = set(meta.get("pending", []))
+        cls._ahead = set()
+        cls._synced = False
+        cls._map(capacity)
+        logger.info(
+            "Mapped track vector index at %s (%d tracks, watermark %d)", path, cls._count, cls._watermark)
+
+    @classmethod
+    def _map(cls, capacity: int) -> None:
+        for suffix, item_size in ((".ids", 8), (".vectors", 4 * EMBEDDING_DIMENSIONS)):
+            file_path = f"{cls._path}{suffix}"
+            with open(file_path, "ab"):
+                pass
+            if os.path.getsize(file_path) < capacity * item_size:
+                os.truncate(file_path, capacity * item_size)
+
+        cls._ids = np.memmap(f"{cls._path}.ids", dtype=np.int64, mode="r+", shape=(capacity,))
+        cls._vectors = np.memmap(
+            f"{cls._path}.vectors", dtype=np.float32, mode="r+", shape=(capacity, EMBEDDING_DIMENSIONS))
+
+    @classmethod
+    def _ensure_capacity(cls, n_rows: int) -> None:
+        capacity = cls._ids.shape[0]
+        if cls._count + n_rows <= capacity:
+            return
+
+        while cls._count + n_rows > capacity:
+            capacity *= 2
+        cls._ids.flush()
+        cls._vectors.flush()
+        cls._map(capacity)
+
+    @classmethod
+    def is_ready(cls) -> bool:
+        """
+        Whether the index has been synchronized at least once by this process.
+        """
+        return cls._synced
+
+    @classmethod
+    def _append(cls, track_ids: list[int], embeddings: list) -> None:
+        if not track_ids:
+            return
+
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(track_ids), EMBEDDING_DIMENSIONS)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+
+        cls._ensure_capacity(len(track_ids))
+        start, end = cls._count, cls._count + len(track_ids)
+        cls._ids[start:end] = track_ids
+        cls._vectors[start:end] = matrix / norms
+        cls._count = end
+
+    @classmethod
+    def add(cls, track_id: int, embedding) -> None:
+        """
+        Write-through for tracks created by this process, so that they are
+        visible to the router before the next synchronization round.
+        """
+        if cls._ids is None or track_id in cls._ahead:
+            return
+        if track_id <= cls._watermark and track_id not in cls._pending:
+            return
+
+        cls._append([track_id], [embedding])
+        if track_id <= cls._watermark:
+            cls._pending.discard(track_id)
+        else:
+            cls._ahead.add(track_id)
+
+    @classmethod
+    async def sync(cls) -> int:
+        """
+        Fetch the embeddings of tracks added since the last synchronization.
+        Returns the number of tracks added to the index.
+        """
+        if cls._ids is None:
+            return 0
+        if cls._sync_lock is None:
+            cls._sync_lock = asyncio.Lock()
+
+        n_added = 0
+        async with cls._sync_lock:
+            if cls._pending:
+                rows = await TracksDAO.get_track_embeddings_by_ids(list(cls._pending))
+                # Tracks which `add` wrote through during the fetch are no
+                # longer pending, and are already in the index.
+                rows = [r for r in rows if r.search_embedding is not None and r.id in cls._pending]
+                cls._append([r.id for r in rows], [r.search_embedding for r in rows])
+                cls._pending.difference_update(r.id for r in rows)
+                n_added += len(rows)
+
+            while True:
+                rows = await TracksDAO.get_track_embeddings_after(cls._watermark, SYNC_BATCH_SIZE)
+                if not rows:
+                    break
+
+                embedded = [r for r in rows if r.search_embedding is not None and r.id not in cls._ahead]
+                cls._append([r.id for r in embedded], [r.search_embedding for r in embedded])
+                cls._pending.update(r.id for r in rows if r.search_embedding is None)
+                cls._watermark = rows[-1].id
+                cls._ahead = {tid for tid in cls._ahead if tid > cls._watermark}
+                n_added += len(embedded)
+
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+
+            cls._synced = True
+
+        if n_added:
+            logger.info("Synchronized %d tracks into the vector index", n_added)
+        return n_added
+
+    @classmethod
+    async def run_sync_loop(cls, interval: float) -> None:
+        """
+        Periodically synchronize the index and persist its snapshot.
+        """
+        while True:
+            try:
+                await cls.sync()
+                cls.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Failed to synchronize the vector index: %s", e)
+            await asyncio.sleep(interval)
+
+    @classmethod
+    def flush(cls) -> None:
+        """
+        Persist the snapshot so that the next start only needs an incremental
+        synchronization.
+        """
+        if cls._ids is None:
+            return
+
+        cls._ids.flush()
+        cls._vectors.flush()
+        meta_path = f"{cls._path}.json"
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump({
+                "capacity": cls._ids.shape[0],
+                "count": cls._count,
+                "watermark": cls._watermark,
+                "pending": sorted(cls._pending),
+            }, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    @classmethod
+    def _snapshot(cls) -> tuple[np.ndarray, np.ndarray]:
+        # Rows are only ever appended, so the rows counted here stay the same
+        # while a search runs in a thread, even if the files are remapped.
+        return cls._ids[:cls._count], cls._vectors[:cls._count]
+
+    @staticmethod
+    def _similarities(vectors: np.ndarray, search_embedding) -> np.ndarray:
+        query = np.asarray(search_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        return vectors @ query
+
+    @classmethod
+    async def get_similar_track_ids(
+            cls, search_embedding, sim_threshold: float = 0.5, limit: int | None = None) -> list[SimilarTrack]:
+        """
+        Tracks with a cosine distance less than `sim_threshold` from the given
+        embedding, ordered from the most to the least similar.
+        """
+        ids, vectors = cls._snapshot()
+
+        def search() -> list[SimilarTrack]:
+            distances = 1 - cls._similarities(vectors, search_embedding)
+            (matches,) = np.nonzero(distances < sim_threshold)
+            order = matches[np.argsort(distances[matches], kind="stable")]
+            if limit is not None:
+                order = order[:limit]
+            return [SimilarTrack(int(ids[i]), float(distances[i])) for i in order]
+
+        return await asyncio.to_thread(search)
+
+    @classmethod
+    async def n_similar_tracks_count(cls, search_embedding, sim_threshold: float = 0.5) -> int:
+        """
+        Count the tracks with a cosine distance less than `sim_threshold` from
+        the given embedding.
+        """
+        _, vectors = cls._snapshot()
+        return await asyncio.to_thread(
+            lambda: int(np.count_nonzero(cls._similarities(vectors, search_embedding) > 1 - sim_threshold)))
@@ -18,82 +18,372 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
+from __future__ import annotations
 import json
 import logging
 import asyncio
+import time
+from typing import TYPE_CHECKING
 
 import aio_pika
 from aio_pika.abc import AbstractRobustConnection, AbstractIncomingMessage
 
-from internal.chain import curate
+from internal.circuit import CircuitBreaker, circuit_open_in
+from internal.conf import Config
+from internal.flight_recorder import FlightRecorder
 from internal.models.dao import SubscribersDAO
+from internal.profiler import SamplingProfiler
+from internal.health import WorkerHealth
+from internal.priority import QUEUE_ARGUMENTS, URGENCY_PRIORITIES, PriorityGate, message_urgency
+from internal.retries import RetryTopology
+from internal.sharding import ShardTopology, WorkerMembership
+from internal.warmup import PipelineWarmup
+from internal import metrics
+
+if TYPE_CHECKING:
+    from internal.streaming import StreamingPipeline
 
 __logger = logging.getLogger(__name__)
 
+# Every path of the pipeline generates a search query and embeds it
+ESSENTIAL_UPSTREAMS = ("llm", "openai")
+
 
-async def start_consuming(mq: AbstractRobustConnection) -> None:
+class InvalidMessage(ValueError):
     """
-    Establish a channel to the RabbitMQ queue and consume messages indefinitely,
-    creating async tasks for each message to be processed.
+    Raised for messages which would fail the same way on every attempt, so
+    that they are dead-lettered right away instead of being retried.
+    """
+
+
+async def start_consuming(
+        mq: AbstractRobustConnection, pipeline: StreamingPipeline | None = None,
+        stop: asyncio.Event | None = None) -> None:
+    """
+    Establish a channel to the RabbitMQ queue and consume messages until `stop`
+    is set, creating async tasks for each message to be processed. When a
+    streaming pipeline is given, curations run through its stages instead of
+    the graph. Failed curations are retried with growing delays, see
+    `RetryTopology`.
+
+    The queue orders messages by the priority of their urgency, and so do
+    the messages waiting here for a free slot. Waiting raises the priority
+    of a message by one level every PRIORITY_AGING_SECONDS, so that
+    low-urgency work is delayed but never starved, see `PriorityGate`.
+
+    With SHARDS set, messages are routed by subscriber to shard queues, see
+    `ShardTopology`. The worker then forwards the messages of the main queue
+    to their shards, and consumes the shards assigned to it among the
+    workers it knows of, which are rebalanced whenever a worker joins or
+    leaves.
+
+    Once `stop` is set, the worker drains: the consumer is cancelled so that
+    no new messages are delivered, while the curations in flight get
+    DRAIN_GRACE_PERIOD seconds to finish. Messages which are still waiting
+    for a slot, or whose curation is still running at the deadline, are
+    requeued, and resume from their checkpoints on another worker.
     """
 
     __logger.info("Starting message consumption from RabbitMQ...")
+    conf = Config()
     channel = await mq.channel()
-    queue = await channel.declare_queue("acura", durable=True, auto_delete=False)
-    sem = asyncio.Semaphore(5)  # Limit concurrent processing to 5 tasks
+    queue = await channel.declare_queue("acura", durable=True, auto_delete=False, arguments=QUEUE_ARGUMENTS)
+    # Retries and requeues go back to the main queue, and from there to the
+    # shard of their subscriber.
+    retries = await RetryTopology.declare(channel, queue.name)
+    shards = await ShardTopology.declare(channel, queue.name, conf.SHARDS) if conf.SHARDS else None
+    # Limit concurrent processing to 5 tasks, unless the streaming pipeline
+    # bounds the work of every stage on its own.
+    gate = PriorityGate(pipeline.max_jobs if pipeline else 5, conf.PRIORITY_AGING_SECONDS)
     tasks: set[asyncio.Task] = set()
+    # Tasks of the messages which are still waiting for a free slot
+    waiting: dict[asyncio.Task, AbstractIncomingMessage] = {}
+    # Iterator and dispatcher of every consumed queue, by queue name
+    consumers: dict[str, tuple[aio_pika.abc.AbstractQueueIterator, asyncio.Task]] = {}
 
-    async def process_with_semaphore(message: AbstractIncomingMessage):
-        async with sem:
-            await __process_message(message)
+    async def process_when_admitted(message: AbstractIncomingMessage):
+        queued_at = time.perf_counter()
+        urgency = message_urgency(message)
+        task = asyncio.current_task()
+        waiting[task] = message
+        try:
+            await gate.acquire(URGENCY_PRIORITIES[urgency])
+        finally:
+            waiting.pop(task, None)
 
-    async with queue.iterator() as iterator:
         try:
-            async for message in iterator:
-                task = asyncio.create_task(process_with_semaphore(message))
-                tasks.add(task)
-                task.add_done_callback(lambda t: tasks.discard(t))
-        except asyncio.CancelledError:
-            __logger.info("Shutdown triggered, canceling tasks...")
+            metrics.SEMAPHORE_WAIT.observe(time.perf_counter() - queued_at, urgency=urgency)
+            metrics.IN_FLIGHT.inc()
+            try:
+                await __process_message(message, retries, pipeline)
+            finally:
+                metrics.IN_FLIGHT.dec()
         finally:
-            __logger.info("Waiting for all tasks to complete...")
-            for task in tasks:
-                task.cancel()
+            gate.release()
 
+    async def dispatch(iterator: aio_pika.abc.AbstractQueueIterator):
+        async for message in iterator:
+            task = asyncio.create_task(process_when_admitted(message))
+            tasks.add(task)
+            task.add_done_callback(lambda t: tasks.discard(t))
 
-async def __process_message(msg: AbstractIncomingMessage) -> None:
+    async def forward(iterator: aio_pika.abc.AbstractQueueIterator):
+        async for message in iterator:
+            try:
+                await shards.forward(message)
+            except Exception as e:
+                __logger.error("Failed to forward message %s to its shard: %s", message.message_id, e)
+                await message.nack(requeue=True)
+
+    def subscribe(consumed: aio_pika.abc.AbstractQueue, handler) -> None:
+        iterator = consumed.iterator()
+        consumers[consumed.name] = (iterator, asyncio.create_task(handler(iterator)))
+
+    async def unsubscribe(name: str) -> None:
+        # Messages buffered by the consumer but not dispatched yet are
+        # returned to the queue by the iterator.
+        iterator, dispatcher = consumers.pop(name)
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+        await iterator.close()
+
+    async def follow_shards(membership: WorkerMembership):
+        while True:
+            membership.changed.clear()
+            owned = shards.owned(membership.workers(), membership.worker_id)
+            for name in set(shards.queues).intersection(consumers) - owned:
+                await unsubscribe(name)
+            for name in owned.difference(consumers):
+                subscribe(shards.queues[name], dispatch)
+            metrics.OWNED_SHARDS.set(len(owned))
+            __logger.info("Worker %s consumes %d of %d shards", membership.worker_id, len(owned), len(shards.queues))
+            await membership.changed.wait()
+
+    background: list[asyncio.Task] = []
+    if shards is None:
+        subscribe(queue, dispatch)
+    else:
+        membership = WorkerMembership(conf.SHARD_HEARTBEAT_INTERVAL)
+        subscribe(queue, forward)
+        background.append(asyncio.create_task(membership.run(channel)))
+        background.append(asyncio.create_task(follow_shards(membership)))
+
+    stopped = asyncio.create_task((stop or asyncio.Event()).wait())
+    WorkerHealth.consuming = True
     try:
-        async with msg.process(ignore_processed=True):
-            license_key = __extract_license_key(msg)
-            if not license_key:
-                raise ValueError("License key not provided in the message.")
+        await asyncio.wait(
+            (stopped, *background, *(dispatcher for _, dispatcher in consumers.values())),
+            return_when=asyncio.FIRST_COMPLETED)
+        WorkerHealth.draining = True
+        # The shards of a draining worker are handed over right away
+        for task in reversed(background):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for name in list(consumers):
+            await unsubscribe(name)
+        await __drain(tasks, waiting, retries, conf.DRAIN_GRACE_PERIOD)
+    except asyncio.CancelledError:
+        __logger.info("Shutdown triggered, canceling tasks...")
+        raise
+    finally:
+        WorkerHealth.consuming = False
+        stopped.cancel()
+        for task in background:
+            task.cancel()
+        for iterator, dispatcher in consumers.values():
+            dispatcher.cancel()
+        for task in tasks:
+            task.cancel()
+        # Interrupted curations still requeue their messages
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for iterator, _ in consumers.values():
+            await iterator.close()
+
+
+async def __drain(
+        tasks: set[asyncio.Task], waiting: dict[asyncio.Task, AbstractIncomingMessage],
+        retries: RetryTopology, grace_period: float) -> None:
+    __logger.info("Draining: %d messages in flight, %d waiting for a slot", len(tasks) - len(waiting), len(waiting))
+    # Waiting messages have not cost anything yet, so they go back right away.
+    # Their tasks are all cancelled before the first requeue is awaited, during
+    # which a released slot could otherwise admit one of them, whose message
+    # would then be requeued twice.
+    waited = list(waiting.items())
+    for task, _ in waited:
+        task.cancel()
+    for _, message in waited:
+        try:
+            await retries.requeue(message, "Worker draining")
+        except Exception as e:
+            __logger.error("Failed to requeue message %s: %s", message.message_id, e)
+
+    if tasks:
+        _, pending = await asyncio.wait(set(tasks), timeout=grace_period)
+        if pending:
+            # Interrupted curations requeue their own messages, see
+            # `__process_message`.
+            __logger.warning("Drain deadline reached, interrupting %d curations", len(pending))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+    __logger.info("Drained")
 
-            subscriber = await SubscribersDAO.get_subscriber_by_license(license_key)
-            if not subscriber:
-                raise ValueError(
-                    "No subscriber found with the provided license key.")
 
+async def __process_message(
+        msg: AbstractIncomingMessage, retries: RetryTopology, pipeline: StreamingPipeline | None = None) -> None:
+    try:
+        async with msg.process(ignore_processed=True):
             try:
-                n_added_items = await curate(subscriber.id)
+                await __curate_message(msg, retries, pipeline)
+            except asyncio.CancelledError:
+                # The worker is stopping before the curation is done. Its
+                # progress is checkpointed, so another worker resumes it
+                # instead of the message being rejected.
+                try:
+                    await retries.requeue(msg, "Worker stopped")
+                except Exception as e:
+                    __logger.error("Failed to requeue message %s: %s", msg.message_id, e)
+                raise
             except Exception as e:
-                raise RuntimeError(f"Error during curation: {e}")
+                # Handled here, since leaving the context with an error would
+                # reject the message.
+                __logger.error("Error processing message: %s", e)
+                if not msg.processed:
+                    await __settle_failed_message(msg, retries, e)
+    except Exception as e:
+        __logger.error("Error processing message: %s", e)
 
-            if n_added_items > 0:
-                await msg.ack()
-            else:
-                # If no items were added, we can choose to reject the message and
-                # requeue it for later processing.
-                await msg.reject()
 
+async def __settle_failed_message(msg: AbstractIncomingMessage, retries: RetryTopology, error: Exception) -> None:
+    invalid = isinstance(error, InvalidMessage)
+    try:
+        if invalid:
+            # Invalid messages would fail the same way again
+            await retries.dead_letter(msg, str(error))
+        else:
+            # E.g. the database being unavailable, which uses up one of the
+            # attempts like a failed curation.
+            await retries.retry(msg, f"Error processing message: {error}")
     except Exception as e:
-        __logger.error("Error processing message: %s", e)
+        __logger.error("Failed to %s the message: %s", "dead-letter" if invalid else "retry", e)
+        metrics.MESSAGES.inc(outcome="reject")
         try:
-            # Reject the message to prevent re-queuing
-            await msg.reject(requeue=False)
+            # Without the retry queues, a transient failure still leaves the
+            # message to another attempt.
+            await msg.reject(requeue=not invalid)
         except aio_pika.exceptions.MessageProcessError as e:
             __logger.error("Message already processed: %s", e)
 
 
+async def __curate_message(
+        msg: AbstractIncomingMessage, retries: RetryTopology, pipeline: StreamingPipeline | None = None) -> None:
+    license_key = __extract_license_key(msg)
+    if not license_key:
+        raise InvalidMessage("License key not provided in the message.")
+
+    subscriber = await SubscribersDAO.get_subscriber_by_license(license_key)
+    if not subscriber:
+        raise InvalidMessage(
+            "No subscriber found with the provided license key.")
+
+    # Curations which could only fail fast are not started, and free the
+    # slot for messages which can still be curated. Circuits of the other
+    # upstreams are left to the pipeline, which can reuse existing tracks.
+    if Config().CIRCUIT_MIN_CALLS and (breaker := CircuitBreaker.first_open(*ESSENTIAL_UPSTREAMS)):
+        await retries.delay(msg, breaker.retry_after(), f"Circuit of upstream `{breaker.upstream}` is open")
+        return
+
+    # The pipeline is imported in the background while the worker
+    # starts, so only the first messages may have to wait for it.
+    await PipelineWarmup.wait()
+    from internal.chain import curate
+
+    # The message is acknowledged as soon as the first batches of
+    # tracks are published, the rest of the curation then continues
+    # in the background while still holding the worker slot.
+    published = asyncio.Event()
+    # Retries carry the same ID, which lets them resume from the
+    # checkpoint of the failed attempt.
+    checkpoint_key = msg.message_id or msg.correlation_id
+    curation = asyncio.create_task(
+        curate(subscriber.id, pipeline, published, checkpoint_key=checkpoint_key))
+    waiter = asyncio.create_task(published.wait())
+    try:
+        await asyncio.wait((curation, waiter), return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+
+        if not curation.done():
+            await msg.ack()
+            metrics.MESSAGES.inc(outcome="early_ack")
+            try:
+                await curation
+            except Exception as e:
+                __logger.error("Error during curation after early acknowledgement: %s", e)
+            return
+
+        try:
+            n_added_items = curation.result()
+        except Exception as e:
+            # Failed on an open circuit, which says nothing about the message
+            if (circuit_open := circuit_open_in(e)) is not None:
+                await retries.delay(msg, circuit_open.retry_after, f"Error during curation: {e}")
+                return
+            await retries.retry(msg, f"Error during curation: {e}")
+            return
+    except asyncio.CancelledError:
+        # Give the curation the chance to checkpoint its progress before the
+        # message is requeued.
+        curation.cancel()
+        await asyncio.wait((curation,))
+        raise
+    finally:
+        waiter.cancel()
+        curation.cancel()
+
+    if n_added_items > 0:
+        await msg.ack()
+        metrics.MESSAGES.inc(outcome="ack")
+    else:
+        # Most likely the upstreams are rate limiting us, so the message
+        # comes back after a delay instead of immediately.
+        await retries.retry(msg, "No tracks were added")
+
+
+async def consume_control_messages(mq: AbstractRobustConnection) -> None:
+    """
+    Listen for operator commands broadcast on the `acura.control` fanout
+    exchange. Every worker binds its own exclusive queue, so that a single
+    message reaches all of them:
+
+    - `{"command": "profile", "seconds": 30}` samples the event loop thread
+    - `{"command": "flight_recorder"}` dumps the slowest curations
+    """
+
+    conf = Config()
+    channel = await mq.channel()
+    exchange = await channel.declare_exchange("acura.control", aio_pika.ExchangeType.FANOUT, durable=True)
+    queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+    await queue.bind(exchange)
+
+    async with queue.iterator(no_ack=True) as iterator:
+        async for message in iterator:
+            try:
+                command = json.loads(message.body)
+                name = command["command"]
+            except (json.JSONDecodeError, KeyError, TypeError):
+                __logger.error("Ignoring malformed control message.")
+                continue
+
+            if name == "profile":
+                seconds = min(float(command.get("seconds", conf.PROFILE_MAX_SECONDS)), conf.PROFILE_MAX_SECONDS)
+                if not SamplingProfiler.start(conf.PROFILE_DIR, seconds, conf.PROFILE_SAMPLE_INTERVAL):
+                    __logger.warning("Sampling profiler is already running.")
+            elif name == "flight_recorder":
+                FlightRecorder.dump(conf.PROFILE_DIR)
+            else:
+                __logger.error("Unknown control command `%s`.", name)
+
+
 def __extract_license_key(msg: AbstractIncomingMessage) -> str | None:
     """
     Extract the license key from the message body.
@@ -101,6 +391,8 @@ def __extract_license_key(msg: AbstractIncomingMessage) -> str | None:
 
     try:
         return json.loads(msg.body)["license"]
-    except json.JSONDecodeError:
+    except ValueError:
         __logger.error("Failed to decode message body as JSON.")
         return None
+    except (KeyError, TypeError):
+        return None
@@ -0,0 +1,113 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import hashlib
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+from internal.conf import Config
+from internal.models.dao import PlaylistFilterDecisionsDAO
+from internal import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PlaylistDecisions:
+    """
+    Remembers whether the playlist filter agent considered Spotify playlists a
+    match for a search query, across curations and processes. Decisions are
+    keyed by the playlist ID and the canonical form of the query, and are only
+    trusted while the playlist's title and description stay the same.
+
+    The cache is best effort: failing to read or write it only costs the LLM
+    calls it would have saved.
+    """
+    query: str
+    query_key: str = field(init=False)
+    _known: dict[str, bool] = field(default_factory=dict, repr=False)
+    _new: list[dict] = field(default_factory=list, repr=False)
+
+    def __post_init__(self):
+        self.query_key = self.canonicalize(self.query)
+
+    @staticmethod
+    def canonicalize(query: str) -> str:
+        """
+        Case, punctuation, word order and repeated words do not change the
+        meaning of a search query for the filter agent, so they are dropped.
+        """
+        words = re.findall(r"\w+", unicodedata.normalize("NFKC", query).casefold())
+        return " ".join(sorted(set(words)))
+
+    @staticmethod
+    def digest(playlist: dict) -> str:
+        return hashlib.sha1(f"{playlist['name']}\0{playlist['description']}".encode()).hexdigest()
+
+    async def load(self, playlists: list[dict]) -> None:
+        """
+        Fetch the decisions already made about the given playlists with a
+        single query.
+        """
+        conf = Config()
+        if not conf.PLAYLIST_DECISIONS_TTL_HOURS or not playlists:
+            return
+
+        digests = {playlist["id"]: self.digest(playlist) for playlist in playlists}
+        try:
+            rows = await PlaylistFilterDecisionsDAO.get_decisions(
+                self.query_key, list(digests), conf.PLAYLIST_DECISIONS_TTL_HOURS)
+        except Exception as e:
+            logger.warning("Failed to load playlist filter decisions for `%s`: %s", self.query_key, e)
+            return
+
+        self._known = {
+            row.spotify_playlist_id: row.matches
+            for row in rows if digests.get(row.spotify_playlist_id) == row.playlist_digest
+        }
+
+    def get(self, playlist: dict) -> bool | None:
+        matches = self._known.get(playlist["id"])
+        metrics.PLAYLIST_DECISION_LOOKUPS.inc(result="miss" if matches is None else "hit")
+        return matches
+
+    def remember(self, playlist: dict, matches: bool) -> None:
+        self._known[playlist["id"]] = matches
+        self._new.append({
+            "spotify_playlist_id": playlist["id"],
+            "playlist_digest": self.digest(playlist),
+            "matches": matches,
+        })
+
+    async def save(self) -> None:
+        """
+        Store the decisions made since `load` with a single statement.
+        """
+        conf = Config()
+        new, self._new = self._new, []
+        if not conf.PLAYLIST_DECISIONS_TTL_HOURS or not new:
+            return
+
+        try:
+            await PlaylistFilterDecisionsDAO.save_decisions(self.query_key, new, conf.PLAYLIST_DECISIONS_TTL_HOURS)
+        except Exception as e:
+            logger.warning("Failed to save playlist filter decisions for `%s`: %s", self.query_key, e)
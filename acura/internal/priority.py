@@ -0,0 +1,111 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aio_pika.abc import AbstractIncomingMessage
+
+logger = logging.getLogger(__name__)
+
+# Urgency of a curation request, from its `urgency` field, and the AMQP
+# priority it is published with. Messages without an urgency are "normal".
+# Publishers (e.g. the UI's `/api/tracklist`) must use the same mapping.
+URGENCY_PRIORITIES = {"low": 0, "normal": 1, "high": 2, "critical": 3}
+DEFAULT_URGENCY = "normal"
+# The priorities of a queue are fixed when it is declared, so every client
+# declaring the `acura` queue has to pass the same arguments.
+QUEUE_ARGUMENTS = {"x-max-priority": max(URGENCY_PRIORITIES.values())}
+
+
+def message_urgency(msg: AbstractIncomingMessage) -> str:
+    """
+    The urgency supplied in the message body, or the one of its AMQP
+    priority for messages which only carry the latter.
+    """
+    try:
+        urgency = json.loads(msg.body).get("urgency")
+    except (json.JSONDecodeError, AttributeError):
+        urgency = None
+    if urgency in URGENCY_PRIORITIES:
+        return urgency
+    if urgency is not None:
+        logger.warning("Unknown urgency `%s` of message %s", urgency, msg.message_id)
+    if msg.priority is not None:
+        return max(
+            (name for name, priority in URGENCY_PRIORITIES.items() if priority <= msg.priority),
+            key=URGENCY_PRIORITIES.get, default=DEFAULT_URGENCY)
+    return DEFAULT_URGENCY
+
+
+def message_priority(msg: AbstractIncomingMessage) -> int:
+    return URGENCY_PRIORITIES[message_urgency(msg)]
+
+
+@dataclass
+class PriorityGate:
+    """
+    Admits at most `slots` holders at a time, like a semaphore, except that
+    waiters are admitted by priority instead of in arrival order. To keep
+    low priorities from starving under a steady stream of urgent work, every
+    `aging` seconds of waiting count as one priority level: a waiter is
+    admitted at the latest `aging` seconds per level after a newer waiter of
+    a higher priority would be.
+    """
+    slots: int
+    aging: float
+    # Heap of (admission key, tie breaker, future)
+    _waiters: list[tuple[float, int, asyncio.Future]] = field(default_factory=list, repr=False)
+    _counter: itertools.count = field(default_factory=itertools.count, repr=False)
+
+    def __post_init__(self):
+        if self.aging <= 0:
+            raise ValueError("The aging period of a priority gate must be positive")
+
+    async def acquire(self, priority: int) -> None:
+        if self.slots > 0 and not self._waiters:
+            self.slots -= 1
+            return
+
+        # Waiting adds to the priority at the same pace for every waiter, so
+        # their order is fixed when they arrive.
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (time.monotonic() / self.aging - priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Admitted right before being cancelled, so the slot is passed on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            # Cancelled waiters are only dropped once they reach the top
+            if not future.done():
+                future.set_result(None)
+                return
+        self.slots += 1
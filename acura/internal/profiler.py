@@ -0,0 +1,160 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from types import FrameType
+from typing import ClassVar, Optional
+
+from internal import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    """
+    Render a stack in the collapsed format understood by flamegraph.pl and
+    speedscope: frames from the root to the leaf, separated by semicolons.
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+@dataclass
+class SamplingProfiler:
+    """
+    Samples the stack of the event loop thread from a background thread and
+    writes the result as a collapsed-stack file, ready to be turned into a
+    flamegraph. Can be toggled at runtime, so it costs nothing while idle.
+    """
+    _thread_id: ClassVar[Optional[int]] = None
+    _sampler: ClassVar[Optional[threading.Thread]] = None
+    _stop: ClassVar[threading.Event] = threading.Event()
+
+    @classmethod
+    def attach(cls) -> None:
+        """
+        Must be called from the event loop thread.
+        """
+        cls._thread_id = threading.get_ident()
+
+    @classmethod
+    def is_running(cls) -> bool:
+        return cls._sampler is not None and cls._sampler.is_alive()
+
+    @classmethod
+    def start(cls, directory: str, seconds: float, interval: float) -> bool:
+        if cls._thread_id is None or cls.is_running():
+            return False
+
+        cls._stop.clear()
+        cls._sampler = threading.Thread(
+            target=cls._run, args=(directory, seconds, interval), name="acura-profiler", daemon=True)
+        cls._sampler.start()
+        logger.info("Sampling profiler started for up to %ss", seconds)
+        return True
+
+    @classmethod
+    def stop(cls) -> None:
+        cls._stop.set()
+
+    @classmethod
+    def toggle(cls, directory: str, seconds: float, interval: float) -> None:
+        if cls.is_running():
+            cls.stop()
+        else:
+            cls.start(directory, seconds, interval)
+
+    @classmethod
+    def _run(cls, directory: str, seconds: float, interval: float) -> None:
+        samples: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while not cls._stop.is_set() and time.monotonic() < deadline:
+            frame = sys._current_frames().get(cls._thread_id)
+            if frame is not None:
+                samples[_collapse(frame)] += 1
+            del frame
+            cls._stop.wait(interval)
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"acura-{os.getpid()}-{int(time.time())}.collapsed")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Sampling profiler wrote %d samples to %s", sum(samples.values()), path)
+
+
+@dataclass
+class LoopStallDetector:
+    """
+    Detects event loop stalls, i.e. code blocking the loop for longer than
+    the threshold. A heartbeat coroutine stamps the time on every loop
+    iteration, and a watchdog thread captures the stack of the loop thread
+    while it is still stuck, pointing right at the blocking code.
+    """
+    _heartbeat: ClassVar[float] = 0.0
+    _thread_id: ClassVar[Optional[int]] = None
+    _stop: ClassVar[threading.Event] = threading.Event()
+
+    @classmethod
+    async def run(cls, threshold: float) -> None:
+        cls._thread_id = threading.get_ident()
+        cls._heartbeat = time.monotonic()
+        cls._stop.clear()
+        threading.Thread(target=cls._watch, args=(threshold,), name="acura-stall-watchdog", daemon=True).start()
+
+        while True:
+            cls._heartbeat = time.monotonic()
+            await asyncio.sleep(threshold / 4)
+
+    @classmethod
+    def stop(cls) -> None:
+        """
+        Stop the watchdog, which would otherwise take the heartbeats missed
+        once the loop is gone for a stall.
+        """
+        cls._stop.set()
+
+    @classmethod
+    def _watch(cls, threshold: float) -> None:
+        reported = None
+        while not cls._stop.wait(threshold / 4):
+            heartbeat = cls._heartbeat
+            stalled_for = time.monotonic() - heartbeat
+            if stalled_for < threshold or reported == heartbeat:
+                continue
+
+            # Report every stall only once, while it is still ongoing
+            reported = heartbeat
+            metrics.LOOP_STALLS.inc()
+            frame = sys._current_frames().get(cls._thread_id)
+            logger.warning(
+                "Event loop stalled for more than %.2fs in: %s", stalled_for, _collapse(frame).replace(";", " -> "))
+            del frame
@@ -0,0 +1,61 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from internal.models.dao import SuggestionsDAO
+
+
+@dataclass
+class SuggestionBatcher:
+    """
+    Collects the tracks of a curation and publishes them to the subscriber's
+    playlist in small batches, as soon as each batch is full, rather than all
+    at once at the end of the curation.
+    """
+    sid: int
+    playlist_id: int
+    batch_size: int
+    # Called with the number of batches published so far and the number of
+    # tracks in the latest batch
+    on_published: Optional[Callable[[int, int], None]] = None
+
+    n_batches: int = 0
+    n_published: int = 0
+    _pending: list[int] = field(default_factory=list, repr=False)
+
+    async def add(self, track_id: int) -> None:
+        self._pending.append(track_id)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        # Swap the batch out before awaiting, so that concurrent producers
+        # never publish the same tracks twice.
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        inserted = await SuggestionsDAO.publish_suggestions(self.sid, self.playlist_id, batch)
+        self.n_batches += 1
+        self.n_published += len(inserted)
+        if self.on_published is not None:
+            self.on_published(self.n_batches, len(inserted))
@@ -0,0 +1,44 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import logging
+
+from internal.models.dao import SuggestionsDAO
+
+logger = logging.getLogger(__name__)
+
+
+async def run_suggestions_retention(interval: float, retention_days: int | None, drop_detached: bool) -> None:
+    """
+    Periodically create the upcoming monthly partitions of the Suggestions
+    table and remove the partitions which fell out of the retention period.
+    Every worker runs this, the database serializes them.
+    """
+    while True:
+        try:
+            n_removed = await SuggestionsDAO.maintain_partitions(retention_days, drop_detached)
+            if n_removed:
+                logger.info("Removed %d expired partitions of suggestions", n_removed)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Failed to maintain the partitions of suggestions: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,152 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import logging
+from dataclasses import dataclass
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+
+from internal.conf import Config
+from internal.priority import message_priority
+from internal import metrics
+
+logger = logging.getLogger(__name__)
+
+# Header counting the retries a message went through so far
+ATTEMPT_HEADER = "x-acura-attempt"
+# Header carrying the reason of the latest retry or of the dead-lettering
+ERROR_HEADER = "x-acura-error"
+DEAD_LETTER_QUEUE = "acura.dead"
+
+
+@dataclass
+class RetryTopology:
+    """
+    Delayed retries of failed curations. Every retry tier is a queue without
+    consumers whose messages expire after the tier's delay and are then
+    dead-lettered back into the main queue. A failed message is republished
+    into the tier of its attempt, so the delays grow exponentially, and once
+    all attempts are spent it is parked in the final dead-letter queue.
+
+    Republishing keeps the message and correlation IDs, so that a retry
+    resumes from the checkpoint of the failed attempt.
+    """
+    channel: AbstractChannel
+    queue_name: str
+    # Delay of every tier in seconds
+    delays: list[float]
+
+    @classmethod
+    async def declare(cls, channel: AbstractChannel, queue_name: str) -> "RetryTopology":
+        conf = Config()
+        topology = cls(channel, queue_name, [
+            conf.RETRY_BASE_DELAY * 2 ** attempt for attempt in range(conf.RETRY_MAX_ATTEMPTS)])
+
+        for delay in topology.delays:
+            await channel.declare_queue(topology.tier_queue_name(delay), durable=True, arguments={
+                "x-message-ttl": int(delay * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            })
+        await channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+        return topology
+
+    def tier_queue_name(self, delay: float) -> str:
+        # The delay is part of the name, since the TTL of an existing queue
+        # cannot be changed by declaring it again.
+        return f"{self.queue_name}.retry.{int(delay * 1000)}ms"
+
+    @staticmethod
+    def attempt(msg: AbstractIncomingMessage) -> int:
+        try:
+            return int((msg.headers or {}).get(ATTEMPT_HEADER, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    async def _republish(self, msg: AbstractIncomingMessage, routing_key: str, attempt: int, reason: str) -> None:
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=msg.body,
+                headers={**(msg.headers or {}), ATTEMPT_HEADER: attempt, ERROR_HEADER: reason},
+                content_type=msg.content_type,
+                message_id=msg.message_id,
+                correlation_id=msg.correlation_id,
+                # Also carries urgencies which were only given in the body
+                priority=message_priority(msg),
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=routing_key,
+        )
+        # Acknowledged only once the copy is confirmed, so the message is
+        # never lost in between (but may, rarely, be duplicated). Messages
+        # acknowledged early are already gone from the queue.
+        if not msg.processed:
+            await msg.ack()
+
+    async def retry(self, msg: AbstractIncomingMessage, reason: str) -> None:
+        """
+        Schedule the message for another attempt after the delay of its tier,
+        or dead-letter it when it has no attempts left.
+        """
+        attempt = self.attempt(msg)
+        if attempt >= len(self.delays):
+            await self.dead_letter(msg, reason)
+            return
+
+        delay = self.delays[attempt]
+        logger.warning("Retrying message %s in %gs (attempt %d): %s", msg.message_id, delay, attempt + 1, reason)
+        await self._republish(msg, self.tier_queue_name(delay), attempt + 1, reason)
+        metrics.MESSAGES.inc(outcome="retry")
+
+    async def requeue(self, msg: AbstractIncomingMessage, reason: str) -> None:
+        """
+        Put the message back into the main queue right away, without using up
+        one of its attempts, e.g. when the worker stops before its curation
+        is done. Also works for messages which were acknowledged early, whose
+        curation then carries on from its checkpoint on another worker.
+        """
+        logger.info("Requeueing message %s: %s", msg.message_id, reason)
+        await self._republish(msg, self.queue_name, self.attempt(msg), reason)
+        metrics.MESSAGES.inc(outcome="requeue")
+
+    async def delay(self, msg: AbstractIncomingMessage, seconds: float, reason: str) -> None:
+        """
+        Deliver the message again after at least the given number of seconds
+        (the delay of the shortest tier which is long enough, or of the
+        longest tier), without using up one of its attempts, e.g. while an
+        upstream it needs is unavailable.
+        """
+        delay = next((delay for delay in self.delays if delay >= seconds), max(self.delays, default=None))
+        if delay is None:
+            await self.requeue(msg, reason)
+            return
+
+        logger.warning("Delaying message %s by %gs: %s", msg.message_id, delay, reason)
+        await self._republish(msg, self.tier_queue_name(delay), self.attempt(msg), reason)
+        metrics.MESSAGES.inc(outcome="delay")
+
+    async def dead_letter(self, msg: AbstractIncomingMessage, reason: str) -> None:
+        """
+        Park the message in the final dead-letter queue for inspection.
+        """
+        logger.error("Dead-lettering message %s: %s", msg.message_id, reason)
+        await self._republish(msg, DEAD_LETTER_QUEUE, self.attempt(msg), reason)
+        metrics.MESSAGES.inc(outcome="dead_letter")
@@ -0,0 +1,122 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import ClassVar, Optional
+
+import numpy as np
+
+from internal.conf import Config
+from internal import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedCuration:
+    query: str
+    spotify_playlist_id: str
+    track_ids: list[int]
+    created_at: float
+
+
+@dataclass
+class SemanticCurationCache:
+    """
+    In-memory nearest-neighbour store of recent Spotify curations, shared by
+    all subscribers handled by this process. Entries are keyed by the
+    normalized search query embedding and are kept in a fixed-size ring
+    buffer, so that a lookup is a single matrix-vector product.
+    """
+
+    _embeddings: ClassVar[Optional[np.ndarray]] = None
+    _created_at: ClassVar[Optional[np.ndarray]] = None
+    _entries: ClassVar[list[Optional[CachedCuration]]] = []
+    _cursor: ClassVar[int] = 0
+
+    @classmethod
+    def _ensure_initialized(cls, dimensions: int) -> None:
+        if cls._embeddings is None or cls._embeddings.shape[1] != dimensions:
+            capacity = Config().SEMANTIC_CACHE_SIZE
+            cls._embeddings = np.zeros((capacity, dimensions), dtype=np.float32)
+            # Empty slots are marked with -inf so that they are never fresh.
+            cls._created_at = np.full(capacity, -np.inf, dtype=np.float64)
+            cls._entries = [None] * capacity
+            cls._cursor = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @classmethod
+    def lookup(cls, embedding, exclude: frozenset[int] | set[int] = frozenset()) -> CachedCuration | None:
+        """
+        Return the most similar fresh curation within the configured similarity
+        radius of the given query embedding, or None. Curations whose tracks
+        are all in `exclude` (for instance the ones the subscriber was already
+        suggested) would not add anything, so they are skipped.
+        """
+        if cls._embeddings is None:
+            metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        conf = Config()
+        query = cls._normalize(embedding)
+        similarities = cls._embeddings @ query
+        fresh = cls._created_at > (time.monotonic() - conf.SEMANTIC_CACHE_TTL)
+        similarities[~fresh] = -np.inf
+
+        for best in np.argsort(-similarities):
+            if similarities[best] < conf.SEMANTIC_CACHE_SIMILARITY:
+                break
+            entry = cls._entries[best]
+            if all(tid in exclude for tid in entry.track_ids):
+                continue
+
+            metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="hit")
+            logger.info(
+                "Semantic cache hit (similarity %.3f) for cached query `%s`", similarities[best], entry.query)
+            return entry
+
+        metrics.SEMANTIC_CACHE_LOOKUPS.inc(result="miss")
+        return None
+
+    @classmethod
+    def store(cls, embedding, query: str, spotify_playlist_id: str, track_ids: list[int]) -> None:
+        """
+        Remember the outcome of a Spotify curation, overwriting the oldest
+        entry once the cache is full.
+        """
+        if not track_ids:
+            return
+
+        vector = cls._normalize(embedding)
+        cls._ensure_initialized(vector.shape[0])
+        now = time.monotonic()
+
+        slot = cls._cursor
+        cls._embeddings[slot] = vector
+        cls._created_at[slot] = now
+        cls._entries[slot] = CachedCuration(query, spotify_playlist_id, list(track_ids), now)
+        cls._cursor = (slot + 1) % len(cls._entries)
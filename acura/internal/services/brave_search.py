@@ -20,8 +20,12 @@ For inquiries, contact: michael.grigoryan25@gmail.com
 
 import httpx
 import asyncio
+import time
 from dataclasses import dataclass
+from internal.circuit import CircuitBreaker
 from internal.conf import Config
+from internal.metrics import instrument_upstream, record_attempt
+from internal.usage import UpstreamUsage
 import logging
 
 logging.getLogger("httpx").setLevel(logging.CRITICAL + 1)
@@ -29,10 +33,19 @@ logging.getLogger("httpx").setLevel(logging.CRITICAL + 1)
 
 @dataclass
 class BraveSearchService:
-    _client = httpx.AsyncClient(
-        base_url="https://api.search.brave.com",
-        follow_redirects=True,
-        headers={"Accept": "application/json"})
+    _client = None
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        """
+        The HTTP client, created on first use.
+        """
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(
+                base_url="https://api.search.brave.com",
+                follow_redirects=True,
+                headers={"Accept": "application/json"})
+        return cls._client
 
     @classmethod
     async def _make_request(cls, endpoint: str, params: dict, headers: dict | None = None, max_retries: int = 5):
@@ -40,12 +53,15 @@ class BraveSearchService:
         backoff = 1  # Initial backoff in seconds
 
         while retries < max_retries:
+            started = time.perf_counter()
             try:
-                response = await cls._client.get(endpoint, params=params, headers=headers)
+                response = await cls.client().get(endpoint, params=params, headers=headers)
+                record_attempt("brave", response.is_error, time.perf_counter() - started)
 
                 if response.status_code == 429:
                     retries += 1
-                    await asyncio.sleep(backoff)
+                    if retries < max_retries:
+                        await cls._back_off(backoff)
                     backoff *= 2  # Exponential backoff
                     continue
 
@@ -53,16 +69,28 @@ class BraveSearchService:
                 return response.json()
 
             except httpx.RequestError as e:
+                record_attempt("brave", True, time.perf_counter() - started)
                 retries += 1
-                await asyncio.sleep(backoff)
-                backoff *= 2  # Exponential backoff
                 if retries >= max_retries:
                     raise e
+                await cls._back_off(backoff)
+                backoff *= 2  # Exponential backoff
 
         raise Exception(
             "Max retries exceeded while trying to perform the request.")
 
     @classmethod
+    async def _back_off(cls, backoff: float) -> None:
+        if Config().CIRCUIT_MIN_CALLS:
+            # Once the failed attempts opened the circuit, the call fails
+            # right away instead of backing off further.
+            CircuitBreaker.of("brave").check()
+        await asyncio.sleep(backoff)
+        # Only the first attempt is counted by `instrument_upstream`
+        UpstreamUsage.record("brave", calls=1)
+
+    @classmethod
+    @instrument_upstream("brave")
     async def search_youtube_for_videos(cls, query: str, num_results: int = 10) -> list[dict]:
         query = "site:youtube.com" + ' ' + query
         params = {
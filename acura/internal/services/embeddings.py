@@ -18,8 +18,28 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
-from openai import AsyncOpenAI
+from __future__ import annotations
+import base64
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
+import numpy as np
+from internal.metrics import instrument_upstream
+from internal.usage import UpstreamUsage
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# An embedding is a one-dimensional float32 array: 4 KiB per 1024 dimensions,
+# instead of 1024 boxed floats in a list.
+Embedding = np.ndarray
+
+
+def as_embedding(value) -> Embedding:
+    """
+    Coerce a list of floats (e.g. restored from a JSON checkpoint) or any
+    other array into an `Embedding`, without copying when it already is one.
+    """
+    return np.asarray(value, dtype=np.float32)
 
 
 @dataclass
@@ -27,23 +47,45 @@ class EmbeddingsService:
     """
     Provides methods to create embeddings for tracks using OpenAI's API.
     """
-    _client: AsyncOpenAI = AsyncOpenAI()
+    _client: AsyncOpenAI | None = None
 
     @classmethod
-    async def create_search_query_embedding(cls, search_query: str) -> list[float]:
+    def client(cls) -> AsyncOpenAI:
         """
-        Create an embedding for the search query.
+        The OpenAI client, created on first use. Importing `openai` alone
+        takes most of a second, so it is left out of the worker's start.
         """
-        response = await cls._client.embeddings.create(
+        if cls._client is None:
+            from openai import AsyncOpenAI
+            cls._client = AsyncOpenAI()
+        return cls._client
+
+    @classmethod
+    async def _create_embedding(cls, text: str) -> Embedding:
+        # Asking for base64 explicitly makes the client return the raw
+        # little-endian float32 buffer, which is wrapped without building a
+        # list of floats first.
+        response = await cls.client().embeddings.create(
             model="text-embedding-3-large",
-            input=f"Search Query: {search_query}",
+            input=text,
             dimensions=1024,
+            encoding_format="base64",
         )
+        UpstreamUsage.record("openai", input_tokens=response.usage.prompt_tokens)
 
-        return response.data[0].embedding
+        return np.frombuffer(base64.b64decode(response.data[0].embedding), dtype="<f4")
 
     @classmethod
-    async def create_track_embedding(cls, search_query: str, track_title: str, track_artist: str) -> list[float]:
+    @instrument_upstream("openai")
+    async def create_search_query_embedding(cls, search_query: str) -> Embedding:
+        """
+        Create an embedding for the search query.
+        """
+        return await cls._create_embedding(f"Search Query: {search_query}")
+
+    @classmethod
+    @instrument_upstream("openai")
+    async def create_track_embedding(cls, search_query: str, track_title: str, track_artist: str) -> Embedding:
         # In order to get accurate embeddings for the track, we need to
         # create a string that contains the search query, track title, and
         # track artist. This will help the model understand the context
@@ -53,11 +95,4 @@ Search Query: {search_query}
 Track Title: {track_title}
 Track Artist: {track_artist}"""
 
-        response = await cls._client.embeddings.create(
-            model="text-embedding-3-large",
-            input=embeddable,
-            dimensions=1024,
-        )
-
-        embedding = response.data[0].embedding
-        return embedding
+        return await cls._create_embedding(embeddable)
@@ -19,13 +19,15 @@ For inquiries, contact: michael.grigoryan25@gmail.com
 """
 
 from __future__ import annotations
+import asyncio
 from dataclasses import dataclass
 import urllib.parse
 import httpx
 import datetime
 from internal.conf import Config
+from internal.metrics import instrument_upstream
 import base64
-from typing import Optional
+from typing import AsyncIterator, Optional
 import urllib
 import logging
 
@@ -34,16 +36,51 @@ S_CLIENT_ID = Config().SPOTIFY_CLIENT_ID
 S_CLIENT_SECRET = Config().SPOTIFY_CLIENT_SECRET
 
 
+@dataclass(slots=True)
+class TrackCandidate:
+    """
+    The fields of a Spotify track which the pipeline uses. Track objects
+    carry a lot more (e.g. album objects, available markets, external IDs),
+    and thousands of them may be in flight across concurrent curations.
+    """
+    name: str
+    artist: str
+    duration_ms: int
+    explicit: bool
+    image: str | None = None
+
+    @classmethod
+    def from_spotify(cls, track: dict) -> TrackCandidate:
+        images = (track.get("album") or {}).get("images") or [{}]
+        return cls(
+            name=track["name"],
+            artist=track["artists"][0]["name"],
+            duration_ms=track["duration_ms"],
+            explicit=track["explicit"],
+            image=images[0].get("url"),
+        )
+
+
 @dataclass
 class SpotifyService:
     _bearer_token: Optional[str] = None
     _refresh_token: Optional[str] = None
     _token_expiration_date: Optional[datetime.datetime] = None
-    _client: httpx.AsyncClient = httpx.AsyncClient(base_url=S_BASE_URL)
+    _client: Optional[httpx.AsyncClient] = None
     # Singleton instance
     _instance: Optional[SpotifyService] = None
 
     @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        """
+        The HTTP client, created on first use.
+        """
+        if cls._client is None:
+            cls._client = httpx.AsyncClient(base_url=S_BASE_URL)
+        return cls._client
+
+    @classmethod
+    @instrument_upstream("spotify")
     async def get_track_by_id(cls, id: str) -> dict:
         """
         Get the track information by its ID from Spotify. In case of multiple
@@ -55,7 +92,7 @@ class SpotifyService:
         if cls._token_expired():
             await cls._set_token()
 
-        r = await cls._client.get(
+        r = await cls.client().get(
             f"/v1/tracks/{id}",
             headers={"Authorization": f"Bearer {cls._bearer_token}"}
         )
@@ -64,48 +101,62 @@ class SpotifyService:
         return r.json()["tracks"]
 
     @classmethod
-    async def get_playlist_tracks(cls, id: str, total_limit: Optional[int] = None) -> list[dict]:
+    async def iter_playlist_tracks(
+            cls, id: str, total_limit: Optional[int] = None) -> AsyncIterator[list[TrackCandidate]]:
         """
-        Get the tracks from a playlist by its ID with an optional limit on the total number of tracks.
-        If no limit is provided, fetch all tracks.
+        Yields the tracks of a playlist one page at a time, with an optional
+        limit on the total number of tracks. The next page is requested before
+        the current one is yielded, so that it downloads while the caller is
+        busy with the current one. Use with `contextlib.aclosing` to cancel
+        that request when stopping early.
         """
         # Check if the bearer token is expired or even exists. This is required
         # for all API calls.
         if cls._token_expired():
             await cls._set_token()
 
-        # Set the target URL for the API call. If `next_url` is provided, use it
-        # to get the next page of results. Otherwise, use the default URL.
-        target_url = f"/v1/playlists/{id}/tracks"
-        found_tracks = []
-        while total_limit is None or len(found_tracks) < total_limit:
-            r = await cls._client.get(
-                target_url,
-                headers={"Authorization": f"Bearer {cls._bearer_token}"}
-            )
+        next_page = asyncio.ensure_future(cls.get_playlist_tracks_page(f"/v1/playlists/{id}/tracks"))
+        n_found = 0
+        try:
+            while next_page is not None:
+                json = await next_page
+                next_page = None
 
-            r.raise_for_status()
-            json: dict = r.json()
-            # Append the entries to the list, respecting the total limit if provided
-            found_tracks.extend(
-                map(lambda entry: entry["track"], json["items"][:total_limit - len(found_tracks)] if total_limit else json["items"])
-            )
-            if json["next"] and (total_limit is None or len(found_tracks) < total_limit):
-                # Parse the next URL to get the path and query parameters
-                parsed_url = urllib.parse.urlparse(json["next"])
-                path = parsed_url.path
-                query = parsed_url.query
+                items: list[dict] = json["items"]
+                if total_limit is not None:
+                    items = items[:total_limit - n_found]
+                n_found += len(items)
+
+                if json["next"] and (total_limit is None or n_found < total_limit):
+                    # Parse the next URL to get the path and query parameters
+                    parsed_url = urllib.parse.urlparse(json["next"])
+                    target_url = parsed_url.path
+                    if parsed_url.query:
+                        target_url += '?' + parsed_url.query
+                    next_page = asyncio.ensure_future(cls.get_playlist_tracks_page(target_url))
 
-                # Use the path and query parameters to set the target URL for the next request
-                target_url = path
-                if query:
-                    target_url += '?' + query
-            else:
-                break
+                # Removed tracks show up as entries without a track
+                yield [TrackCandidate.from_spotify(entry["track"]) for entry in items if entry.get("track")]
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    @classmethod
+    @instrument_upstream("spotify")
+    async def get_playlist_tracks_page(cls, target_url: str) -> dict:
+        """
+        Get a single page of the tracks of a playlist.
+        """
+        r = await cls.client().get(
+            target_url,
+            headers={"Authorization": f"Bearer {cls._bearer_token}"}
+        )
 
-        return found_tracks
+        r.raise_for_status()
+        return r.json()
 
     @classmethod
+    @instrument_upstream("spotify")
     async def search_playlists(cls, query: str | None = None, next_url: str | None = None, limit: int = 10) -> tuple[list[dict], str | None]:
         if (query is None) and (next_url is None):
             raise ValueError(
@@ -121,13 +172,13 @@ class SpotifyService:
             parsed_url = urllib.parse.urlparse(next_url)
             path = parsed_url.path
             query = parsed_url.query
-            r = await cls._client.get(
+            r = await cls.client().get(
                 path,
                 params=query,
                 headers={"Authorization": f"Bearer {cls._bearer_token}"}
             )
         else:
-            r = await cls._client.get(
+            r = await cls.client().get(
                 "/v1/search",
                 params={"q": query, "type": "playlist", "limit": limit},
                 headers={"Authorization": f"Bearer {cls._bearer_token}"}
@@ -144,7 +195,7 @@ class SpotifyService:
         """
         if cls._bearer_token is None:
             return True
-        return datetime.datetime.now() >= cls.__token_expiration_date
+        return datetime.datetime.now() >= cls._token_expiration_date
 
     @classmethod
     async def _set_token(cls):
@@ -153,12 +204,13 @@ class SpotifyService:
         """
         Set the bearer token for the Spotify API client.
         """
-        if cls.__refresh_token:
+        if cls._refresh_token:
             await cls.__refresh_access_token()
         else:
             await cls.__request_new_token()
 
     @classmethod
+    @instrument_upstream("spotify")
     async def __request_new_token(cls):
         """
         Request a new access token using client credentials.
@@ -166,7 +218,7 @@ class SpotifyService:
         auth_str = S_CLIENT_ID + ':' + S_CLIENT_SECRET
         b64_auth_str = base64.b64encode(auth_str.encode()).decode()
 
-        token_response = await cls._client.post(
+        token_response = await cls.client().post(
             "https://accounts.spotify.com/api/token",
             headers={"Authorization": f"Basic {b64_auth_str}"},
             data={"grant_type": "client_credentials"},
@@ -174,12 +226,13 @@ class SpotifyService:
 
         token_response.raise_for_status()
         token_data = token_response.json()
-        cls.__bearer_token = token_data["access_token"]
-        cls.__token_expiration_date = datetime.datetime.now(
+        cls._bearer_token = token_data["access_token"]
+        cls._token_expiration_date = datetime.datetime.now(
         ) + datetime.timedelta(seconds=token_data["expires_in"])
-        cls.__refresh_token = token_data.get("refresh_token")
+        cls._refresh_token = token_data.get("refresh_token")
 
     @classmethod
+    @instrument_upstream("spotify")
     async def __refresh_access_token(cls):
         """
         Refresh the access token using the refresh token.
@@ -187,7 +240,7 @@ class SpotifyService:
         auth_str = S_CLIENT_ID + ':' + S_CLIENT_SECRET
         b64_auth_str = base64.b64encode(auth_str.encode()).decode()
 
-        token_response = await cls._client.post(
+        token_response = await cls.client().post(
             "https://accounts.spotify.com/api/token",
             headers={
                 "Authorization": f"Basic {b64_auth_str}",
@@ -195,17 +248,17 @@ class SpotifyService:
             },
             data={
                 "grant_type": "refresh_token",
-                "refresh_token": cls.__refresh_token,
+                "refresh_token": cls._refresh_token,
                 "scope": " ".join(["playlist-read-private"]),
             },
         )
 
         token_response.raise_for_status()
         token_data = token_response.json()
-        cls.__bearer_token = token_data["access_token"]
-        cls.__token_expiration_date = datetime.datetime.now(
+        cls._bearer_token = token_data["access_token"]
+        cls._token_expiration_date = datetime.datetime.now(
         ) + datetime.timedelta(seconds=token_data["expires_in"])
 
         # Update the refresh token if a new one is provided
         if "refresh_token" in token_data:
-            cls.__refresh_token = token_data["refresh_token"]
+            cls._refresh_token = token_data["refresh_token"]
@@ -0,0 +1,183 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage, AbstractQueue
+
+from internal.priority import QUEUE_ARGUMENTS
+
+logger = logging.getLogger(__name__)
+
+SHARD_EXCHANGE = "acura.shards"
+MEMBERSHIP_EXCHANGE = "acura.workers"
+# Heartbeats a worker may miss before the others take over its shards
+MISSED_HEARTBEATS = 3
+
+
+def shard_owner(shard: int, workers: list[str]) -> str:
+    """
+    Rendezvous hashing: every shard goes to the worker with the highest
+    score for it, so a joining or leaving worker only moves its own share of
+    the shards and every worker agrees on the owners without coordination.
+    """
+    return max(workers, key=lambda worker: hashlib.blake2b(f"{worker}/{shard}".encode(), digest_size=8).digest())
+
+
+@dataclass
+class ShardTopology:
+    """
+    Optional subscriber affinity. Curation messages are routed by license
+    through a consistent hash exchange (`rabbitmq_consistent_hash_exchange`
+    plugin) to one of `count` shard queues, so that all messages of a
+    subscriber end up in the same queue and thus on the same worker, whose
+    in-process caches stay warm.
+
+    Publishers keep sending to the main queue, whose messages any worker
+    forwards to the exchange, or publish to the exchange directly with the
+    license as the routing key. Shard queues only deliver to one consumer at
+    a time (`x-single-active-consumer`), so a shard is never curated by two
+    workers even while they disagree on its owner.
+    """
+    exchange: AbstractExchange
+    # Shard queues by name, in shard order
+    queues: dict[str, AbstractQueue]
+
+    @classmethod
+    async def declare(cls, channel: AbstractChannel, queue_name: str, count: int) -> "ShardTopology":
+        exchange = await channel.declare_exchange(SHARD_EXCHANGE, aio_pika.ExchangeType.X_CONSISTENT_HASH, durable=True)
+        queues = {}
+        for shard in range(count):
+            queue = await channel.declare_queue(f"{queue_name}.shard.{shard}", durable=True, arguments={
+                **QUEUE_ARGUMENTS,
+                "x-single-active-consumer": True,
+            })
+            # The routing key of a binding is its weight
+            await queue.bind(exchange, routing_key="1")
+            queues[queue.name] = queue
+        return cls(exchange, queues)
+
+    @staticmethod
+    def routing_key(msg: AbstractIncomingMessage) -> str:
+        try:
+            return str(json.loads(msg.body)["license"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            # Invalid messages are dead-lettered by whichever shard gets them
+            return msg.message_id or ""
+
+    async def forward(self, msg: AbstractIncomingMessage) -> None:
+        """
+        Move a message of the main queue to the shard of its subscriber. It
+        is acknowledged once the copy is confirmed.
+        """
+        await self.exchange.publish(
+            aio_pika.Message(
+                body=msg.body,
+                headers=msg.headers,
+                content_type=msg.content_type,
+                message_id=msg.message_id,
+                correlation_id=msg.correlation_id,
+                priority=msg.priority,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=self.routing_key(msg),
+        )
+        await msg.ack()
+
+    def owned(self, workers: list[str], worker_id: str) -> set[str]:
+        return {name for shard, name in enumerate(self.queues) if shard_owner(shard, workers) == worker_id}
+
+
+@dataclass
+class WorkerMembership:
+    """
+    Workers taking part in the sharded topology. Every worker announces
+    itself on the `acura.workers` fanout exchange every `interval` seconds,
+    and announces its departure when it stops. Workers which were not heard
+    from for a few intervals are considered gone. `changed` is set whenever
+    the set of workers changes, and then the shards are rebalanced.
+    """
+    interval: float
+    worker_id: str = field(default_factory=lambda: f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}")
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    # Last heartbeat of every other worker, by ID
+    _seen: dict[str, float] = field(default_factory=dict, repr=False)
+
+    def workers(self) -> list[str]:
+        return sorted({self.worker_id, *self._seen})
+
+    async def run(self, channel: AbstractChannel) -> None:
+        exchange = await channel.declare_exchange(MEMBERSHIP_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+        queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        await queue.bind(exchange)
+        listener = asyncio.create_task(self._listen(queue))
+        try:
+            while True:
+                await self._announce(exchange, leaving=False)
+                await asyncio.sleep(self.interval)
+                self._expire()
+        finally:
+            listener.cancel()
+            try:
+                await self._announce(exchange, leaving=True)
+            except Exception as e:
+                logger.warning("Failed to announce the departure of worker %s: %s", self.worker_id, e)
+
+    async def _announce(self, exchange: AbstractExchange, leaving: bool) -> None:
+        await exchange.publish(
+            aio_pika.Message(json.dumps({"worker": self.worker_id, "leaving": leaving}).encode()), routing_key="")
+
+    async def _listen(self, queue: AbstractQueue) -> None:
+        async with queue.iterator(no_ack=True) as iterator:
+            async for message in iterator:
+                try:
+                    heartbeat = json.loads(message.body)
+                    worker = heartbeat["worker"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    logger.error("Ignoring malformed worker heartbeat.")
+                    continue
+                if worker == self.worker_id:
+                    continue
+                if heartbeat.get("leaving"):
+                    if self._seen.pop(worker, None) is not None:
+                        logger.info("Worker %s left", worker)
+                        self.changed.set()
+                    continue
+                if worker not in self._seen:
+                    logger.info("Worker %s joined", worker)
+                    self.changed.set()
+                self._seen[worker] = time.monotonic()
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.interval * MISSED_HEARTBEATS
+        for worker, seen_at in list(self._seen.items()):
+            if seen_at < deadline:
+                logger.warning("Worker %s stopped sending heartbeats", worker)
+                del self._seen[worker]
+                self.changed.set()
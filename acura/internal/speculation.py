@@ -0,0 +1,83 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Coroutine
+
+from internal import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SpeculativeDiscovery:
+    """
+    A discovery task (Spotify search, optionally followed by the playlist
+    prefilter) that was started before the router decided which branch of the
+    pipeline to take. The task is either claimed by the discovery branch or
+    discarded when the router decides to reuse existing data.
+    """
+    query: str
+    task: asyncio.Task
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: float | None = None
+
+    @classmethod
+    def start(cls, query: str, work: Coroutine[Any, Any, Any]) -> "SpeculativeDiscovery":
+        metrics.SPECULATIONS.inc(outcome="started")
+        speculation = cls(query=query, task=asyncio.create_task(work))
+        speculation.task.add_done_callback(speculation._mark_finished)
+        return speculation
+
+    def _mark_finished(self, _: asyncio.Task) -> None:
+        self.finished_at = time.monotonic()
+
+    async def claim(self, query: str | None) -> Any | None:
+        """
+        Wait for the speculative result if it was started for the same query.
+        Returns None (and discards the work) if the query has changed since.
+        """
+        if query != self.query:
+            self.discard("query changed")
+            return None
+
+        metrics.SPECULATIONS.inc(outcome="used")
+        return await self.task
+
+    def discard(self, reason: str) -> None:
+        """
+        Cancel the speculative task (if it is still running) and account for
+        the time spent on it as wasted work.
+        """
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled() and self.task.exception() is not None:
+            # The exception has to be retrieved, otherwise asyncio complains
+            # about it never being retrieved when the task is garbage collected.
+            logger.debug("Discarded speculative discovery failed: %s", self.task.exception())
+
+        wasted = (self.finished_at or time.monotonic()) - self.started_at
+        metrics.SPECULATIONS.inc(outcome="discarded")
+        metrics.SPECULATION_WASTED.inc(wasted)
+        logger.info(
+            "Discarded speculative discovery for query `%s` after %.2fs (%s)", self.query, wasted, reason)
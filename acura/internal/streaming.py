@@ -0,0 +1,408 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import logging
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, ClassVar
+
+from pydantic_graph import BaseNode, End, GraphRunContext
+
+from internal import metrics
+from internal.chain import (
+    GraphDeps,
+    GraphState,
+    MusicDiscoveryPipeline,
+    GenerateSearchQueryNode,
+    SourceSelectionRouterNode,
+    SearchSpotifyPlaylistsNode,
+    MatchQueryWithSpotifyPlaylist,
+    SearchAndVerifyYoutubeAndSaveNode,
+    ReuseExistingDataNode,
+    ReuseCachedCurationNode,
+)
+from internal.budget import BudgetExhausted
+from internal.flight_recorder import CurationRecording, FlightRecorder
+from internal.models.dao import PlaylistsDAO
+from internal.publishing import SuggestionBatcher
+from internal.services.embeddings import EmbeddingsService, Embedding
+from internal.services.spotify import TrackCandidate
+from internal.usage import UpstreamUsage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CurationJob:
+    """
+    A single curation travelling through the stages of the streaming pipeline.
+    """
+    deps: GraphDeps
+    done: asyncio.Future
+    recording: CurationRecording | None = None
+    state: GraphState = field(default_factory=GraphState)
+
+    batcher: SuggestionBatcher | None = None
+    spotify_playlist_id: str | None = None
+    pending_tracks: int = 0
+    n_verified_tracks: int = 0
+    n_added_tracks: int = 0
+    added_track_ids: list[int] = field(default_factory=list)
+    completing: bool = False
+    # Worker tasks currently handling an item of this job
+    active: set[asyncio.Task] = field(default_factory=set, repr=False)
+    abandoned: bool = False
+
+    def is_finished(self) -> bool:
+        return self.done.done()
+
+    def finish(self, n_added_tracks: int) -> None:
+        if not self.done.done():
+            self.done.set_result(n_added_tracks)
+
+    def fail(self, error: BaseException) -> None:
+        if not self.done.done():
+            self.done.set_exception(error)
+
+    def abandon(self) -> None:
+        """
+        Cancel the work in flight on behalf of this job, including its
+        upstream calls, e.g. once its deadline has passed.
+        """
+        self.abandoned = True
+        self.done.cancel()
+        for task in self.active:
+            task.cancel()
+
+    async def complete(self) -> None:
+        if self.completing:
+            return
+        self.completing = True
+        await self.batcher.flush()
+        SearchAndVerifyYoutubeAndSaveNode.remember_curation(
+            self.state, self.spotify_playlist_id, self.added_track_ids)
+        self.finish(self.n_added_tracks)
+
+    async def track_done(self) -> None:
+        self.pending_tracks -= 1
+        if self.pending_tracks == 0:
+            await self.complete()
+
+
+@dataclass
+class NodeWork:
+    job: CurationJob
+    node: BaseNode
+
+
+@dataclass
+class TrackWork:
+    job: CurationJob
+    track: TrackCandidate
+    youtube_result: dict | None = None
+    embedding: Embedding | None = None
+
+
+@dataclass
+class Stage:
+    """
+    A pool of workers consuming a bounded queue. Producers block on `put`
+    while the queue is full, which propagates backpressure upstream.
+    """
+    name: str
+    handler: Callable[[NodeWork | TrackWork], Awaitable[None]]
+    workers: int
+    queue: asyncio.Queue
+    _tasks: list[asyncio.Task] = field(default_factory=list, repr=False)
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"acura-stage-{self.name}-{i}") for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, item: NodeWork | TrackWork) -> None:
+        await self.queue.put(item)
+        metrics.STAGE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+
+    async def _work(self) -> None:
+        while True:
+            item = await self.queue.get()
+            metrics.STAGE_QUEUE_DEPTH.set(self.queue.qsize(), stage=self.name)
+            task = asyncio.current_task()
+            try:
+                # Work left over from failed or abandoned curations is dropped
+                if not item.job.is_finished():
+                    item.job.active.add(task)
+                    # Tracks are the fanned out work of the save node
+                    node_id = item.node.get_id() if isinstance(item, NodeWork) \
+                        else SearchAndVerifyYoutubeAndSaveNode.get_id()
+                    with FlightRecorder.resume(item.job.recording), metrics.STAGE_DURATION.time(stage=self.name), \
+                            UpstreamUsage.node(node_id):
+                        await self.handler(item)
+            except asyncio.CancelledError:
+                # Only the item was cancelled when its job was abandoned, the
+                # worker itself carries on.
+                if not item.job.abandoned:
+                    raise
+                task.uncancel()
+            except Exception as e:
+                item.job.fail(e)
+            finally:
+                item.job.active.discard(task)
+                self.queue.task_done()
+
+
+@dataclass
+class StreamingPipeline:
+    """
+    Alternative execution engine for the music discovery pipeline. Instead of
+    running every curation end to end in its own task, the nodes are split
+    into stages with independently sized worker pools connected by bounded
+    queues:
+
+    - query: query generation and source selection
+    - discovery: Spotify playlist search and matching
+    - verification: YouTube lookup of every track of the matched playlist
+    - embedding: embeddings of the verified tracks
+    - persistence: writes of new tracks and of reused suggestions
+
+    A slow upstream thus only saturates its own stage, while the other stages
+    keep serving the rest of the curations in flight. The tracks of a matched
+    playlist are fed into verification by a producer task per curation, so
+    that the backpressure of verification only throttles that producer.
+    """
+    max_jobs: int = 50
+    queue_size: int = 100
+    workers: dict[str, int] = field(default_factory=dict)
+
+    DEFAULT_WORKERS: ClassVar[dict[str, int]] = {
+        "query": 4,
+        "discovery": 4,
+        "verification": 16,
+        "embedding": 8,
+        "persistence": 4,
+    }
+    NODE_STAGES: ClassVar[dict[type, str]] = {
+        GenerateSearchQueryNode: "query",
+        SourceSelectionRouterNode: "query",
+        SearchSpotifyPlaylistsNode: "discovery",
+        MatchQueryWithSpotifyPlaylist: "discovery",
+        ReuseExistingDataNode: "persistence",
+        ReuseCachedCurationNode: "persistence",
+    }
+
+    def __post_init__(self):
+        self._admission = asyncio.Semaphore(self.max_jobs)
+        handlers = {
+            "query": self._run_node,
+            "discovery": self._run_node,
+            "verification": self._verify_track,
+            "embedding": self._embed_track,
+            "persistence": self._persist,
+        }
+        self.stages: dict[str, Stage] = {}
+        for name, handler in handlers.items():
+            # Retries loop back from discovery to query generation. Sizing the
+            # query queue by the number of admitted jobs guarantees that such
+            # a put never blocks, so the cycle cannot deadlock.
+            maxsize = self.max_jobs if name == "query" else self.queue_size
+            self.stages[name] = Stage(
+                name, handler, self.workers.get(name, self.DEFAULT_WORKERS[name]), asyncio.Queue(maxsize))
+        # Tasks streaming the tracks of matched playlists, at most one per job
+        self._producers: set[asyncio.Task] = set()
+
+    @staticmethod
+    def parse_workers(spec: str) -> dict[str, int]:
+        """
+        Parses `stage=workers` pairs, e.g. "verification=32,embedding=8".
+        """
+        workers = {}
+        for pair in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, count = pair.partition("=")
+            if name.strip() not in StreamingPipeline.DEFAULT_WORKERS:
+                raise ValueError(f"Unknown streaming pipeline stage `{name.strip()}`")
+            workers[name.strip()] = int(count)
+        return workers
+
+    def start(self) -> None:
+        for stage in self.stages.values():
+            stage.start()
+        logger.info(
+            "Streaming pipeline started with workers %s",
+            {name: stage.workers for name, stage in self.stages.items()})
+
+    async def stop(self) -> None:
+        for task in self._producers:
+            task.cancel()
+        await asyncio.gather(*self._producers, return_exceptions=True)
+        for stage in self.stages.values():
+            await stage.stop()
+
+    async def run(self, deps: GraphDeps) -> int:
+        """
+        Same contract as `MusicDiscoveryPipeline.run`: returns the number of
+        added tracks once the curation has left the last stage.
+        """
+        async with self._admission:
+            start_node, state = await MusicDiscoveryPipeline.restore(deps)
+            job = CurationJob(deps, asyncio.get_running_loop().create_future(), FlightRecorder.current(), state)
+            try:
+                await self._route(job, start_node)
+                n_added_tracks = await job.done
+                if deps.checkpointer is not None:
+                    await deps.checkpointer.clear()
+                return n_added_tracks
+            except asyncio.CancelledError:
+                job.abandon()
+                # Tracks saved before the cancellation are still published
+                if job.batcher is not None:
+                    await job.batcher.flush()
+                raise
+            finally:
+                deps.discard_speculation("pipeline finished")
+
+    async def _route(self, job: CurationJob, node: BaseNode | End) -> None:
+        if isinstance(node, End):
+            job.finish(node.data)
+        elif isinstance(node, SearchAndVerifyYoutubeAndSaveNode):
+            self._start_fan_out(job, node)
+        else:
+            await self.stages[self.NODE_STAGES[type(node)]].put(NodeWork(job, node))
+
+    def _start_fan_out(self, job: CurationJob, node: SearchAndVerifyYoutubeAndSaveNode) -> None:
+        """
+        Streams the tracks of the matched playlist from a producer task of its
+        own, so that the discovery worker which matched it goes back to its
+        queue right away, and a saturated verification stage only holds up
+        this producer.
+        """
+        task = asyncio.create_task(self._produce_tracks(job, node), name=f"acura-fan-out-{job.deps.sid}")
+        self._producers.add(task)
+        # Cancelled along with the rest of the job when it is abandoned
+        job.active.add(task)
+        task.add_done_callback(self._producers.discard)
+        task.add_done_callback(job.active.discard)
+
+    async def _produce_tracks(self, job: CurationJob, node: SearchAndVerifyYoutubeAndSaveNode) -> None:
+        try:
+            await self._fan_out(job, node)
+        except Exception as e:
+            job.fail(e)
+
+    async def _fan_out(self, job: CurationJob, node: SearchAndVerifyYoutubeAndSaveNode) -> None:
+        """
+        Splits the matched playlist into per-track work items as its pages
+        are downloaded, so that the first tracks are verified while the rest
+        of the playlist is still being read. Tracks complete out of order
+        here, so unlike the graph engine the checkpoint is not advanced per
+        batch: a resumed job skips only what the graph engine recorded, or
+        restarts the whole playlist.
+        """
+        playlist = await PlaylistsDAO.create_or_get_playlist(job.deps.sid)
+        job.batcher = job.deps.suggestion_batcher(playlist.id)
+        job.spotify_playlist_id = node.spotify_playlist_id
+        job.n_added_tracks = node.n_added_tracks
+        job.added_track_ids = list(node.added_track_ids)
+
+        # Held until the whole playlist has been read, so that the job does
+        # not complete when the tracks of the first pages are done early.
+        job.pending_tracks = 1
+        with UpstreamUsage.node(node.get_id()):
+            async with aclosing(node.stream_tracks()) as tracks:
+                async for track in tracks:
+                    # The target was met, or the job failed, before the end
+                    if job.completing or job.is_finished():
+                        return
+                    job.pending_tracks += 1
+                    await self.stages["verification"].put(TrackWork(job, track))
+        await job.track_done()
+
+    async def _run_node(self, work: NodeWork) -> None:
+        node_id = work.node.get_id()
+        with metrics.NODE_DURATION.time(node=node_id), FlightRecorder.span("node", node_id):
+            next_node = await work.node.run(GraphRunContext(work.job.state, work.job.deps))
+        if not isinstance(next_node, End):
+            await work.job.deps.checkpoint(next_node, work.job.state)
+        await self._route(work.job, next_node)
+
+    async def _verify_track(self, work: TrackWork) -> None:
+        # Verified tracks are almost always added, so there is no need to
+        # verify more of them than the target asks for.
+        try:
+            if work.job.deps.budget.tracks_wanted(work.job.n_verified_tracks) == 0:
+                raise BudgetExhausted("Enough tracks verified")
+            work.job.deps.budget.spend("search")
+        except BudgetExhausted:
+            await work.job.track_done()
+            return
+
+        try:
+            work.youtube_result = await SearchAndVerifyYoutubeAndSaveNode.find_youtube_video(work.track)
+        except Exception as e:
+            raise RuntimeError(
+                f"Error searching and verifying YouTube for track '{work.track.name}']: {e}")
+
+        if work.youtube_result is None:
+            await work.job.track_done()
+            return
+        work.job.n_verified_tracks += 1
+        await self.stages["embedding"].put(work)
+
+    async def _embed_track(self, work: TrackWork) -> None:
+        try:
+            work.job.deps.budget.spend("embedding")
+        except BudgetExhausted:
+            await work.job.track_done()
+            return
+
+        work.embedding = await EmbeddingsService.create_track_embedding(
+            work.job.state.spotify_search_query,
+            work.track.name,
+            work.track.artist,
+        )
+        await self.stages["persistence"].put(work)
+
+    async def _persist(self, work: NodeWork | TrackWork) -> None:
+        if isinstance(work, NodeWork):
+            await self._run_node(work)
+            return
+
+        job = work.job
+        # Tracks verified concurrently with the one which met the target
+        if job.completing:
+            return
+
+        tid = await SearchAndVerifyYoutubeAndSaveNode.save_track(work.track, work.youtube_result, work.embedding)
+        job.n_added_tracks += 1
+        if tid is not None:
+            job.added_track_ids.append(tid)
+            await job.batcher.add(tid)
+
+        if job.deps.budget.should_stop(job.n_added_tracks):
+            await job.complete()
+        else:
+            await job.track_done()
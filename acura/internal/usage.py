@@ -0,0 +1,149 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import contextvars
+import datetime
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import ClassVar
+
+from internal.flight_recorder import FlightRecorder
+
+logger = logging.getLogger(__name__)
+
+_node: contextvars.ContextVar[str | None] = contextvars.ContextVar("upstream_usage_node", default=None)
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+@dataclass
+class UpstreamUsage:
+    """
+    Upstream calls and tokens of this process per subscriber, pipeline node
+    and upstream, aggregated in memory and periodically added to the
+    `upstream_usage` table.
+
+    The subscriber is the one of the curation being recorded (see
+    `FlightRecorder`), so calls made on behalf of several subscribers at once,
+    like batched query generation, are attributed to none.
+    """
+    # Nothing is aggregated unless the totals are flushed somewhere
+    enabled: ClassVar[bool] = False
+    # Totals by hour (in UTC) of the calls, subscriber, node and upstream
+    _totals: ClassVar[dict[tuple[datetime.datetime, int | None, str | None, str], UsageTotals]] = {}
+
+    @classmethod
+    @contextmanager
+    def node(cls, node_id: str):
+        """
+        Attribute the upstream calls made in the wrapped block, including the
+        tasks spawned from it, to the given pipeline node.
+        """
+        token = _node.set(node_id)
+        try:
+            yield
+        finally:
+            _node.reset(token)
+
+    @classmethod
+    def record(cls, upstream: str, calls: int = 0, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        if not cls.enabled:
+            return
+        recording = FlightRecorder.current()
+        period_start = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        key = (period_start, recording.sid if recording is not None else None, _node.get(), upstream)
+        totals = cls._totals.get(key)
+        if totals is None:
+            totals = cls._totals[key] = UsageTotals()
+        totals.calls += calls
+        totals.input_tokens += input_tokens
+        totals.output_tokens += output_tokens
+
+    @classmethod
+    def record_model_usage(cls, usage) -> None:
+        """
+        Record the tokens of an agent run (a `pydantic_ai.usage.Usage`). The
+        run itself is already counted by `track_upstream`, so only the extra
+        requests it made (retries, tool calls) are added to the calls.
+        """
+        cls.record(
+            "llm",
+            calls=max((usage.requests or 1) - 1, 0),
+            input_tokens=usage.request_tokens or 0,
+            output_tokens=usage.response_tokens or 0,
+        )
+
+    @classmethod
+    async def flush(cls) -> int:
+        """
+        Add the totals aggregated since the last flush to the database, in a
+        single batch, and return the number of rows written. On failure the
+        totals are kept for the next flush.
+        """
+        # Imported here since the DAO imports the services, which record usage
+        from internal.models.dao import UpstreamUsageDAO
+
+        if not cls._totals:
+            return 0
+        totals, cls._totals = cls._totals, {}
+        rows = [
+            {
+                "period_start": period_start,
+                "sid": sid,
+                "node": node,
+                "upstream": upstream,
+                "calls": t.calls,
+                "input_tokens": t.input_tokens,
+                "output_tokens": t.output_tokens,
+            }
+            for (period_start, sid, node, upstream), t in totals.items()
+        ]
+        try:
+            await UpstreamUsageDAO.add_usage(rows)
+        except BaseException:
+            for key, t in totals.items():
+                current = cls._totals.setdefault(key, UsageTotals())
+                current.calls += t.calls
+                current.input_tokens += t.input_tokens
+                current.output_tokens += t.output_tokens
+            raise
+        return len(rows)
+
+
+async def run_usage_flush(interval: float) -> None:
+    """
+    Periodically flush the upstream usage totals of this worker. The totals
+    left when cancelled must be flushed by the caller.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await UpstreamUsage.flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Failed to flush the upstream usage: %s", e)
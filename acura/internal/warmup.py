@@ -0,0 +1,77 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+import importlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import ClassVar, Optional
+
+logger = logging.getLogger(__name__)
+
+# Modules which only curations need, and which take most of the worker's
+# start when imported up front: the pipeline (pydantic_graph, pydantic_ai)
+# and the OpenAI client behind the agents and the embeddings.
+PIPELINE_MODULES = ("internal.chain", "pydantic_ai.models.openai", "openai")
+
+
+@dataclass
+class PipelineWarmup:
+    """
+    Imports the pipeline and configures Logfire in a background thread, so
+    that the worker can connect to its dependencies and start consuming
+    without waiting for them. The first curations wait for the warm-up
+    instead of importing the modules on the event loop.
+    """
+    _task: ClassVar[Optional[asyncio.Task]] = None
+
+    @classmethod
+    def start(cls, logfire_token: str | None) -> None:
+        if cls._task is None:
+            cls._task = asyncio.create_task(asyncio.to_thread(cls._warm_up, logfire_token))
+
+    @classmethod
+    async def wait(cls) -> None:
+        """
+        Wait for the warm-up to finish, if it was started. Failures are only
+        logged: the modules are imported again where they are used, which
+        raises the same error there.
+        """
+        if cls._task is None:
+            return
+        try:
+            await asyncio.shield(cls._task)
+        except Exception as e:
+            logger.error("Pipeline warm-up failed: %s", e)
+
+    @staticmethod
+    def _warm_up(logfire_token: str | None) -> None:
+        started = time.perf_counter()
+        for module in PIPELINE_MODULES:
+            importlib.import_module(module)
+
+        import logfire
+        from pydantic_ai import Agent
+
+        logger.info("Logfire is initializing...")
+        logfire.configure(token=logfire_token, service_name="acura")
+        Agent.instrument_all()  # used for pydanticai logging
+        logger.info("Pipeline warmed up in %.3fs", time.perf_counter() - started)
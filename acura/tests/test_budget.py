@@ -0,0 +1,122 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from internal.budget import BudgetExhausted, CurationBudget
+
+
+def test_spend_raises_once_the_cap_is_reached():
+    budget = CurationBudget(max_calls={"llm": 2})
+    budget.spend("llm")
+    budget.spend("llm")
+
+    with pytest.raises(BudgetExhausted):
+        budget.spend("llm")
+    assert budget.stop_reason == "llm"
+    assert budget.remaining("llm") == 0
+
+
+def test_uncapped_calls_are_unlimited():
+    budget = CurationBudget(max_calls={"llm": 1})
+    for _ in range(100):
+        budget.spend("search")
+
+    assert budget.remaining("search") is None
+    assert budget.stop_reason is None
+
+
+def test_should_stop_at_the_target():
+    budget = CurationBudget(target_tracks=10)
+
+    assert budget.tracks_wanted(4) == 6
+    assert not budget.should_stop(9)
+    assert budget.should_stop(10)
+    assert budget.stop_reason == "target"
+
+
+def test_should_stop_after_the_deadline():
+    async def main():
+        budget = CurationBudget(deadline=asyncio.get_running_loop().time() - 1)
+        assert budget.should_stop(0)
+        assert budget.stop_reason == "deadline"
+
+    asyncio.run(main())
+
+
+def test_first_stop_reason_is_kept():
+    budget = CurationBudget(target_tracks=1, max_calls={"llm": 0})
+    with pytest.raises(BudgetExhausted):
+        budget.spend("llm")
+    budget.should_stop(1)
+
+    assert budget.stop_reason == "llm"
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """
+    The graph pipeline with upstreams which never find anything, so that
+    every curation loops back for new search queries.
+    """
+    from internal import chain
+
+    async def get_prompts(sid):
+        return [SimpleNamespace(prompt="prompt")]
+
+    async def generate_search_query(cls, prompt):
+        return "query"
+
+    async def create_search_query_embedding(query):
+        return np.ones(4, dtype=np.float32)
+
+    async def get_similar_track_ids(embedding):
+        return []
+
+    async def get_suggestions(sid):
+        return []
+
+    async def search_playlists(query):
+        return [], None
+
+    monkeypatch.setattr(chain.PromptsDAO, "get_subscriber_prompts_by_sid", get_prompts)
+    monkeypatch.setattr(chain.GenerateSearchQueryNode, "generate_search_query", classmethod(generate_search_query))
+    monkeypatch.setattr(chain.EmbeddingsService, "create_search_query_embedding", create_search_query_embedding)
+    monkeypatch.setattr(chain, "get_similar_track_ids", get_similar_track_ids)
+    monkeypatch.setattr(chain.SuggestionsDAO, "get_past_n_hours_subscriber_suggestions", get_suggestions)
+    monkeypatch.setattr(chain.SpotifyService, "search_playlists", search_playlists)
+    return chain
+
+
+@pytest.mark.parametrize("kind", ["llm", "embedding"])
+def test_exhausted_budget_ends_the_curation_with_the_published_tracks(pipeline, kind):
+    budget = CurationBudget(max_calls={kind: 2})
+    # Published by an earlier node, e.g. before a resumed checkpoint
+    budget.n_published = 3
+
+    n_tracks = asyncio.run(pipeline.MusicDiscoveryPipeline().run(pipeline.GraphDeps(1, budget=budget)))
+
+    assert n_tracks == 3
+    assert budget.stop_reason == kind
+    assert budget.calls[kind] == 2
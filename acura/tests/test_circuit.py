@@ -0,0 +1,181 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import pytest
+
+from internal import circuit, metrics
+from internal.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, circuit_open_in
+from internal.conf import Config
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def breaker(**overrides) -> CircuitBreaker:
+    return CircuitBreaker("brave", **{
+        "failure_rate": 0.5,
+        "slow_call_seconds": 1.0,
+        "slow_call_rate": 0.5,
+        "window": 60,
+        "min_calls": 4,
+        "open_seconds": 30,
+        "probes": 2,
+        **overrides,
+    })
+
+
+def call(b: CircuitBreaker, failed: bool = False, duration: float = 0.1) -> None:
+    b.after_call(b.before_call(), failed, duration)
+
+
+def opened(clock) -> CircuitBreaker:
+    b = breaker()
+    for _ in range(4):
+        call(b, failed=True)
+    assert b.state == OPEN
+    return b
+
+
+def test_stays_closed_below_min_calls(clock):
+    b = breaker()
+    for _ in range(3):
+        call(b, failed=True)
+    assert b.state == CLOSED
+
+
+def test_opens_at_the_failure_rate(clock):
+    b = breaker()
+    for failed in (False, True, False):
+        call(b, failed=failed)
+    assert b.state == CLOSED
+
+    call(b, failed=True)
+    assert b.state == OPEN
+
+
+def test_opens_at_the_slow_call_rate(clock):
+    b = breaker()
+    for duration in (0.1, 0.1, 2.0):
+        call(b, duration=duration)
+    assert b.state == CLOSED
+
+    call(b, duration=2.0)
+    assert b.state == OPEN
+
+
+def test_calls_outside_of_the_window_are_forgotten(clock):
+    b = breaker()
+    for _ in range(3):
+        call(b, failed=True)
+    clock[0] += 61
+
+    call(b, failed=True)
+    assert b.state == CLOSED
+
+
+def test_calls_which_did_not_reach_the_upstream_are_not_counted(clock):
+    b = breaker()
+    for _ in range(4):
+        b.after_call(b.before_call(), None, 0.1)
+    assert b.state == CLOSED
+    assert not b._calls
+
+
+def test_open_circuit_fails_fast(clock):
+    b = opened(clock)
+    clock[0] += 10
+
+    with pytest.raises(CircuitOpen) as e:
+        b.before_call()
+    assert e.value.retry_after == pytest.approx(20)
+
+
+def test_half_open_only_lets_the_probes_through(clock):
+    b = opened(clock)
+    clock[0] += 30
+
+    assert b.before_call()
+    assert b.state == HALF_OPEN
+    assert b.before_call()
+    with pytest.raises(CircuitOpen):
+        b.before_call()
+
+
+def test_closes_only_after_all_probes_succeeded(clock):
+    b = opened(clock)
+    clock[0] += 30
+
+    call(b)
+    assert b.state == HALF_OPEN
+    call(b)
+    assert b.state == CLOSED
+
+
+@pytest.mark.parametrize("failed, duration", [(True, 0.1), (False, 2.0)])
+def test_failed_or_slow_probe_opens_again(clock, failed, duration):
+    b = opened(clock)
+    clock[0] += 30
+
+    call(b)
+    call(b, failed=failed, duration=duration)
+    assert b.state == OPEN
+    with pytest.raises(CircuitOpen):
+        b.before_call()
+
+
+def test_circuit_open_is_found_in_wrapped_errors():
+    cause = CircuitOpen("brave", 5)
+    try:
+        try:
+            raise cause
+        except CircuitOpen as e:
+            raise RuntimeError("Error searching and verifying YouTube") from e
+    except RuntimeError as e:
+        assert circuit_open_in(e) is cause
+    assert circuit_open_in(RuntimeError()) is None
+
+
+@pytest.fixture
+def brave(monkeypatch, clock):
+    monkeypatch.setattr(Config(), "CIRCUIT_MIN_CALLS", 4)
+    b = breaker(slow_call_seconds=0.5)
+    monkeypatch.setitem(CircuitBreaker._breakers, "brave", b)
+    return b
+
+
+def test_retried_call_counts_its_attempts_instead_of_itself(brave):
+    with metrics.track_upstream("brave", "search"):
+        metrics.record_attempt("brave", True, 0.1)
+        metrics.record_attempt("brave", False, 0.1)
+
+    assert [failed for _, failed, _ in brave._calls] == [True, False]
+    assert not any(slow for _, _, slow in brave._calls)
+
+
+def test_call_without_attempts_counts_as_a_whole(brave):
+    with pytest.raises(ValueError):
+        with metrics.track_upstream("brave", "search"):
+            raise ValueError()
+
+    assert [failed for _, failed, _ in brave._calls] == [True]
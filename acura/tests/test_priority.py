@@ -0,0 +1,103 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from internal import priority
+from internal.priority import PriorityGate, message_urgency
+
+
+def message(body: bytes, amqp_priority: int | None = None) -> SimpleNamespace:
+    return SimpleNamespace(body=body, priority=amqp_priority, message_id="m")
+
+
+@pytest.mark.parametrize("body, amqp_priority, urgency", [
+    (b'{"urgency": "critical"}', None, "critical"),
+    (b'{"urgency": "low"}', 3, "low"),
+    (b'{"urgency": "unknown"}', 2, "high"),
+    (b'{}', 7, "critical"),
+    (b'{}', None, "normal"),
+    (b'not json', None, "normal"),
+])
+def test_message_urgency(body, amqp_priority, urgency):
+    assert message_urgency(message(body, amqp_priority)) == urgency
+
+
+async def admission_order(gate: PriorityGate, waiters: list[tuple[str, int]], advance=None) -> list[str]:
+    admitted = []
+
+    async def wait(name: str, level: int):
+        await gate.acquire(level)
+        admitted.append(name)
+
+    tasks = []
+    for name, level in waiters:
+        tasks.append(asyncio.create_task(wait(name, level)))
+        await asyncio.sleep(0)
+        if advance is not None:
+            advance()
+    for _ in waiters:
+        gate.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return admitted
+
+
+def test_gate_admits_by_priority(monkeypatch):
+    monkeypatch.setattr(priority.time, "monotonic", lambda: 1000.0)
+    gate = PriorityGate(slots=0, aging=30)
+
+    order = asyncio.run(admission_order(gate, [("low", 0), ("critical", 3), ("normal", 1)]))
+
+    assert order == ["critical", "normal", "low"]
+
+
+def test_gate_ages_waiters_so_that_low_priorities_are_not_starved(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(priority.time, "monotonic", lambda: now[0])
+    gate = PriorityGate(slots=0, aging=30)
+
+    def advance():
+        # Every waiter arrives 40s after the previous one
+        now[0] += 40
+
+    order = asyncio.run(admission_order(gate, [("low", 0), ("normal", 1)], advance))
+
+    assert order == ["low", "normal"]
+
+
+def test_gate_passes_on_the_slot_of_a_cancelled_waiter():
+    async def main():
+        gate = PriorityGate(slots=1, aging=30)
+        await gate.acquire(1)
+        cancelled = asyncio.create_task(gate.acquire(1))
+        waiting = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0)
+
+        # Admitted right before being cancelled
+        gate.release()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(main())
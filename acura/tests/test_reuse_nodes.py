@@ -0,0 +1,71 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from internal import chain
+from internal.conf import Config
+
+
+@pytest.fixture
+def failing_publisher(monkeypatch):
+    """
+    A playlist without recent suggestions, whose second batch fails to
+    publish.
+    """
+    published = []
+
+    async def create_or_get_playlist(sid):
+        return SimpleNamespace(id=10)
+
+    async def get_suggestions(playlist_id):
+        return []
+
+    async def publish_suggestions(sid, playlist_id, batch):
+        if published:
+            raise ConnectionError("database unavailable")
+        published.extend(batch)
+        return batch
+
+    async def get_similar_track_ids(embedding):
+        return [SimpleNamespace(id=tid) for tid in range(1, 5)]
+
+    monkeypatch.setattr(Config(), "PUBLISH_BATCH_SIZE", 2)
+    monkeypatch.setattr(chain.PlaylistsDAO, "create_or_get_playlist", create_or_get_playlist)
+    monkeypatch.setattr(chain.SuggestionsDAO, "get_past_n_hours_suggestions", get_suggestions)
+    monkeypatch.setattr(chain.SuggestionsDAO, "publish_suggestions", publish_suggestions)
+    monkeypatch.setattr(chain, "get_similar_track_ids", get_similar_track_ids)
+    return published
+
+
+@pytest.mark.parametrize("node", [
+    chain.ReuseExistingDataNode(search_embedding=np.ones(4, dtype=np.float32)),
+    chain.ReuseCachedCurationNode(track_ids=[1, 2, 3, 4]),
+], ids=type)
+def test_failed_batch_fails_the_curation(failing_publisher, node):
+    ctx = SimpleNamespace(deps=chain.GraphDeps(1), state=chain.GraphState())
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(node.run(ctx))
+    assert failing_publisher == [1, 2]
@@ -0,0 +1,68 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import numpy as np
+import pytest
+
+from internal.conf import Config
+from internal.semantic_cache import SemanticCurationCache
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    conf = Config()
+    monkeypatch.setattr(conf, "SEMANTIC_CACHE_SIZE", 4)
+    monkeypatch.setattr(conf, "SEMANTIC_CACHE_SIMILARITY", 0.9)
+    monkeypatch.setattr(conf, "SEMANTIC_CACHE_TTL", 600)
+    monkeypatch.setattr(SemanticCurationCache, "_embeddings", None)
+
+
+def embedding(*values: float) -> np.ndarray:
+    return np.array([*values, 0, 0, 0, 0][:4], dtype=np.float32)
+
+
+def test_lookup_returns_the_most_similar_curation():
+    SemanticCurationCache.store(embedding(1, 0.3), "near", "p1", [1])
+    SemanticCurationCache.store(embedding(1), "nearest", "p2", [2])
+
+    assert SemanticCurationCache.lookup(embedding(1)).query == "nearest"
+
+
+def test_lookup_misses_outside_of_the_radius():
+    SemanticCurationCache.store(embedding(0, 1), "other", "p1", [1])
+
+    assert SemanticCurationCache.lookup(embedding(1)) is None
+
+
+def test_lookup_skips_curations_without_new_tracks():
+    SemanticCurationCache.store(embedding(1, 0.3), "near", "p1", [3])
+    SemanticCurationCache.store(embedding(1), "nearest", "p2", [1, 2])
+
+    assert SemanticCurationCache.lookup(embedding(1), exclude={1}).query == "nearest"
+    assert SemanticCurationCache.lookup(embedding(1), exclude={1, 2}).query == "near"
+    assert SemanticCurationCache.lookup(embedding(1), exclude={1, 2, 3}) is None
+
+
+def test_oldest_curation_is_overwritten_once_full():
+    for i in range(5):
+        SemanticCurationCache.store(embedding(1, i * 0.01), f"q{i}", "p", [i])
+
+    queries = {entry.query for entry in SemanticCurationCache._entries}
+    assert queries == {"q1", "q2", "q3", "q4"}
@@ -0,0 +1,93 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import pytest
+
+from internal import sharding
+from internal.sharding import MISSED_HEARTBEATS, ShardTopology, WorkerMembership, shard_owner
+
+SHARDS = range(64)
+
+
+def owners(workers: list[str]) -> dict[int, str]:
+    return {shard: shard_owner(shard, workers) for shard in SHARDS}
+
+
+def test_owner_does_not_depend_on_the_order_of_the_workers():
+    assert owners(["a", "b", "c"]) == owners(["c", "a", "b"])
+
+
+def test_every_worker_owns_some_shards():
+    assert set(owners(["a", "b", "c", "d"]).values()) == {"a", "b", "c", "d"}
+
+
+def test_joining_worker_only_takes_over_shards():
+    before = owners(["a", "b", "c"])
+    after = owners(["a", "b", "c", "d"])
+
+    moved = {shard for shard in SHARDS if before[shard] != after[shard]}
+    assert moved
+    assert all(after[shard] == "d" for shard in moved)
+
+
+def test_leaving_worker_only_hands_over_its_own_shards():
+    before = owners(["a", "b", "c", "d"])
+    after = owners(["a", "b", "c"])
+
+    moved = {shard for shard in SHARDS if before[shard] != after[shard]}
+    assert moved == {shard for shard in SHARDS if before[shard] == "d"}
+
+
+def test_owned_shards_partition_the_queues():
+    topology = ShardTopology(exchange=None, queues={f"acura.shard.{shard}": None for shard in SHARDS})
+    workers = ["a", "b", "c"]
+
+    owned = [topology.owned(workers, worker) for worker in workers]
+    assert set().union(*owned) == set(topology.queues)
+    assert sum(map(len, owned)) == len(topology.queues)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sharding.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_expire_forgets_workers_which_missed_their_heartbeats(clock):
+    membership = WorkerMembership(interval=5, worker_id="self")
+    membership._seen = {"gone": clock[0], "alive": clock[0] + 10}
+    clock[0] += 5 * MISSED_HEARTBEATS + 1
+
+    membership._expire()
+
+    assert membership.workers() == ["alive", "self"]
+    assert membership.changed.is_set()
+
+
+def test_expire_keeps_workers_within_the_missed_heartbeats(clock):
+    membership = WorkerMembership(interval=5, worker_id="self")
+    membership._seen = {"late": clock[0]}
+    clock[0] += 5 * MISSED_HEARTBEATS - 1
+
+    membership._expire()
+
+    assert membership.workers() == ["late", "self"]
+    assert not membership.changed.is_set()
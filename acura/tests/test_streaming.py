@@ -0,0 +1,92 @@
+"""
+EngineQ: An AI-enabled music management system.
+Copyright (C) 2025  Mikayel Grigoryan
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+For inquiries, contact: michael.grigoryan25@gmail.com
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from internal import streaming
+from internal.chain import GraphDeps, SearchAndVerifyYoutubeAndSaveNode
+from internal.streaming import CurationJob, StreamingPipeline
+
+N_TRACKS = 10
+
+
+@pytest.fixture
+def playlist(monkeypatch):
+    async def create_or_get_playlist(sid):
+        return SimpleNamespace(id=10)
+
+    async def stream_tracks(self):
+        for i in range(N_TRACKS):
+            yield SimpleNamespace(name=f"track {i}", artist="artist")
+
+    monkeypatch.setattr(streaming.PlaylistsDAO, "create_or_get_playlist", create_or_get_playlist)
+    monkeypatch.setattr(SearchAndVerifyYoutubeAndSaveNode, "stream_tracks", stream_tracks)
+
+
+def test_matched_playlist_does_not_hold_up_the_routing_worker(playlist):
+    async def main():
+        pipeline = StreamingPipeline(max_jobs=2, queue_size=1, workers={"verification": 1})
+        verified = []
+        unblocked = asyncio.Event()
+
+        async def verify_track(work):
+            await unblocked.wait()
+            verified.append(work.track.name)
+            await work.job.track_done()
+
+        pipeline.stages["verification"].handler = verify_track
+        pipeline.start()
+        try:
+            job = CurationJob(GraphDeps(1), asyncio.get_running_loop().create_future())
+            # Returns while the verification stage is saturated
+            await asyncio.wait_for(
+                pipeline._route(job, SearchAndVerifyYoutubeAndSaveNode(spotify_playlist_id="p")), 1)
+            assert not job.is_finished()
+
+            unblocked.set()
+            assert await asyncio.wait_for(job.done, 1) == 0
+            assert len(verified) == N_TRACKS
+        finally:
+            await pipeline.stop()
+
+    asyncio.run(main())
+
+
+def test_abandoned_job_stops_reading_the_playlist(playlist):
+    async def main():
+        pipeline = StreamingPipeline(max_jobs=2, queue_size=1, workers={"verification": 1})
+        pipeline.stages["verification"].handler = lambda work: asyncio.Event().wait()
+        pipeline.start()
+        try:
+            job = CurationJob(GraphDeps(1), asyncio.get_running_loop().create_future())
+            await pipeline._route(job, SearchAndVerifyYoutubeAndSaveNode(spotify_playlist_id="p"))
+            await asyncio.sleep(0.01)
+            assert pipeline._producers
+
+            job.abandon()
+            await asyncio.sleep(0.01)
+            assert not pipeline._producers
+        finally:
+            await pipeline.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,16 @@
+-- migrate:up
+CREATE TABLE curation_checkpoints (
+    key TEXT NOT NULL,
+    sid INT NOT NULL,
+    node TEXT NOT NULL,
+    node_data JSONB NOT NULL,
+    state JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT curation_checkpoints_pkey PRIMARY KEY (key),
+    CONSTRAINT curation_checkpoints_sid_fkey FOREIGN KEY (sid) REFERENCES subscribers(id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_curation_checkpoints_updated_at ON curation_checkpoints (updated_at);
+
+-- migrate:down
+DROP TABLE curation_checkpoints;
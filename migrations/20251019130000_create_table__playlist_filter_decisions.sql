@@ -0,0 +1,14 @@
+-- migrate:up
+CREATE TABLE playlist_filter_decisions (
+    spotify_playlist_id TEXT NOT NULL,
+    query_key TEXT NOT NULL,
+    playlist_digest TEXT NOT NULL,
+    matches BOOLEAN NOT NULL,
+    decided_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CONSTRAINT playlist_filter_decisions_pkey PRIMARY KEY (spotify_playlist_id, query_key)
+);
+
+CREATE INDEX idx_playlist_filter_decisions_decided_at ON playlist_filter_decisions (decided_at);
+
+-- migrate:down
+DROP TABLE playlist_filter_decisions;
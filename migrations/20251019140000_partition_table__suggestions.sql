@@ -0,0 +1,171 @@
+-- migrate:up
+-- Range-partitions `suggestions` by month of `added_at`, so that recent-history
+-- lookups only touch the latest partitions and old suggestions can be dropped
+-- a whole partition at a time (see `maintain_suggestions_partitions`).
+--
+-- The primary key of a partitioned table must include the partition key, so it
+-- becomes (id, added_at) and `playback.suggestion_id` can no longer reference
+-- `suggestions (id)`. The retention job clears playback references to the
+-- partitions it removes instead.
+--
+-- Existing rows are copied into the new table, which holds a lock on
+-- `suggestions` for the duration of the copy.
+
+ALTER TABLE playback DROP CONSTRAINT playback_suggestion_id_fkey;
+
+ALTER TABLE suggestions RENAME TO suggestions_unpartitioned;
+ALTER TABLE suggestions_unpartitioned RENAME CONSTRAINT suggestions_pkey TO suggestions_unpartitioned_pkey;
+ALTER TABLE suggestions_unpartitioned RENAME CONSTRAINT suggestions_pid_fkey TO suggestions_unpartitioned_pid_fkey;
+ALTER TABLE suggestions_unpartitioned RENAME CONSTRAINT suggestions_tid_fkey TO suggestions_unpartitioned_tid_fkey;
+
+CREATE TABLE suggestions (
+    pid INT NOT NULL,
+    tid INT NOT NULL,
+    added_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    CONSTRAINT suggestions_pkey PRIMARY KEY (id, added_at),
+    CONSTRAINT suggestions_pid_fkey FOREIGN KEY (pid) REFERENCES playlists(id) ON DELETE CASCADE,
+    CONSTRAINT suggestions_tid_fkey FOREIGN KEY (tid) REFERENCES tracks(id) ON DELETE CASCADE
+) PARTITION BY RANGE (added_at);
+
+CREATE INDEX idx_suggestions_pid_added_at ON suggestions (pid, added_at);
+
+-- Catches rows outside of the monthly partitions, e.g. when the retention job
+-- has not created the upcoming partitions in time.
+CREATE TABLE suggestions_default PARTITION OF suggestions DEFAULT;
+
+-- Creates the partition of the month (in UTC) which contains `at`, unless it
+-- exists already. Rows of that month in the default partition would make
+-- creating the partition fail, so they are moved into it.
+CREATE FUNCTION create_suggestions_partition(at TIMESTAMPTZ) RETURNS VOID AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', at AT TIME ZONE 'UTC');
+    lower_bound TIMESTAMPTZ := month_start AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMPTZ := (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC';
+    partition_name TEXT := 'suggestions_p' || to_char(month_start, 'YYYYMM');
+BEGIN
+    IF to_regclass(format('%I', partition_name)) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    -- Keeps new rows of the month from landing in the default partition
+    -- while the partition is created.
+    LOCK TABLE suggestions_default IN EXCLUSIVE MODE;
+    CREATE TEMP TABLE suggestions_moved (LIKE suggestions) ON COMMIT DROP;
+    WITH moved AS (
+        DELETE FROM suggestions_default
+        WHERE added_at >= lower_bound AND added_at < upper_bound
+        RETURNING pid, tid, added_at, id
+    )
+    INSERT INTO suggestions_moved (pid, tid, added_at, id) SELECT pid, tid, added_at, id FROM moved;
+
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF suggestions FOR VALUES FROM (%L) TO (%L)',
+        partition_name, lower_bound, upper_bound);
+
+    INSERT INTO suggestions (pid, tid, added_at, id) SELECT pid, tid, added_at, id FROM suggestions_moved;
+    DROP TABLE suggestions_moved;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Creates the partitions of the current and the next `premake` months, and
+-- removes the partitions whose rows are all older than `retention`: they are
+-- detached and dropped, or only detached (and kept as standalone tables) when
+-- `drop_detached` is false. Returns the number of removed partitions. Safe to
+-- call concurrently from several workers.
+CREATE FUNCTION maintain_suggestions_partitions(
+    retention INTERVAL, drop_detached BOOLEAN DEFAULT true, premake INT DEFAULT 2) RETURNS INT AS $$
+DECLARE
+    partition_name TEXT;
+    n_removed INT := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('maintain_suggestions_partitions'));
+
+    FOR i IN 0..premake LOOP
+        PERFORM create_suggestions_partition(now() + make_interval(months => i));
+    END LOOP;
+
+    IF retention IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'suggestions'::regclass
+          AND c.relname ~ '^suggestions_p\d{6}$'
+          -- The partition's upper bound, in UTC like the partition names
+          AND to_date(substring(c.relname FROM '\d{6}$'), 'YYYYMM') + INTERVAL '1 month'
+              <= (now() - retention) AT TIME ZONE 'UTC'
+    LOOP
+        EXECUTE format(
+            'UPDATE playback SET suggestion_id = NULL WHERE suggestion_id IN (SELECT id FROM %I)', partition_name);
+        EXECUTE format('ALTER TABLE suggestions DETACH PARTITION %I', partition_name);
+        IF drop_detached THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+        END IF;
+        n_removed := n_removed + 1;
+    END LOOP;
+
+    UPDATE playback SET suggestion_id = NULL
+    WHERE suggestion_id IN (SELECT id FROM suggestions_default WHERE added_at < now() - retention);
+    DELETE FROM suggestions_default WHERE added_at < now() - retention;
+
+    RETURN n_removed;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    month TIMESTAMPTZ;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE(min(added_at), now()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+            now(),
+            INTERVAL '1 month')
+        FROM suggestions_unpartitioned
+    LOOP
+        PERFORM create_suggestions_partition(month);
+    END LOOP;
+END;
+$$;
+SELECT maintain_suggestions_partitions(NULL);
+
+INSERT INTO suggestions (pid, tid, added_at, id)
+SELECT pid, tid, COALESCE(added_at, now()), id FROM suggestions_unpartitioned;
+
+DROP TABLE suggestions_unpartitioned;
+
+-- migrate:down
+DROP FUNCTION maintain_suggestions_partitions(INTERVAL, BOOLEAN, INT);
+DROP FUNCTION create_suggestions_partition(TIMESTAMPTZ);
+
+ALTER TABLE suggestions RENAME TO suggestions_partitioned;
+ALTER TABLE suggestions_partitioned RENAME CONSTRAINT suggestions_pkey TO suggestions_partitioned_pkey;
+ALTER TABLE suggestions_partitioned RENAME CONSTRAINT suggestions_pid_fkey TO suggestions_partitioned_pid_fkey;
+ALTER TABLE suggestions_partitioned RENAME CONSTRAINT suggestions_tid_fkey TO suggestions_partitioned_tid_fkey;
+
+CREATE TABLE suggestions (
+    pid INT NOT NULL,
+    tid INT NOT NULL,
+    added_at TIMESTAMPTZ DEFAULT now(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    CONSTRAINT suggestions_pkey PRIMARY KEY (id),
+    CONSTRAINT suggestions_pid_fkey FOREIGN KEY (pid) REFERENCES playlists(id) ON DELETE CASCADE,
+    CONSTRAINT suggestions_tid_fkey FOREIGN KEY (tid) REFERENCES tracks(id) ON DELETE CASCADE
+);
+
+INSERT INTO suggestions (pid, tid, added_at, id)
+SELECT pid, tid, added_at, id FROM suggestions_partitioned;
+
+-- Partitions which were detached by the retention job are not restored
+DROP TABLE suggestions_partitioned;
+
+UPDATE playback SET suggestion_id = NULL
+WHERE suggestion_id IS NOT NULL AND suggestion_id NOT IN (SELECT id FROM suggestions);
+
+ALTER TABLE playback
+ADD CONSTRAINT playback_suggestion_id_fkey
+FOREIGN KEY (suggestion_id) REFERENCES suggestions(id) ON DELETE CASCADE;
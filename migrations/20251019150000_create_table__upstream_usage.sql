@@ -0,0 +1,25 @@
+-- migrate:up
+-- Upstream calls and tokens per hour, subscriber, pipeline node and upstream
+-- (llm, openai, spotify, brave), flushed in batches by every worker. `sid` is
+-- NULL for calls made on behalf of several subscribers at once (e.g. batched
+-- query generation), and `node` for calls made outside of a pipeline node.
+-- There is no foreign key on `sid`, so that the spend of deleted subscribers
+-- stays in the totals.
+CREATE TABLE upstream_usage (
+    id BIGINT GENERATED ALWAYS AS IDENTITY,
+    period_start TIMESTAMPTZ NOT NULL,
+    sid INT,
+    node TEXT,
+    upstream TEXT NOT NULL,
+    calls BIGINT NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    CONSTRAINT upstream_usage_pkey PRIMARY KEY (id),
+    CONSTRAINT upstream_usage_period_start_sid_node_upstream_key
+        UNIQUE NULLS NOT DISTINCT (period_start, sid, node, upstream)
+);
+
+CREATE INDEX idx_upstream_usage_sid_period_start ON upstream_usage (sid, period_start);
+
+-- migrate:down
+DROP TABLE upstream_usage;
@@ -15,6 +15,7 @@
 // along with this program.  If not, see <https://www.gnu.org/licenses/>.
 // 
 // For inquiries, contact: michael.grigoryan25@gmail.com
+import { randomUUID } from "crypto";
 import { NextRequest, NextResponse } from "next/server";
 import amqplib from "amqplib";
 import { sql } from "@/src/lib/sql";
@@ -22,6 +23,17 @@ import { sql } from "@/src/lib/sql";
 let mq: amqplib.ChannelModel | null = null;
 let ch: amqplib.Channel | null = null;
 
+// Must match `URGENCY_PRIORITIES` in acura/internal/priority.py
+const URGENCY_PRIORITIES = { low: 0, normal: 1, high: 2, critical: 3 };
+type Urgency = keyof typeof URGENCY_PRIORITIES;
+
+// The fewer tracks a listener has left, the sooner their refill is curated
+function urgencyOf(remaining: number): Urgency {
+  if (remaining <= 2) return "critical";
+  if (remaining <= 5) return "high";
+  return "normal";
+}
+
 async function getRemainingSuggestionsCount(lck: string) {
   // Get subscriber ID, today's playlist, and playback info in a single query
   const userInfo = await sql`
@@ -71,7 +83,7 @@ export async function GET(request: NextRequest) {
   if (!mq) mq = await amqplib.connect(process.env.AMQP_URL!);
   if (!ch) {
     ch = await mq.createChannel();
-    await ch.assertQueue("acura");
+    await ch.assertQueue("acura", { maxPriority: URGENCY_PRIORITIES.critical });
   }
 
   const lck = request.cookies.get("lck")!.value;
@@ -105,11 +117,14 @@ ORDER BY sug.added_at ASC;
 
   const countOfSuggestions = await getRemainingSuggestionsCount(lck);
   if (countOfSuggestions <= 10) {
+    const urgency = urgencyOf(countOfSuggestions);
     ch.sendToQueue(
       "acura",
       Buffer.from(
-        JSON.stringify({ license: request.cookies.get("lck")?.value })
-      )
+        JSON.stringify({ license: request.cookies.get("lck")?.value, urgency })
+      ),
+      // Lets the curation resume from its checkpoint when it is redelivered
+      { messageId: randomUUID(), priority: URGENCY_PRIORITIES[urgency] }
     );
   }
 